@@ -1,233 +1,3699 @@
 #!/usr/bin/env python3
 """AnsiblePower — Lightweight web interface for managing Ansible playbooks."""
 import os
+import copy
+import cProfile
 import json
 import sqlite3
 import shutil
 import subprocess
 import psutil
 import csv
+import uuid
+import zlib
+import queue
+import gzip
+import hashlib
+import hmac
+import html
 import logging
-from datetime import datetime
-from io import StringIO
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, Blueprint
+import logging.handlers
+import re
+import shlex
+import fnmatch
+import time
+import atexit
+import bisect
+import contextlib
+import itertools
+import math
+import threading
+import tempfile
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from io import StringIO, TextIOWrapper
+from flask import (Flask, render_template, request, jsonify, session, redirect, url_for, Response, Blueprint, g,
+                   send_file, before_render_template, template_rendered)
 from flask_wtf.csrf import CSRFProtect
 
+try:
+    import fcntl
+except ImportError:  # Windows: log rotation is then only safe with a single process
+    fcntl = None
+
+try:
+    import yaml
+except ImportError:  # YAML inventories then cannot be parsed, INI still works
+    yaml = None
+
+# =============================================================================
+# Metrics: counters and histograms in Prometheus text format. Every process
+# keeps its own values and periodically writes them to a file of its own under
+# data/metrics/; /metrics adds up the files of all Gunicorn workers.
+# =============================================================================
+METRICS_WRITE_INTERVAL = 5.0
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+RUN_DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# name: (type, help, histogram buckets)
+METRIC_DEFINITIONS = {
+    "ansiblepower_http_requests_total": (
+        "counter", "HTTP requests by endpoint, method and status.", None),
+    "ansiblepower_http_request_duration_seconds": (
+        "histogram", "HTTP request latency by endpoint and method.", LATENCY_BUCKETS),
+    "ansiblepower_playbook_runs_total": (
+        "counter", "Finished playbook runs by outcome.", None),
+    "ansiblepower_playbook_run_duration_seconds": (
+        "histogram", "Wall time of finished playbook runs by outcome.", RUN_DURATION_BUCKETS),
+    "ansiblepower_phase_duration_seconds": (
+        "histogram", "Time spent in instrumented phases such as SQLite statements and log writes.",
+        PHASE_BUCKETS),
+}
+
+
+def get_metrics_dir():
+    """Directory of the per-process metrics files, next to the history database."""
+    return os.path.join(os.path.dirname(get_history_db_file()), "metrics")
+
+
+class MetricsRegistry:
+    """This process's counters and histograms, shared with other workers through files.
+
+    Values live in memory; write() saves them to <metrics dir>/<pid>-<id>.json
+    at most every METRICS_WRITE_INTERVAL seconds. collect() folds the files
+    of processes that have exited into one archive, so counters never go
+    backwards when a worker is replaced, and adds everything up.
+    """
+
+    def __init__(self):
+        self._last_write = 0.0
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            # A forked worker starts from zero instead of repeating its parent's counts.
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # Writers share one temporary file name, so they take turns.
+        self._write_lock = threading.Lock()
+        self._values = {}
+        self._filename = "%d-%s.json" % (os.getpid(), uuid.uuid4().hex[:8])
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum.
+                series = self._values[key] = [0] * (len(METRIC_DEFINITIONS[name][2]) + 1) + [0.0]
+            series[bisect.bisect_left(METRIC_DEFINITIONS[name][2], value)] += 1
+            series[-1] += value
+
+    def write(self, force=False):
+        """Save this process's values to its file; skipped if done recently unless force."""
+        now = time.monotonic()
+        if not force and now - self._last_write < METRICS_WRITE_INTERVAL:
+            return
+        with self._write_lock:
+            with self._lock:
+                self._last_write = now
+                snapshot = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+                filename = self._filename
+            metrics_dir = get_metrics_dir()
+            os.makedirs(metrics_dir, exist_ok=True)
+            path = os.path.join(metrics_dir, filename)
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _merge(totals, snapshot):
+        for name, labels, value in snapshot:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if name not in METRIC_DEFINITIONS:
+                continue
+            if isinstance(value, list):
+                current = totals.get(key)
+                if current is None or len(current) != len(value):
+                    totals[key] = list(value)
+                else:
+                    totals[key] = [a + b for a, b in zip(current, value)]
+            else:
+                totals[key] = totals.get(key, 0) + value
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def collect(self):
+        """Return the values of all processes, as {(name, labels): value}."""
+        self.write(force=True)
+        metrics_dir = get_metrics_dir()
+        archive_path = os.path.join(metrics_dir, "archive.json")
+        totals = {}
+        with open(os.path.join(metrics_dir, ".lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                archive = {}
+                self._merge(archive, self._load(archive_path))
+                exited = []
+                for name in os.listdir(metrics_dir):
+                    if not name.endswith(".json") or name == "archive.json":
+                        continue
+                    path = os.path.join(metrics_dir, name)
+                    pid = name.split("-", 1)[0]
+                    if pid.isdigit() and not psutil.pid_exists(int(pid)):
+                        self._merge(archive, self._load(path))
+                        exited.append(path)
+                    else:
+                        self._merge(totals, self._load(path))
+                if exited:
+                    with open(archive_path + ".tmp", "w") as f:
+                        json.dump([[name, list(labels), value]
+                                   for (name, labels), value in archive.items()], f)
+                    os.replace(archive_path + ".tmp", archive_path)
+                    for path in exited:
+                        os.remove(path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        self._merge(totals, [[name, labels, value] for (name, labels), value in archive.items()])
+        return totals
+
+
+metrics = MetricsRegistry()
+
+
+_phase_labels = {}
+# phases: {phase: [seconds, calls]} of the request being profiled on this thread, else unset.
+_profile_local = threading.local()
+
+
+def _record_phase(phase, seconds):
+    labels = _phase_labels.get(phase)
+    if labels is None:
+        labels = _phase_labels[phase] = (("phase", phase),)
+    metrics.observe("ansiblepower_phase_duration_seconds", seconds, labels)
+    phases = getattr(_profile_local, "phases", None)
+    if phases is not None:
+        entry = phases.get(phase)
+        if entry is None:
+            phases[phase] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+class _PhaseTimer:
+    __slots__ = ("phase", "start")
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record_phase(self.phase, time.perf_counter() - self.start)
+        return False
+
+
+def _observe_phase(phase):
+    """Context manager that records the time spent in its body as a phase."""
+    return _PhaseTimer(phase)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\")
+                                          .replace('"', '\\"').replace("\n", "\\n"))
+                             for key, value in labels)
+
+
+def format_metrics(values, gauges=()):
+    """Render collected values and (name, help, [(labels, value)]) gauges in text format."""
+    by_name = {}
+    for (name, labels), value in values.items():
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text, buckets = METRIC_DEFINITIONS[name]
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in sorted(by_name[name]):
+            if kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    lines.append("%s_bucket%s %d" % (name, _format_labels(labels + (("le", bound),)),
+                                                     cumulative))
+                lines.append("%s_sum%s %r" % (name, _format_labels(labels), float(value[-1])))
+                lines.append("%s_count%s %d" % (name, _format_labels(labels), cumulative))
+            else:
+                lines.append("%s%s %r" % (name, _format_labels(labels), float(value)))
+    for name, help_text, samples in gauges:
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s gauge" % name)
+        for labels, value in samples:
+            lines.append("%s%s %r" % (name, _format_labels(labels), float(value)))
+    return "\n".join(lines) + "\n"
+
+
 # =============================================================================
-# Custom Logging Handler: Keeps a maximum of 200 lines with newest messages at the top.
+# Custom Logging Handler: append-only log segments, read newest first.
 # =============================================================================
+LOG_RECORD_START = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+
+
 class CustomRotatingLogHandler(logging.Handler):
-    def __init__(self, filename, max_lines=200):
+    """Append-only log file that rotates into a single older segment.
+
+    Every record is one O_APPEND write, so a log call costs the same no matter
+    how large the file is, and concurrent Gunicorn workers never overwrite
+    each other's lines. Once the active file grows past max_bytes it is
+    renamed to <filename>.1 (under a lock shared by all processes) and a new
+    segment is started. read_recent() returns the newest max_lines records.
+    """
+
+    def __init__(self, filename, max_lines=200, max_bytes=256 * 1024):
         super().__init__()
         self.filename = filename
         self.max_lines = max_lines
+        self.max_bytes = max_bytes
         log_dir = os.path.dirname(filename)
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
-        if not os.path.exists(filename):
-            with open(filename, "w") as f:
-                f.write("")
+        self._fd = None
+        self._inode = None
+        self._open()
+
+    def _open(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+
+    def _reopen_if_rotated(self):
+        # Another process may have rotated the file since our last write.
+        try:
+            if os.stat(self.filename).st_ino == self._inode:
+                return
+        except FileNotFoundError:
+            pass
+        self._open()
+
+    def _rotate(self):
+        with open(self.filename + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                st = os.stat(self.filename)
+                # Skip if a concurrent writer already rotated this segment.
+                if st.st_ino == self._inode and st.st_size >= self.max_bytes:
+                    os.replace(self.filename, self.filename + ".1")
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        self._open()
+
+    def emit(self, record):
+        try:
+            with _observe_phase("log_emit"):
+                data = (self.format(record) + "\n").encode("utf-8")
+                self.acquire()
+                try:
+                    self._reopen_if_rotated()
+                    os.write(self._fd, data)
+                    if os.fstat(self._fd).st_size >= self.max_bytes:
+                        self._rotate()
+                finally:
+                    self.release()
+        except Exception:
+            self.handleError(record)
+
+    def read_recent(self, limit=None):
+        """Return up to limit log records (default max_lines), newest first.
+
+        Multi-line records such as tracebacks are kept together.
+        """
+        limit = self.max_lines if limit is None else limit
+        records = []
+        for path in (self.filename, self.filename + ".1"):
+            try:
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    lines = f.read().splitlines()
+            except FileNotFoundError:
+                continue
+            current = []
+            for line in reversed(lines):
+                current.append(line)
+                if LOG_RECORD_START.match(line):
+                    records.append("\n".join(reversed(current)))
+                    current = []
+                    if len(records) >= limit:
+                        return records
+        return records
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+        finally:
+            self.release()
+        super().close()
+
+
+# =============================================================================
+# Configuration Variables
+# =============================================================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.environ.get("ANSIBLEPOWER_LOG_DIR") or os.path.join(BASE_DIR, "logs")
+
+logger = logging.getLogger("ansiblePower")
+logger.setLevel(logging.INFO)
+log_handler = CustomRotatingLogHandler(os.path.join(LOG_DIR, "app.log"), max_lines=200)
+formatter = logging.Formatter("%(asctime)s %(levelname)s: %(message)s")
+log_handler.setFormatter(formatter)
+if os.environ.get("ANSIBLEPOWER_LOG_QUEUE", "false").lower() == "true":
+    # Request threads only enqueue records; a listener thread does the file I/O.
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+else:
+    logger.addHandler(log_handler)
+# ANSIBLEPOWER_DATA_DIR moves config, inventory and history out of the checkout.
+DATA_DIR = os.environ.get("ANSIBLEPOWER_DATA_DIR") or os.path.join(BASE_DIR, "data")
+CONFIG_FILE = os.path.join(DATA_DIR, "config.json")
+DEFAULT_PLAYBOOKS_DIR = os.path.join(BASE_DIR, "playbooks")
+HOSTS_FILE = os.path.join(DATA_DIR, "hosts")
+HISTORY_FILE = os.path.join(DATA_DIR, "history.json")
+PLAYBOOK_TIMEOUT = 3600
+OUTPUT_FLUSH_INTERVAL = 0.25
+OUTPUT_FLUSH_BYTES = 64 * 1024
+STREAM_POLL_INTERVAL = 0.2
+STREAM_KEEPALIVE_INTERVAL = 15
+RESOURCE_SAMPLE_INTERVAL = 0.5
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_JOB_QUEUE_SIZE = 100
+HISTORY_DB_BUSY_TIMEOUT_MS = 5000
+OUTPUT_COMPRESSION_LEVEL = 6
+
+# Resolve ansible-playbook: prefer the venv binary, then system PATH, then env override
+def _find_ansible_playbook():
+    # 1. Respect explicit environment override
+    env_override = os.environ.get("ANSIBLE_PLAYBOOK_BIN")
+    if env_override:
+        return env_override
+    # 2. Check venv next to this file (most common dev setup)
+    venv_bin = os.path.join(BASE_DIR, "venv", "bin", "ansible-playbook")
+    if os.path.isfile(venv_bin):
+        return venv_bin
+    # 3. Fall back to whatever is on PATH
+    system_bin = shutil.which("ansible-playbook")
+    if system_bin:
+        return system_bin
+    return "ansible-playbook"  # will raise a clear error at runtime
+
+ANSIBLE_PLAYBOOK = _find_ansible_playbook()
+app = Flask(__name__)
+app.secret_key = os.environ.get("FLASK_SECRET_KEY", os.urandom(24).hex())
+
+csrf = CSRFProtect(app)
+
+class ConfigCache:
+    """In-process cache of the parsed config file.
+
+    The file is only re-parsed when its mtime, inode or size changes, so the
+    hot path costs a single stat(). save_config() replaces the file
+    atomically, which gives it a new inode, and also invalidates the cache
+    for writes made by this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._config = None
+
+    def get(self):
+        """Return the current config. The dict is shared: do not mutate it."""
+        with _observe_phase("config"):
+            return self._get()
+
+    def _get(self):
+        path = CONFIG_FILE
+        try:
+            st = os.stat(path)
+        except OSError:
+            return {"playbooks_dir": DEFAULT_PLAYBOOKS_DIR}
+        signature = (path, st.st_mtime_ns, st.st_ino, st.st_size)
+        config = self._config
+        if signature == self._signature:
+            return config
+        with self._lock:
+            if signature != self._signature:
+                self._config = self._load(path)
+                self._signature = signature
+            return self._config
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+            self._config = None
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error("Error loading config: %s", e)
+            return {"playbooks_dir": DEFAULT_PLAYBOOKS_DIR}
+
+
+config_cache = ConfigCache()
+
+
+def load_config():
+    """Return a private copy of the config that callers may modify and save."""
+    return copy.deepcopy(config_cache.get())
+
+def save_config(config):
+    # Write to a temporary file and rename it over the config, so other
+    # workers never observe a half-written file.
+    tmp_file = "%s.%d.%d.tmp" % (CONFIG_FILE, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(config, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, CONFIG_FILE)
+    except Exception as e:
+        logger.error("Error saving config: %s", e)
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+    finally:
+        config_cache.invalidate()
+
+def get_playbooks_dir():
+    return config_cache.get().get("playbooks_dir", DEFAULT_PLAYBOOKS_DIR)
+
+def get_hosts_file():
+    return config_cache.get().get("hosts_file", HOSTS_FILE)
+
+def get_history_db_file():
+    """Return the SQLite database path for playbook history."""
+    return os.path.splitext(HISTORY_FILE)[0] + ".db"
+
+
+_history_db_local = threading.local()
+_history_db_schema_lock = threading.Lock()
+
+
+def _history_db_identity(path):
+    try:
+        st = os.stat(path)
+        return (st.st_dev, st.st_ino)
+    except OSError:
+        return None
+
+
+def _configure_history_connection(conn):
+    """Apply per-connection pragmas tuned for a shared, write-light database."""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # only takes effect on new databases
+    conn.execute("PRAGMA busy_timeout = %d" % HISTORY_DB_BUSY_TIMEOUT_MS)
+    conn.execute("PRAGMA journal_mode = WAL")    # readers never block the writer
+    conn.execute("PRAGMA synchronous = NORMAL")  # durable enough with WAL, far fewer fsyncs
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -8000")    # 8 MB page cache per connection
+    conn.create_function("decode_output", 2, _decode_output, deterministic=True)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records time spent executing and fetching as the "sqlite" phase.
+
+    Iterating the cursor directly adds up the time of each row and records it
+    as one observation once the rows are exhausted; a loop left early does
+    not record its iteration time.
+    """
+
+    _iterated = 0.0
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            _record_phase("sqlite", self._iterated + time.perf_counter() - start)
+            self._iterated = 0.0
+            raise
+        self._iterated += time.perf_counter() - start
+        return row
+
+    def execute(self, sql, parameters=()):
+        with _observe_phase("sqlite"):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with _observe_phase("sqlite"):
+            return super().executemany(sql, seq_of_parameters)
+
+    def fetchone(self):
+        with _observe_phase("sqlite"):
+            return super().fetchone()
+
+    def fetchall(self):
+        with _observe_phase("sqlite"):
+            return super().fetchall()
+
+    def fetchmany(self, size=None):
+        with _observe_phase("sqlite"):
+            return super().fetchmany(self.arraysize if size is None else size)
+
+
+class TimedConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        return self.cursor(TimedCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor(TimedCursor).executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        with _observe_phase("sqlite"):
+            return super().commit()
+
+
+def _open_history_connection(history_db_file):
+    conn = sqlite3.connect(history_db_file, timeout=HISTORY_DB_BUSY_TIMEOUT_MS / 1000,
+                           factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    try:
+        _configure_history_connection(conn)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def get_history_db_connection():
+    """Return this thread's SQLite connection for history storage.
+
+    Connections are opened once per thread and reused. A new one is opened
+    after a fork or when the database file has been replaced. Pending schema
+    migrations are checked when a connection is opened, never per query.
+    """
+    history_db_file = get_history_db_file()
+    key = (os.getpid(), history_db_file, _history_db_identity(history_db_file))
+    cached = getattr(_history_db_local, "connection", None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    if cached is not None and cached[0][0] == os.getpid():
+        cached[1].close()
+    _history_db_local.connection = None
+    _history_db_local.search_enabled = None
+
+    history_dir = os.path.dirname(history_db_file)
+    if history_dir and not os.path.exists(history_dir):
+        os.makedirs(history_dir)
+
+    conn = _open_history_connection(history_db_file)
+    try:
+        with _history_db_schema_lock:
+            _apply_history_migrations(conn)
+    except Exception:
+        conn.close()
+        raise
+    identity = _history_db_identity(history_db_file)
+    _history_db_local.connection = ((os.getpid(), history_db_file, identity), conn)
+    return conn
+
+
+def _history_records_to_rows(history):
+    """Convert history dictionaries to SQLite insert rows."""
+    return [
+        (
+            record.get("action", ""),
+            record.get("playbook", ""),
+            record.get("output", ""),
+            record.get("time", "")
+        )
+        for record in history
+        if isinstance(record, dict)
+    ]
+
+
+def _migrate_history_v1(conn):
+    """Create the run and job tables and import a legacy history.json."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS playbook_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT NOT NULL,
+            playbook TEXT NOT NULL,
+            output TEXT NOT NULL,
+            time TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS playbook_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            playbook TEXT NOT NULL,
+            priority TEXT NOT NULL,
+            status TEXT NOT NULL,
+            options TEXT NOT NULL DEFAULT '{}',
+            worker TEXT,
+            run_id INTEGER,
+            error TEXT,
+            submitted_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_playbook_jobs_status
+        ON playbook_jobs (status, submitted_at)
+    """)
+
+    row_count = conn.execute(
+        "SELECT COUNT(*) FROM playbook_runs"
+    ).fetchone()[0]
+
+    if row_count == 0 and os.path.exists(HISTORY_FILE):
+        try:
+            with open(HISTORY_FILE, "r") as f:
+                history = json.load(f)
+
+            if isinstance(history, list):
+                conn.executemany("""
+                    INSERT INTO playbook_runs
+                    (action, playbook, output, time)
+                    VALUES (?, ?, ?, ?)
+                """, _history_records_to_rows(history))
+                logger.info("Migrated existing history.json records to SQLite")
+        except Exception as e:
+            logger.error("Error migrating history.json to SQLite: %s", e)
+
+
+def _decode_output(codec, data):
+    """Turn a stored output blob back into text (also exposed to SQL)."""
+    if codec is None or data is None:
+        return None
+    if codec == "zlib":
+        data = zlib.decompress(data)
+    elif codec != "raw":
+        raise ValueError("Unknown output codec: %s" % codec)
+    return bytes(data).decode("utf-8")
+
+
+def _store_output(conn, text):
+    """Store run output once per distinct content and return (hash, size).
+
+    Outputs live in run_outputs keyed by their SHA-256, so identical outputs
+    from repeated runs share one row. Each blob records its codec: zlib, or
+    raw when compression would not make it smaller.
+    """
+    data = text.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    exists = conn.execute("SELECT 1 FROM run_outputs WHERE hash = ?", (digest,)).fetchone()
+    if not exists:
+        compressed = zlib.compress(data, OUTPUT_COMPRESSION_LEVEL)
+        codec, blob = ("zlib", compressed) if len(compressed) < len(data) else ("raw", data)
+        conn.execute("""
+            INSERT OR IGNORE INTO run_outputs (hash, codec, size, data)
+            VALUES (?, ?, ?, ?)
+        """, (digest, codec, len(data), sqlite3.Binary(blob)))
+    return digest, len(data)
+
+
+def _delete_orphaned_outputs(conn, hashes=None):
+    """Drop output blobs no longer referenced by any run.
+
+    With ``hashes``, only those blobs are checked, which keeps deleting a
+    few runs from a large history cheap.
+    """
+    if hashes is None:
+        conn.execute("""
+            DELETE FROM run_outputs WHERE hash NOT IN (
+                SELECT output_hash FROM playbook_runs WHERE output_hash IS NOT NULL
+            )
+        """)
+        return
+    hashes = list(set(h for h in hashes if h))
+    if hashes:
+        conn.execute("""
+            DELETE FROM run_outputs WHERE hash IN (%s) AND NOT EXISTS (
+                SELECT 1 FROM playbook_runs WHERE output_hash = run_outputs.hash
+            )
+        """ % ",".join("?" * len(hashes)), hashes)
+
+
+def _migrate_history_v2(conn):
+    """Move run output into the compressed, deduplicated run_outputs table."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS run_outputs (
+            hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    """)
+    conn.execute("ALTER TABLE playbook_runs ADD COLUMN output_hash TEXT")
+    conn.execute("ALTER TABLE playbook_runs ADD COLUMN output_size INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_playbook_runs_output_hash
+        ON playbook_runs (output_hash)
+    """)
+
+    # Convert in batches to keep memory flat; runs still in progress keep
+    # streaming into the output column and are converted when they finish.
+    last_id = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, output FROM playbook_runs
+            WHERE id > ? AND id NOT IN (
+                SELECT run_id FROM playbook_jobs
+                WHERE run_id IS NOT NULL AND status IN ('queued', 'running')
+            )
+            ORDER BY id LIMIT 500
+        """, (last_id,)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            digest, size = _store_output(conn, row["output"])
+            conn.execute("""
+                UPDATE playbook_runs SET output = '', output_hash = ?, output_size = ?
+                WHERE id = ?
+            """, (digest, size, row["id"]))
+        last_id = rows[-1]["id"]
+
+
+def _migrate_history_v3(conn):
+    """Add an FTS5 index over run playbook names and output."""
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS run_search_source AS
+        SELECT r.id AS id, r.playbook AS playbook,
+               COALESCE(decode_output(o.codec, o.data), r.output) AS output
+        FROM playbook_runs r LEFT JOIN run_outputs o ON o.hash = r.output_hash
+    """)
+    try:
+        # External content: the index stores no second copy of the output.
+        conn.execute("""
+            CREATE VIRTUAL TABLE run_search USING fts5(
+                playbook, output,
+                content='run_search_source', content_rowid='id'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        logger.warning("Full-text search disabled, SQLite lacks FTS5: %s", e)
+        return
+    conn.execute("""
+        INSERT INTO run_search (rowid, playbook, output)
+        SELECT id, playbook, output FROM run_search_source
+        WHERE id NOT IN (
+            SELECT run_id FROM playbook_jobs
+            WHERE run_id IS NOT NULL AND status IN ('queued', 'running')
+        )
+    """)
+
+
+def _search_index_enabled(conn):
+    enabled = getattr(_history_db_local, "search_enabled", None)
+    if enabled is None:
+        enabled = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'run_search'"
+        ).fetchone() is not None
+        _history_db_local.search_enabled = enabled
+    return enabled
+
+
+def _index_run(conn, run_id, playbook, output):
+    """Add a finished run to the full-text index."""
+    if _search_index_enabled(conn):
+        conn.execute(
+            "INSERT INTO run_search (rowid, playbook, output) VALUES (?, ?, ?)",
+            (run_id, playbook, output)
+        )
+
+
+def _unindex_runs(conn, run_ids):
+    """Remove runs from the full-text index. Must run before the rows are deleted."""
+    if _search_index_enabled(conn) and run_ids:
+        placeholders = ",".join("?" * len(run_ids))
+        conn.execute("""
+            INSERT INTO run_search (run_search, rowid, playbook, output)
+            SELECT 'delete', s.id, s.playbook, s.output FROM run_search_source s
+            JOIN playbook_runs r ON r.id = s.id
+            WHERE s.id IN (%s) AND r.output_hash IS NOT NULL
+        """ % placeholders, list(run_ids))
+
+
+def _migrate_history_v4(conn):
+    """Index the columns history exports can be filtered on."""
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_playbook_runs_playbook
+        ON playbook_runs (playbook, id)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_playbook_runs_time ON playbook_runs (time)")
+
+
+def _migrate_history_v5(conn):
+    """Let jobs report progress."""
+    conn.execute("ALTER TABLE playbook_jobs ADD COLUMN progress TEXT")
+
+
+def _migrate_history_v6(conn):
+    """Record history compactions and the space they reclaimed."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_compactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            duration REAL NOT NULL,
+            runs_deleted INTEGER NOT NULL,
+            outputs_deleted INTEGER NOT NULL,
+            bytes_before INTEGER NOT NULL,
+            bytes_after INTEGER NOT NULL,
+            reclaimed_bytes INTEGER NOT NULL
+        )
+    """)
+
+
+def _migrate_history_v7(conn):
+    """Record the performance profile each run used."""
+    conn.execute("ALTER TABLE playbook_runs ADD COLUMN profile TEXT")
+
+
+def _migrate_history_v8(conn):
+    """Store per-host recaps and per-task results of each run.
+
+    Indexes end in the implicit rowid, so filtered queries can page newest
+    first straight off the index.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS run_hosts (
+            run_id INTEGER NOT NULL,
+            host TEXT NOT NULL,
+            ok INTEGER NOT NULL DEFAULT 0,
+            changed INTEGER NOT NULL DEFAULT 0,
+            unreachable INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            rescued INTEGER NOT NULL DEFAULT 0,
+            ignored INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (run_id, host)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_run_hosts_host ON run_hosts (host, run_id)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS run_tasks (
+            id INTEGER PRIMARY KEY,
+            run_id INTEGER NOT NULL,
+            host TEXT NOT NULL,
+            play TEXT,
+            task TEXT NOT NULL,
+            action TEXT,
+            role TEXT,
+            status TEXT NOT NULL,
+            ignored INTEGER NOT NULL DEFAULT 0,
+            msg TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_run_tasks_run ON run_tasks (run_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_run_tasks_status ON run_tasks (status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_run_tasks_task ON run_tasks (task, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_run_tasks_host ON run_tasks (host, status)")
+
+
+def _migrate_history_v9(conn):
+    """Record how long each task took on each host."""
+    conn.execute("ALTER TABLE run_tasks ADD COLUMN duration REAL")
+
+
+def _migrate_history_v10(conn):
+    """Record when each run started and finished, its exit code and resource use."""
+    for column in ("started_at TEXT", "finished_at TEXT", "duration REAL", "return_code INTEGER",
+                   "cpu_seconds REAL", "peak_rss INTEGER"):
+        conn.execute("ALTER TABLE playbook_runs ADD COLUMN " + column)
+    for column in RUN_SORT_COLUMNS[1:]:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_playbook_runs_%s ON playbook_runs (%s)"
+                     % (column, column))
+
+
+def _migrate_history_v11(conn):
+    """Stream run output into appended chunks instead of rewriting the run row."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS run_output_chunks (
+            run_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            chunk TEXT NOT NULL,
+            PRIMARY KEY (run_id, seq)
+        ) WITHOUT ROWID
+    """)
+
+
+# Schema migrations, applied in order. PRAGMA user_version records how many
+# have run, so each one executes exactly once per database.
+HISTORY_MIGRATIONS = [
+    _migrate_history_v1,
+    _migrate_history_v2,
+    _migrate_history_v3,
+    _migrate_history_v4,
+    _migrate_history_v5,
+    _migrate_history_v6,
+    _migrate_history_v7,
+    _migrate_history_v8,
+    _migrate_history_v9,
+    _migrate_history_v10,
+    _migrate_history_v11,
+]
+
+
+def _apply_history_migrations(conn):
+    """Bring the schema up to date. Safe to call from several processes."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(HISTORY_MIGRATIONS):
+        return
+    # BEGIN IMMEDIATE takes the write lock, so only one worker migrates.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number in range(version, len(HISTORY_MIGRATIONS)):
+            HISTORY_MIGRATIONS[number](conn)
+            conn.execute("PRAGMA user_version = %d" % (number + 1))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def init_history_db():
+    """Initialize SQLite history storage and apply pending schema migrations."""
+    try:
+        get_history_db_connection()
+    except Exception as e:
+        logger.error("Error initializing history database: %s", e)
+
+
+# Output a run has streamed so far: the output column (written before chunks
+# existed) followed by its chunks in order.
+RUN_STREAMED_OUTPUT_SQL = """r.output || (
+    SELECT COALESCE(group_concat(chunk, ''), '') FROM (
+        SELECT chunk FROM run_output_chunks c WHERE c.run_id = r.id ORDER BY c.seq))"""
+# Plain-text output of a run: the stored blob once finished, or what it has
+# streamed so far while it is still running.
+RUN_OUTPUT_SQL = "COALESCE(decode_output(o.codec, o.data), %s)" % RUN_STREAMED_OUTPUT_SQL
+RUN_OUTPUT_JOIN = "LEFT JOIN run_outputs o ON o.hash = r.output_hash"
+
+
+def load_history():
+    """Load playbook run history from SQLite as a list of dictionaries."""
+    try:
+        with get_history_db_connection() as conn:
+            rows = conn.execute("""
+                SELECT r.action, r.playbook, %s AS output, r.time
+                FROM playbook_runs r %s
+                ORDER BY r.id ASC
+            """ % (RUN_OUTPUT_SQL, RUN_OUTPUT_JOIN)).fetchall()
+
+        return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error("Error loading history from SQLite: %s", e)
+        return []
+
+
+def iter_history(playbook=None, action=None, since=None, until=None, batch_size=200):
+    """Yield history records oldest first, a batch at a time.
+
+    Uses its own connection so a long export reads one consistent WAL
+    snapshot without holding this thread's connection or blocking writers.
+    The connection is closed when the generator is exhausted or closed.
+    """
+    conditions, params = [], []
+    for column, op, value in (("r.playbook", "=", playbook), ("r.action", "=", action),
+                              ("r.time", ">=", since), ("r.time", "<=", until)):
+        if value:
+            conditions.append("%s %s ?" % (column, op))
+            params.append(value)
+    query = "SELECT r.action, r.playbook, %s AS output, r.time FROM playbook_runs r %s" % (
+        RUN_OUTPUT_SQL, RUN_OUTPUT_JOIN)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY r.id ASC"
+
+    get_history_db_connection()  # makes sure the schema is up to date
+    conn = _open_history_connection(get_history_db_file())
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        conn.close()
+
+
+# Columns runs can be sorted by (each has an index) and the filters the
+# history API accepts, with the SQL condition for each.
+RUN_SORT_COLUMNS = ("id", "duration", "cpu_seconds", "peak_rss", "return_code")
+RUN_FILTERS = {
+    "playbook": "playbook = ?",
+    "return_code": "return_code = ?",
+    "failed": "return_code != 0",
+    "min_duration": "duration >= ?",
+    "max_duration": "duration <= ?",
+    "min_cpu_seconds": "cpu_seconds >= ?",
+    "min_peak_rss": "peak_rss >= ?",
+}
+RUN_SUMMARY_COLUMNS = ("id, action, playbook, time, profile, started_at, finished_at, duration, "
+                       "return_code, cpu_seconds, peak_rss")
+
+
+def list_history_runs(before_id=None, limit=50, sort="id", descending=True, before_value=None,
+                      filters=None):
+    """Return one page of run summaries (no output), newest first by default.
+
+    Pagination is keyset-based on (sort column, id): pass the last run of the
+    previous page as before_value/before_id to fetch the next one, so every
+    page is an index range scan no matter how deep into the history it is.
+    When sorting by a resource column, runs without a value are left out.
+    filters maps RUN_FILTERS names to values ("failed" takes a boolean).
+    """
+    if sort not in RUN_SORT_COLUMNS:
+        raise ValueError("Invalid sort column: %s" % sort)
+    where, params = [], []
+    for name, value in (filters or {}).items():
+        if name == "failed":
+            if value:
+                where.append(RUN_FILTERS[name])
+        elif value is not None:
+            where.append(RUN_FILTERS[name])
+            params.append(value)
+    op = "<" if descending else ">"
+    if sort != "id":
+        where.append("%s IS NOT NULL" % sort)
+        if before_id is not None and before_value is not None:
+            where.append("(%s, id) %s (?, ?)" % (sort, op))
+            params.extend([before_value, before_id])
+    elif before_id is not None:
+        where.append("id %s ?" % op)
+        params.append(before_id)
+    query = "SELECT %s FROM playbook_runs" % RUN_SUMMARY_COLUMNS
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    direction = "DESC" if descending else "ASC"
+    if sort == "id":
+        query += " ORDER BY id %s LIMIT ?" % direction
+    else:
+        query += " ORDER BY %s %s, id %s LIMIT ?" % (sort, direction, direction)
+    params.append(limit)
+    with get_history_db_connection() as conn:
+        return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+
+def get_history_run(run_id):
+    """Return a single run including its output, or None."""
+    with get_history_db_connection() as conn:
+        row = conn.execute("""
+            SELECT r.id, r.action, r.playbook, %s AS output, r.time, r.profile, r.started_at,
+                   r.finished_at, r.duration, r.return_code, r.cpu_seconds, r.peak_rss
+            FROM playbook_runs r %s
+            WHERE r.id = ?
+        """ % (RUN_OUTPUT_SQL, RUN_OUTPUT_JOIN), (run_id,)).fetchone()
+    return dict(row) if row else None
+
+
+SEARCH_MARK_START = "\x02"
+SEARCH_MARK_END = "\x03"
+
+
+def _to_fts_query(text):
+    """Turn free text into an FTS5 query that matches all terms literally."""
+    return " ".join('"%s"' % term.replace('"', '""') for term in text.split())
+
+
+def search_history(query, limit=20, offset=0, raw_syntax=False, sort="rank"):
+    """Full-text search over run output and playbook names.
+
+    Returns (results, has_more). Results are ordered by bm25 rank, or newest
+    first with sort="recent" (which stays fast even for terms that match
+    nearly every run), and carry an HTML snippet with the matched terms
+    wrapped in <mark>. Ordering uses only the index; output is decoded just
+    for the snippets of the returned page. Raises sqlite3.OperationalError
+    on an invalid raw query.
+    """
+    match = query if raw_syntax else _to_fts_query(query)
+    if not match:
+        return [], False
+    with get_history_db_connection() as conn:
+        if not _search_index_enabled(conn):
+            raise RuntimeError("Full-text search is not available")
+        order = "rowid DESC" if sort == "recent" else "rank"
+        ranked = conn.execute("""
+            SELECT rowid FROM run_search WHERE run_search MATCH ?
+            ORDER BY %s LIMIT ? OFFSET ?
+        """ % order, (match, limit + 1, offset)).fetchall()
+        has_more = len(ranked) > limit
+        page_ids = [row[0] for row in ranked[:limit]]
+        if not page_ids:
+            return [], False
+        rows = conn.execute("""
+            SELECT r.id, r.action, r.playbook, r.time,
+                   snippet(run_search, -1, ?, ?, '…', 24) AS snippet
+            FROM run_search JOIN playbook_runs r ON r.id = run_search.rowid
+            WHERE run_search MATCH ? AND run_search.rowid IN (%s)
+        """ % ",".join("?" * len(page_ids)),
+            [SEARCH_MARK_START, SEARCH_MARK_END, match] + page_ids).fetchall()
+    by_id = {row["id"]: dict(row) for row in rows}
+    results = []
+    for run_id in page_ids:
+        result = by_id[run_id]
+        snippet = html.escape(result.pop("snippet") or "")
+        result["snippet_html"] = (snippet.replace(SEARCH_MARK_START, "<mark>")
+                                  .replace(SEARCH_MARK_END, "</mark>"))
+        results.append(result)
+    return results, has_more
+
+
+def _insert_history_record(conn, record):
+    output = record.get("output", "")
+    digest, size = _store_output(conn, output)
+    cursor = conn.execute("""
+        INSERT INTO playbook_runs (action, playbook, output, output_hash, output_size, time)
+        VALUES (?, ?, '', ?, ?, ?)
+    """, (
+        record.get("action", ""),
+        record.get("playbook", ""),
+        digest,
+        size,
+        record.get("time", "")
+    ))
+    _index_run(conn, cursor.lastrowid, record.get("playbook", ""), output)
+    return cursor.lastrowid
+
+
+def save_history(history):
+    """Replace playbook run history in SQLite with the provided records."""
+    try:
+        with get_history_db_connection() as conn:
+            if _search_index_enabled(conn):
+                conn.execute("INSERT INTO run_search (run_search) VALUES ('delete-all')")
+            # Runs still streaming (no output_hash yet) are kept so their job can finish them.
+            for table in ("run_tasks", "run_hosts", "run_output_chunks"):
+                conn.execute("DELETE FROM %s WHERE run_id IN "
+                             "(SELECT id FROM playbook_runs WHERE output_hash IS NOT NULL)" % table)
+            conn.execute("DELETE FROM playbook_runs WHERE output_hash IS NOT NULL")
+            for record in history:
+                if isinstance(record, dict):
+                    _insert_history_record(conn, record)
+            _delete_orphaned_outputs(conn)
+    except Exception as e:
+        logger.error("Error saving history to SQLite: %s", e)
+
+
+def add_history_record(record):
+    """Insert a single playbook run history record into SQLite and return its id."""
+    try:
+        with get_history_db_connection() as conn:
+            return _insert_history_record(conn, record)
+    except Exception as e:
+        logger.error("Error adding history record to SQLite: %s", e)
+        return None
+
+
+def start_history_run(action, playbook, profile=None):
+    """Insert an empty run whose output will be appended while it executes."""
+    now = _current_time()
+    with get_history_db_connection() as conn:
+        return conn.execute("""
+            INSERT INTO playbook_runs (action, playbook, output, time, profile, started_at)
+            VALUES (?, ?, '', ?, ?, ?)
+        """, (action, playbook, now, profile, now)).lastrowid
+
+
+def finish_history_run(run_id, duration=None, return_code=None, cpu_seconds=None, peak_rss=None):
+    """Record a run's end and resource use, and move its streamed output into the deduplicated store."""
+    with get_history_db_connection() as conn:
+        conn.execute("""
+            UPDATE playbook_runs SET finished_at = ?, duration = ?, return_code = ?,
+                cpu_seconds = ?, peak_rss = ?
+            WHERE id = ?
+        """, (_current_time(), duration, return_code, cpu_seconds, peak_rss, run_id))
+        row = conn.execute(
+            "SELECT r.playbook, %s AS output FROM playbook_runs r WHERE r.id = ? AND r.output_hash IS NULL"
+            % RUN_STREAMED_OUTPUT_SQL, (run_id,)
+        ).fetchone()
+        if row is None:
+            conn.execute("DELETE FROM run_output_chunks WHERE run_id = ?", (run_id,))
+            return
+        digest, size = _store_output(conn, row["output"])
+        conn.execute("""
+            UPDATE playbook_runs SET output = '', output_hash = ?, output_size = ?
+            WHERE id = ?
+        """, (digest, size, run_id))
+        conn.execute("DELETE FROM run_output_chunks WHERE run_id = ?", (run_id,))
+        _index_run(conn, run_id, row["playbook"], row["output"])
+
+# =============================================================================
+# Background Job Engine
+# Playbook runs are queued as jobs and executed by a bounded pool of worker
+# threads, so a long play never holds a Gunicorn worker for the whole run.
+# Job state lives in the history database so every worker can report on it.
+# =============================================================================
+JOB_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+JOB_FINISHED_STATUSES = ("succeeded", "failed", "cancelled", "lost")
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+def _current_time():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+_worker_token_cache = {}
+
+
+def _worker_token():
+    """Identify this process in a way that survives PID reuse."""
+    pid = os.getpid()
+    token = _worker_token_cache.get(pid)
+    if token is None:
+        token = "%d-%d" % (pid, int(psutil.Process(pid).create_time()))
+        _worker_token_cache.clear()
+        _worker_token_cache[pid] = token
+    return token
+
+
+def _worker_alive(token):
+    """Return True if the process identified by a worker token still exists."""
+    try:
+        pid, created = (int(part) for part in token.split("-"))
+        return int(psutil.Process(pid).create_time()) == created
+    except (ValueError, AttributeError, psutil.Error):
+        return False
+
+
+def get_job_worker_count():
+    """Return the configured size of the job worker pool."""
+    value = os.environ.get("ANSIBLEPOWER_JOB_WORKERS") or config_cache.get().get("job_workers")
+    try:
+        return max(1, int(value or DEFAULT_JOB_WORKERS))
+    except (TypeError, ValueError):
+        logger.error("Invalid job worker count: %s", value)
+        return DEFAULT_JOB_WORKERS
+
+
+class JobManager:
+    """Bounded, prioritized worker pool for background jobs.
+
+    Jobs are dispatched to the handler registered for their ``kind``. Each
+    priority lane is served first-in first-out, and higher lanes always go
+    before lower ones.
+    """
+
+    def __init__(self, max_queued=DEFAULT_JOB_QUEUE_SIZE):
+        self.max_queued = max_queued
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._queue = queue.PriorityQueue()
+        self._threads = []
+        self._pid = None
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def submit(self, kind, playbook, priority="normal", options=None):
+        """Queue a job and return its id without waiting for it to run."""
+        if priority not in JOB_PRIORITIES:
+            raise ValueError("Unknown priority: %s" % priority)
+        if kind not in self._handlers:
+            raise ValueError("Unknown job kind: %s" % kind)
+        self._ensure_workers()
+        job_id = uuid.uuid4().hex
+        # Check and enqueue under one lock so concurrent submits cannot overshoot max_queued.
+        with self._lock:
+            if self._queue.qsize() >= self.max_queued:
+                raise JobQueueFull()
+            with get_history_db_connection() as conn:
+                conn.execute("""
+                    INSERT INTO playbook_jobs
+                    (id, kind, playbook, priority, status, options, worker, submitted_at)
+                    VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)
+                """, (job_id, kind, playbook, priority, json.dumps(options or {}),
+                      _worker_token(), _current_time()))
+            self._queue.put((JOB_PRIORITIES[priority], next(self._counter), job_id))
+        logger.info("Queued %s job %s for %s (priority %s)", kind, job_id, playbook, priority)
+        return job_id
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads and queued items do not survive a fork; start afresh.
+                self._pid = os.getpid()
+                self._queue = queue.PriorityQueue()
+                self._threads = []
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for _ in range(get_job_worker_count() - len(self._threads)):
+                thread = threading.Thread(target=self._work, name="ansiblepower-job", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception:
+                logger.exception("Unexpected error in job worker for job %s", job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        with get_history_db_connection() as conn:
+            claimed = conn.execute("""
+                UPDATE playbook_jobs SET status = 'running', started_at = ?
+                WHERE id = ? AND status = 'queued'
+            """, (_current_time(), job_id)).rowcount
+            job = conn.execute("SELECT * FROM playbook_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not claimed or job is None:
+            return  # cancelled while waiting in the queue
+
+        job = dict(job)
+        job["options"] = json.loads(job["options"] or "{}")
+        status, run_id, error = "failed", None, None
+        try:
+            status, run_id = self._handlers[job["kind"]](job)
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            error = str(e)
+
+        with get_history_db_connection() as conn:
+            conn.execute("""
+                UPDATE playbook_jobs
+                SET status = ?, run_id = ?, error = ?, finished_at = ?
+                WHERE id = ?
+            """, (status, run_id, error, _current_time(), job_id))
+        logger.info("Job %s finished with status %s", job_id, status)
+
+
+job_manager = JobManager()
+
+
+def _job_to_dict(row):
+    job = dict(row)
+    job["options"] = json.loads(job.get("options") or "{}")
+    job["progress"] = json.loads(job["progress"]) if job.get("progress") else None
+    job.pop("worker", None)
+    return job
+
+
+def get_job_summary(job_id):
+    """Return a job as a dictionary without its output, or None."""
+    with get_history_db_connection() as conn:
+        row = conn.execute("SELECT * FROM playbook_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row["status"] not in JOB_FINISHED_STATUSES and not _worker_alive(row["worker"]):
+            # The worker that owned this job has exited; it will never finish.
+            conn.execute("""
+                UPDATE playbook_jobs SET status = 'lost', finished_at = ?
+                WHERE id = ? AND status = ?
+            """, (_current_time(), job_id, row["status"]))
+            row = conn.execute("SELECT * FROM playbook_jobs WHERE id = ?", (job_id,)).fetchone()
+    return _job_to_dict(row)
+
+
+def get_job(job_id):
+    """Return a job as a dictionary (with run output so far), or None."""
+    job = get_job_summary(job_id)
+    if job is not None and job["run_id"] is not None:
+        with get_history_db_connection() as conn:
+            run = conn.execute(
+                "SELECT %s AS output FROM playbook_runs r %s WHERE r.id = ?"
+                % (RUN_OUTPUT_SQL, RUN_OUTPUT_JOIN), (job["run_id"],)
+            ).fetchone()
+        job["output"] = run["output"] if run else None
+    return job
+
+
+def list_jobs(status=None, limit=50):
+    """Return the most recently submitted jobs, newest first."""
+    query = "SELECT * FROM playbook_jobs"
+    params = []
+    if status:
+        query += " WHERE status = ?"
+        params.append(status)
+    query += " ORDER BY submitted_at DESC, rowid DESC LIMIT ?"
+    params.append(limit)
+    with get_history_db_connection() as conn:
+        return [_job_to_dict(row) for row in conn.execute(query, params).fetchall()]
+
+
+def cancel_job(job_id):
+    """Cancel a job that has not started yet. Returns True on success."""
+    with get_history_db_connection() as conn:
+        return conn.execute("""
+            UPDATE playbook_jobs SET status = 'cancelled', finished_at = ?
+            WHERE id = ? AND status = 'queued'
+        """, (_current_time(), job_id)).rowcount == 1
+
+
+def _build_playbook_command(playbook_path):
+    cmd = [ANSIBLE_PLAYBOOK, playbook_path]
+
+    # Pass the inventory/hosts file if configured
+    hosts_file = get_hosts_file()
+    if os.path.exists(hosts_file):
+        cmd += ["-i", hosts_file]
+    else:
+        # No hosts file — fall back to localhost for convenience
+        cmd += ["-i", "localhost,", "--connection=local"]
+    return cmd
+
+
+DEFAULT_FACT_CACHE_TIMEOUT = 3600
+
+
+def get_fact_cache_settings():
+    """Return the fact cache settings: enabled flag and timeout in seconds."""
+    settings = dict(config_cache.get().get("fact_cache") or {})
+    settings.setdefault("enabled", True)
+    settings.setdefault("timeout", DEFAULT_FACT_CACHE_TIMEOUT)
+    return settings
+
+
+def get_fact_cache_dir():
+    """Directory of the jsonfile fact cache, next to the history database."""
+    return os.path.join(os.path.dirname(get_history_db_file()), "fact_cache")
+
+
+CALLBACK_PLUGINS_DIR = os.path.join(BASE_DIR, "callback_plugins")
+RESULTS_CALLBACK = "ansiblepower_results"
+
+
+def get_results_dir():
+    """Directory where running playbooks write their structured results."""
+    return os.path.join(os.path.dirname(get_history_db_file()), "results")
+
+
+# Built-in performance profiles; config.json may override or add to them.
+# "default" leaves every setting to Ansible and its ansible.cfg.
+BUILTIN_PERFORMANCE_PROFILES = {
+    "default": {},
+    "fast": dict({
+        "forks": 50,
+        "pipelining": True,
+        "ssh_control_persist": "60s",
+    }, **({"local_tmp": "/dev/shm/ansiblepower"} if os.path.isdir("/dev/shm") else {})),
+}
+PERFORMANCE_PROFILE_KEYS = ("forks", "pipelining", "strategy", "ssh_control_persist",
+                            "control_path_dir", "local_tmp")
+
+
+def get_performance_profiles():
+    """Return (profiles, active profile name)."""
+    config = config_cache.get()
+    profiles = dict(BUILTIN_PERFORMANCE_PROFILES)
+    profiles.update(config.get("performance_profiles") or {})
+    active = config.get("active_profile", "default")
+    return profiles, active if active in profiles else "default"
+
+
+def validate_performance_profile(name, profile):
+    """Return a cleaned copy of a performance profile or raise ValueError."""
+    if not re.match(r"^[\w.-]{1,64}$", str(name)):
+        raise ValueError("Invalid profile name: %s" % name)
+    if not isinstance(profile, dict):
+        raise ValueError("Profile %s must be an object" % name)
+    unknown = set(profile) - set(PERFORMANCE_PROFILE_KEYS)
+    if unknown:
+        raise ValueError("Profile %s has unknown settings: %s" % (name, ", ".join(sorted(unknown))))
+    cleaned = {}
+    for key, value in profile.items():
+        if value is None or value == "":
+            continue
+        if key == "forks":
+            if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                raise ValueError("forks must be a positive integer")
+        elif key == "pipelining":
+            if not isinstance(value, bool):
+                raise ValueError("pipelining must be true or false")
+        elif key == "strategy":
+            if not re.match(r"^[\w.]+$", str(value)):
+                raise ValueError("Invalid strategy: %s" % value)
+        elif key == "ssh_control_persist":
+            if not re.match(r"^\d+[smh]?$", str(value)):
+                raise ValueError("ssh_control_persist must look like 60s, 10m or 1h")
+            value = str(value)
+        elif not os.path.isabs(str(value)):
+            raise ValueError("%s must be an absolute path" % key)
+        cleaned[key] = value
+    return cleaned
+
+
+def _profile_env(profile):
+    """Ansible environment variables for a performance profile.
+
+    Environment variables are used instead of a generated ansible.cfg,
+    which would replace (not extend) an ansible.cfg next to the playbooks.
+    """
+    env = {}
+    if "forks" in profile:
+        env["ANSIBLE_FORKS"] = str(profile["forks"])
+    if "pipelining" in profile:
+        env["ANSIBLE_PIPELINING"] = "True" if profile["pipelining"] else "False"
+    if "strategy" in profile:
+        env["ANSIBLE_STRATEGY"] = profile["strategy"]
+    if "ssh_control_persist" in profile:
+        # Reuse one SSH connection per host across tasks and back-to-back runs.
+        env["ANSIBLE_SSH_ARGS"] = "-C -o ControlMaster=auto -o ControlPersist=%s" % profile["ssh_control_persist"]
+        env["ANSIBLE_SSH_CONTROL_PATH_DIR"] = profile.get("control_path_dir") or os.path.join(
+            tempfile.gettempdir(), "ansiblepower-cp-%s" % (os.getuid() if hasattr(os, "getuid") else "0"))
+    if "local_tmp" in profile:
+        env["ANSIBLE_LOCAL_TEMP"] = profile["local_tmp"]
+    return env
+
+
+def describe_performance_profile(name, profile):
+    settings = ", ".join("%s=%s" % (key, profile[key]) for key in PERFORMANCE_PROFILE_KEYS if key in profile)
+    return "%s (%s)" % (name, settings or "Ansible defaults")
+
+
+def _playbook_env(profile=None, results_file=None):
+    """Environment for ansible-playbook runs.
+
+    Applies the performance profile's settings and wires in the managed fact
+    cache: facts gathered by one run are reused by the next within the
+    timeout (gathering=smart). Variables already set in the environment take
+    precedence over the fact cache settings. With results_file, the bundled
+    results callback is enabled alongside the usual stdout callback and
+    writes per-task results there.
+    """
+    env = dict(os.environ)
+    env.update(_profile_env(profile or {}))
+    if results_file:
+        env["ANSIBLEPOWER_RESULTS_FILE"] = results_file
+        env["ANSIBLE_CALLBACK_PLUGINS"] = os.pathsep.join(
+            filter(None, [CALLBACK_PLUGINS_DIR, env.get("ANSIBLE_CALLBACK_PLUGINS")]))
+        env["ANSIBLE_CALLBACKS_ENABLED"] = ",".join(
+            filter(None, [env.get("ANSIBLE_CALLBACKS_ENABLED"), RESULTS_CALLBACK]))
+    settings = get_fact_cache_settings()
+    if settings["enabled"]:
+        env.setdefault("ANSIBLE_GATHERING", "smart")
+        env.setdefault("ANSIBLE_CACHE_PLUGIN", "jsonfile")
+        env.setdefault("ANSIBLE_CACHE_PLUGIN_CONNECTION", get_fact_cache_dir())
+        env.setdefault("ANSIBLE_CACHE_PLUGIN_TIMEOUT", str(settings["timeout"]))
+    return env
+
+
+def get_playbook_timeout():
+    """Return the maximum run time of a playbook in seconds."""
+    value = os.environ.get("ANSIBLEPOWER_PLAYBOOK_TIMEOUT") or config_cache.get().get("playbook_timeout")
+    try:
+        return max(1, int(value or PLAYBOOK_TIMEOUT))
+    except (TypeError, ValueError):
+        logger.error("Invalid playbook timeout: %s", value)
+        return PLAYBOOK_TIMEOUT
+
+
+def _attach_job_run(job_id, run_id):
+    """Link a job to its history record as soon as the run starts."""
+    with get_history_db_connection() as conn:
+        conn.execute("UPDATE playbook_jobs SET run_id = ? WHERE id = ?", (run_id, job_id))
+
+
+class RunOutputWriter:
+    """Append a run's output to run_output_chunks in small batches.
+
+    Lines are flushed at least every OUTPUT_FLUSH_INTERVAL seconds, so readers
+    of the run (such as the live stream endpoint) see output almost as soon
+    as ansible-playbook prints it, without one INSERT per line. Each flush
+    adds a chunk rather than rewriting the growing output, so a long run
+    costs I/O in proportion to its output, not its square.
+    """
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.has_content = False
+        self._seq = 0
+        self._pending = []
+        self._pending_size = 0
+        self._last_flush = 0.0  # the first line is written straight away
+
+    def write(self, text):
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if not self.has_content and text.strip():
+            self.has_content = True
+        if (self._pending_size >= OUTPUT_FLUSH_BYTES
+                or time.monotonic() - self._last_flush >= OUTPUT_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            chunk = "".join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+            self._seq += 1
+            with get_history_db_connection() as conn:
+                conn.execute(
+                    "INSERT INTO run_output_chunks (run_id, seq, chunk) VALUES (?, ?, ?)",
+                    (self.run_id, self._seq, chunk)
+                )
+        self._last_flush = time.monotonic()
+
+
+class ProcessTreeUsage:
+    """CPU time and peak memory of the process trees of a run.
+
+    A background thread adds up the resident memory of every watched process
+    and its descendants each RESOURCE_SAMPLE_INTERVAL seconds and keeps the
+    highest total. CPU time comes from the kernel when each process is
+    reaped, and covers every descendant it waited for, so short-lived
+    workers between samples are still counted.
+    """
+
+    def __init__(self):
+        self.cpu_seconds = 0.0
+        self.peak_rss = 0
+        self._roots = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, pid):
+        try:
+            self._roots.append(psutil.Process(pid))
+        except psutil.Error:
+            return
+        self._sample()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        total = 0
+        for root in list(self._roots):
+            try:
+                tree = [root] + root.children(recursive=True)
+            except psutil.Error:
+                continue
+            for proc in tree:
+                try:
+                    total += proc.memory_info().rss
+                except psutil.Error:
+                    pass
+        self.peak_rss = max(self.peak_rss, total)
+
+    def _run(self):
+        while not self._stop.wait(RESOURCE_SAMPLE_INTERVAL):
+            self._sample()
+
+    def reap(self, proc):
+        """Wait for proc, add its CPU time and return its exit code."""
+        if hasattr(os, "wait4") and proc.returncode is None:
+            try:
+                _, status, rusage = os.wait4(proc.pid, 0)
+            except ChildProcessError:
+                return proc.wait()
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            self.cpu_seconds += rusage.ru_utime + rusage.ru_stime
+            # ru_maxrss (KiB on Linux) is the largest single process in the tree.
+            self.peak_rss = max(self.peak_rss, rusage.ru_maxrss * 1024)
+            return proc.returncode
+        return proc.wait()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _pump_output(stream, lines, index=0):
+    """Read a process pipe line by line into a queue as (index, line); None marks the end."""
+    try:
+        for raw in iter(stream.readline, b""):
+            lines.put((index, raw.decode("utf-8", errors="replace")))
+    finally:
+        stream.close()
+        lines.put((index, None))
+
+
+def _stream_processes(cmds, writer, timeout, format_line=None, env=None, usage=None):
+    """Run several commands at once, streaming their combined output into writer.
+
+    format_line(index, line) may rewrite each line (for example to prefix it
+    with its shard) and returns the text to write, or None to drop it.
+    Returns (returncodes, timed_out). Every process is killed once they have
+    run for longer than timeout seconds. A ProcessTreeUsage passed as usage
+    accounts for the processes' CPU time and memory.
+    """
+    procs = []
+    lines = queue.Queue()
+    env = env if env is not None else _playbook_env()
+    try:
+        for index, cmd in enumerate(cmds):
+            with _observe_phase("subprocess_spawn"):
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+            procs.append(proc)
+            if usage is not None:
+                usage.watch(proc.pid)
+            threading.Thread(target=_pump_output, args=(proc.stdout, lines, index), daemon=True).start()
+    except Exception:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+        if usage is not None:
+            usage.stop()
+        raise
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    running = len(procs)
+    while running:
+        try:
+            index, line = lines.get(timeout=OUTPUT_FLUSH_INTERVAL)
+        except queue.Empty:
+            writer.flush()
+        else:
+            if line is None:
+                running -= 1
+            else:
+                text = format_line(index, line) if format_line else line
+                if text is not None:
+                    writer.write(text)
+        if not timed_out and time.monotonic() > deadline:
+            timed_out = True
+            for proc in procs:
+                proc.kill()
+    writer.flush()
+    if usage is None:
+        return [proc.wait() for proc in procs], timed_out
+    try:
+        return [usage.reap(proc) for proc in procs], timed_out
+    finally:
+        usage.stop()
+
+
+def _stream_process(cmd, writer, timeout, env=None, usage=None):
+    """Run cmd, streaming its combined output into writer.
+
+    Returns (returncode, timed_out).
+    """
+    returncodes, timed_out = _stream_processes([cmd], writer, timeout, env=env, usage=usage)
+    return returncodes[0], timed_out
+
+
+def _write_timeout_notice(writer, playbook_name, timeout):
+    logger.warning("Playbook %s timed out after %s seconds", playbook_name, timeout)
+    writer.write("\n⏱ Playbook timed out after %d seconds. The process was killed.\n"
+                 "Check your inventory and connection settings, or increase the timeout.\n"
+                 % timeout)
+
+
+def _execute_playbook_job(job):
+    """Job handler: run ansible-playbook, persisting output as it is produced."""
+    playbook_name = job["playbook"]
+    profiles, profile_name = get_performance_profiles()
+    profile_name = job["options"].get("profile") or profile_name
+    profile = profiles.get(profile_name, {})
+    run_id = start_history_run("run", playbook_name, profile_name)
+    _attach_job_run(job["id"], run_id)
+
+    writer = RunOutputWriter(run_id)
+    playbook_path = job["options"]["playbook_path"]
+    timeout = get_playbook_timeout()
+    status = "failed"
+    results_file = os.path.join(get_results_dir(), "run-%d.ndjson" % run_id)
+    usage = ProcessTreeUsage()
+    returncode, timed_out = None, False
+    started = time.monotonic()
+    try:
+        writer.write("Performance profile: %s\n" % describe_performance_profile(profile_name, profile))
+        os.makedirs(get_results_dir(), exist_ok=True)
+        env = _playbook_env(profile, results_file)
+        shards = _plan_shards(playbook_path, job["options"].get("shards"), writer) \
+            if job["options"].get("fanout") else None
+        if shards:
+            returncode, timed_out = _run_shards(playbook_path, shards, writer, timeout, env, usage)
+        else:
+            returncode, timed_out = _stream_process(_build_playbook_command(playbook_path), writer,
+                                                    timeout, env, usage)
+            if timed_out:
+                _write_timeout_notice(writer, playbook_name, timeout)
+        if returncode == 0 and not timed_out:
+            status = "succeeded"
+    except Exception as e:
+        logger.exception("Unexpected error running playbook %s", playbook_name)
+        writer.write("Unexpected error occurred: " + str(e))
+    if not writer.has_content:
+        writer.write("No output produced.")
+    writer.flush()
+    try:
+        record_run_results(run_id, results_file)
+    except Exception:
+        logger.exception("Error recording results of run %s", run_id)
+    finally:
+        try:
+            os.remove(results_file)
+        except FileNotFoundError:
+            pass
+    duration = time.monotonic() - started
+    finish_history_run(run_id, duration=round(duration, 3), return_code=returncode,
+                       cpu_seconds=round(usage.cpu_seconds, 3), peak_rss=usage.peak_rss or None)
+    outcome = (("outcome", "timeout" if timed_out else status),)
+    metrics.inc("ansiblepower_playbook_runs_total", outcome)
+    metrics.observe("ansiblepower_playbook_run_duration_seconds", duration, outcome)
+    metrics.write(force=True)
+    logger.info("Recorded playbook run: %s", playbook_name)
+    return status, run_id
+
+
+# -----------------------------------------------------------------------------
+# Fan-out runs: one ansible-playbook per shard of the target hosts, so a large
+# rollout is not limited by a single controller process.
+# -----------------------------------------------------------------------------
+PLAY_RECAP_LINE = re.compile(r"^(\S+)\s+:\s+(ok=\d+.*?)\s*$")
+RECAP_COUNTERS = ("ok", "changed", "unreachable", "failed", "skipped", "rescued", "ignored")
+
+
+def get_default_shard_count():
+    return psutil.cpu_count() or 1
+
+
+def _plan_shards(playbook_path, shard_count, writer):
+    """Split the playbook's target hosts into shards, or return None to run once.
+
+    Targets are the hosts its plays' ``hosts`` patterns select in the parsed
+    inventory. Templated patterns cannot be resolved ahead of the run.
+    """
+    content, _ = content_cache.get(playbook_path)
+    _, patterns = parse_playbook_summary(content)
+    reason = None
+    if not patterns:
+        reason = "no hosts pattern found"
+    elif any("{{" in p for p in patterns):
+        reason = "hosts patterns are templated"
+    else:
+        try:
+            inventory = get_inventory()
+        except (OSError, InventoryError, RuntimeError) as e:
+            reason = "inventory unavailable (%s)" % e
+        else:
+            targets = {}
+            for pattern in patterns:
+                targets.update(dict.fromkeys(inventory.resolve(pattern)))
+            hosts = list(targets)
+            if len(hosts) < 2:
+                reason = "fewer than two target hosts"
+    if reason:
+        writer.write("Fan-out not possible (%s); running as a single process.\n" % reason)
+        return None
+
+    count = max(1, min(int(shard_count or get_default_shard_count()), len(hosts)))
+    size, extra = divmod(len(hosts), count)
+    shards, start = [], 0
+    for index in range(count):
+        end = start + size + (1 if index < extra else 0)
+        shards.append(hosts[start:end])
+        start = end
+    return shards
+
+
+def _run_shards(playbook_path, shards, writer, timeout, env=None, usage=None):
+    """Run one ansible-playbook per shard and write a combined recap.
+
+    Returns (returncode, timed_out); returncode is the first non-zero shard
+    exit code, or 0.
+    """
+    count = len(shards)
+    writer.write("Fan-out: %d hosts in %d shards\n" % (sum(map(len, shards)), count))
+    limit_dir = tempfile.mkdtemp(prefix="ansiblepower-shards-")
+    recap = {}
+    in_recap = [False] * count
+
+    def format_line(index, line):
+        # Collect each shard's recap; it is printed once, combined, at the end.
+        if line.startswith("PLAY RECAP"):
+            in_recap[index] = True
+            return None
+        if in_recap[index]:
+            match = PLAY_RECAP_LINE.match(line)
+            if match:
+                recap[match.group(1)] = match.group(2)
+                return None
+            if line.strip():
+                in_recap[index] = False
+            else:
+                return None
+        return "[shard %d/%d] %s" % (index + 1, count, line)
+
+    try:
+        cmds = []
+        for index, hosts in enumerate(shards):
+            # A limit file keeps very long host lists off the command line.
+            limit_file = os.path.join(limit_dir, "shard-%d" % (index + 1))
+            with open(limit_file, "w") as f:
+                f.write("\n".join(hosts) + "\n")
+            cmds.append(_build_playbook_command(playbook_path) + ["--limit", "@" + limit_file])
+        returncodes, timed_out = _stream_processes(cmds, writer, timeout, format_line, env, usage)
+    finally:
+        shutil.rmtree(limit_dir, ignore_errors=True)
+
+    writer.write(_format_combined_recap(shards, recap, returncodes))
+    if timed_out:
+        _write_timeout_notice(writer, os.path.basename(playbook_path), timeout)
+    return next((code for code in returncodes if code), 0), timed_out
+
+
+def _format_combined_recap(shards, recap, returncodes):
+    lines = ["", "PLAY RECAP (combined, %d shards) " % len(shards) + "*" * 40]
+    totals = dict.fromkeys(RECAP_COUNTERS, 0)
+    width = max(len(h) for hosts in shards for h in hosts)
+    for hosts in shards:
+        for host in hosts:
+            if host in recap:
+                lines.append("%-*s : %s" % (width, host, recap[host]))
+                for counter, value in re.findall(r"(\w+)=(\d+)", recap[host]):
+                    if counter in totals:
+                        totals[counter] += int(value)
+    lines.append("")
+    lines.append("Totals: " + "  ".join("%s=%d" % item for item in totals.items()))
+    lines.append("Shard exit codes: " + ", ".join(
+        "%d:%d" % (index + 1, code) for index, code in enumerate(returncodes)))
+    return "\n".join(lines) + "\n"
+
+
+def _sse_event(data, event=None, event_id=None):
+    """Format one Server-Sent Event; every line of data becomes a data: field."""
+    parts = []
+    if event_id is not None:
+        parts.append("id: %s" % event_id)
+    if event:
+        parts.append("event: %s" % event)
+    parts.extend("data: " + line for line in data.split("\n"))
+    return "\n".join(parts) + "\n\n"
+
+
+def stream_job_output(job_id, offset=0):
+    """Yield Server-Sent Events with a job's output as it is written.
+
+    Output events carry complete lines and use the character offset into the
+    run output as their id, so a reconnecting EventSource resumes exactly
+    where it left off via Last-Event-ID. A final "done" event carries the job
+    status.
+    """
+    yield ": connected\n\n"
+    last_status = None
+    last_sent = time.monotonic()
+    # While the run streams, only chunks after last_seq are read on each poll.
+    # pending holds text read but not sent yet: the trailing partial line, and
+    # on a resumed stream first the skip characters the client already has.
+    last_seq = None
+    pending = ""
+    skip = offset
+    while True:
+        job = get_job_summary(job_id)
+        if job is None:
+            yield _sse_event(json.dumps({"status": "lost"}), event="done")
+            return
+        finished = job["status"] in JOB_FINISHED_STATUSES
+        if job["status"] != last_status:
+            last_status = job["status"]
+            yield _sse_event(json.dumps({"status": last_status}), event="status")
+            last_sent = time.monotonic()
+
+        if job["run_id"] is not None:
+            if finished:
+                # The output has moved to the blob store: read the rest once.
+                with get_history_db_connection() as conn:
+                    row = conn.execute(
+                        "SELECT substr(%s, ?) AS chunk FROM playbook_runs r %s WHERE r.id = ?"
+                        % (RUN_OUTPUT_SQL, RUN_OUTPUT_JOIN), (offset + 1, job["run_id"])
+                    ).fetchone()
+                chunk = row["chunk"] if row else ""
+            else:
+                with get_history_db_connection() as conn:
+                    if last_seq is None:
+                        # Output written before chunks existed stays in the output column.
+                        row = conn.execute("SELECT output FROM playbook_runs WHERE id = ?",
+                                           (job["run_id"],)).fetchone()
+                        pending += row["output"] if row else ""
+                        last_seq = 0
+                    rows = conn.execute(
+                        "SELECT seq, chunk FROM run_output_chunks WHERE run_id = ? AND seq > ? ORDER BY seq",
+                        (job["run_id"], last_seq)
+                    ).fetchall()
+                if rows:
+                    last_seq = rows[-1]["seq"]
+                    pending += "".join(row["chunk"] for row in rows)
+                if skip:
+                    skipped = min(skip, len(pending))
+                    pending = pending[skipped:]
+                    skip -= skipped
+                # Hold back a trailing partial line until it is complete.
+                end = pending.rfind("\n") + 1
+                chunk, pending = pending[:end], pending[end:]
+            if chunk:
+                offset += len(chunk)
+                yield _sse_event(chunk[:-1] if chunk.endswith("\n") else chunk, event_id=offset)
+                last_sent = time.monotonic()
+
+        if finished:
+            yield _sse_event(json.dumps({"status": job["status"]}), event="done")
+            return
+        if time.monotonic() - last_sent >= STREAM_KEEPALIVE_INTERVAL:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        time.sleep(STREAM_POLL_INTERVAL)
+
+
+job_manager.register("playbook", _execute_playbook_job)
+
+# =============================================================================
+# History Import
+# Uploaded history files are parsed incrementally and inserted in bounded
+# transactions by an "import" background job, which reports its progress.
+# =============================================================================
+IMPORT_MODES = ("replace", "merge", "append")
+IMPORT_BATCH_SIZE = 500
+IMPORT_READ_SIZE = 64 * 1024
+IMPORT_RECORD_KEYS = ("action", "playbook", "output", "time")
+
+
+def _import_file_type(filename):
+    """Return (format, compressed) for an upload name, or None if unsupported."""
+    name = filename.lower()
+    compressed = name.endswith(".gz")
+    if compressed:
+        name = name[:-3]
+    for extension, file_format in ((".json", "json"), (".ndjson", "ndjson"),
+                                   (".jsonl", "ndjson"), (".csv", "csv")):
+        if name.endswith(extension):
+            return file_format, compressed
+    return None
+
+
+def _iter_json_array(stream, read_size=IMPORT_READ_SIZE):
+    """Yield the elements of a top-level JSON array without loading it whole."""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def peek():
+        # Skip whitespace and return the next character ("" at end of input).
+        nonlocal buffer, pos, eof
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            buffer, pos = stream.read(read_size), 0
+            eof = not buffer
+
+    if peek() != "[":
+        raise ValueError("Invalid data format: expected a list of records.")
+    pos += 1
+    if peek() == "]":
+        return
+    while True:
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A value ending at the buffer edge might continue in the next read.
+                if end < len(buffer) or eof:
+                    break
+            except ValueError:
+                if eof:
+                    raise
+            # Read at least as much as is buffered, so a huge record is
+            # re-parsed only a logarithmic number of times.
+            chunk = stream.read(max(read_size, len(buffer) - pos))
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+        pos = end
+        yield value
+        separator = peek()
+        pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError("Invalid JSON: expected ',' or ']' between records.")
+
+
+def _iter_import_records(text_stream, file_format):
+    if file_format == "csv":
+        return csv.DictReader(text_stream)
+    if file_format == "ndjson":
+        return (json.loads(line) for line in text_stream if line.strip())
+    return _iter_json_array(text_stream)
+
+
+def _clean_import_record(record):
+    """Keep only known keys, as strings. Raises ValueError for non-objects."""
+    if not isinstance(record, dict):
+        raise ValueError("Invalid record format: each entry must be a dictionary.")
+    cleaned = {}
+    for key in IMPORT_RECORD_KEYS:
+        value = record.get(key)
+        cleaned[key] = "" if value is None else value if isinstance(value, str) else str(value)
+    return cleaned
+
+
+def _is_duplicate_run(conn, record):
+    digest = hashlib.sha256(record["output"].encode("utf-8")).hexdigest()
+    return conn.execute("""
+        SELECT 1 FROM playbook_runs
+        WHERE time = ? AND playbook = ? AND action = ? AND output_hash = ?
+        LIMIT 1
+    """, (record["time"], record["playbook"], record["action"], digest)).fetchone() is not None
+
+
+def _delete_runs(conn, where, params):
+    """Delete runs matching a WHERE clause with their results, search entries and unshared outputs."""
+    rows = conn.execute("SELECT id, output_hash FROM playbook_runs WHERE " + where, params).fetchall()
+    _unindex_runs(conn, [row[0] for row in rows])
+    for table in ("run_tasks", "run_hosts", "run_output_chunks"):
+        conn.execute("DELETE FROM %s WHERE run_id IN (SELECT id FROM playbook_runs WHERE %s)"
+                     % (table, where), params)
+    conn.execute("DELETE FROM playbook_runs WHERE " + where, params)
+    _delete_orphaned_outputs(conn, [row[1] for row in rows])
+    return len(rows)
+
+
+def _set_job_progress(job_id, progress):
+    with get_history_db_connection() as conn:
+        conn.execute("UPDATE playbook_jobs SET progress = ? WHERE id = ?",
+                     (json.dumps(progress), job_id))
+
+
+def import_history_file(path, file_format, compressed=False, mode="replace",
+                        on_progress=None):
+    """Import history records from a file in bounded-size transactions.
+
+    mode "append" inserts every record, "merge" skips records already present
+    (same time, playbook, action and output), and "replace" additionally
+    removes the finished runs that existed when the import started, once
+    every record has been imported; runs still streaming output are kept. If the file turns out to be invalid part-way, rows
+    inserted by this import are removed again. Returns the final progress.
+    """
+    conn = get_history_db_connection()
+    total_bytes = os.path.getsize(path)
+    progress = {"processed": 0, "inserted": 0, "skipped": 0, "removed": 0,
+                "bytes_read": 0, "total_bytes": total_bytes}
+    # Each batch is a single write transaction, so its ids are contiguous.
+    inserted_ranges = []
+    with conn:
+        replace_up_to = conn.execute("SELECT COALESCE(MAX(id), 0) FROM playbook_runs").fetchone()[0]
+
+    with open(path, "rb") as raw:
+        binary = gzip.GzipFile(fileobj=raw) if compressed else raw
+        text_stream = TextIOWrapper(binary, encoding="utf-8", newline="" if file_format == "csv" else None)
+        records = _iter_import_records(text_stream, file_format)
+        try:
+            while True:
+                batch = [_clean_import_record(r) for r in itertools.islice(records, IMPORT_BATCH_SIZE)]
+                if not batch:
+                    break
+                with conn:
+                    first_id = last_id = None
+                    for record in batch:
+                        if mode == "merge" and _is_duplicate_run(conn, record):
+                            progress["skipped"] += 1
+                            continue
+                        last_id = _insert_history_record(conn, record)
+                        first_id = first_id or last_id
+                        progress["inserted"] += 1
+                if first_id is not None:
+                    inserted_ranges.append((first_id, last_id))
+                progress["processed"] += len(batch)
+                progress["bytes_read"] = raw.tell()
+                if on_progress:
+                    on_progress(progress)
+        except Exception:
+            for first_id, last_id in inserted_ranges:
+                with conn:
+                    _delete_runs(conn, "id BETWEEN ? AND ?", (first_id, last_id))
+            raise
+
+    if mode == "replace":
+        progress["removed"] += _delete_run_batches(conn, lambda limit: _finished_ids(
+            conn, "id <= ?", (replace_up_to,), limit))
+    if on_progress:
+        on_progress(progress)
+    return progress
+
+
+def _execute_import_job(job):
+    """Job handler: import an uploaded history file, then delete the upload."""
+    options = job["options"]
+    try:
+        progress = import_history_file(
+            options["path"], options["format"], compressed=options["compressed"],
+            mode=options["mode"], on_progress=lambda p: _set_job_progress(job["id"], p)
+        )
+    finally:
+        try:
+            os.remove(options["path"])
+        except OSError:
+            pass
+    logger.info("History imported from %s: %d inserted, %d skipped, %d removed",
+                job["playbook"], progress["inserted"], progress["skipped"], progress["removed"])
+    return "succeeded", None
+
+
+job_manager.register("import", _execute_import_job)
+
+
+# =============================================================================
+# History Retention and Compaction
+# A background compactor trims playbook_runs to the configured retention
+# policy in small batches and hands freed pages back with incremental VACUUM.
+# =============================================================================
+RETENTION_LIMITS = ("max_age_days", "max_rows", "max_output_bytes")
+DEFAULT_COMPACTION_INTERVAL = 3600
+COMPACTION_POLL_INTERVAL = 60
+COMPACTION_BATCH_SIZE = 200
+VACUUM_BATCH_PAGES = 1000
+
+
+def get_retention_policy():
+    """Return the configured retention policy, with unset limits as None.
+
+    ``keep_last_per_playbook`` is either a number or a mapping of playbook
+    name to number, where the key ``"*"`` applies to unlisted playbooks.
+    """
+    policy = dict(config_cache.get().get("history_retention") or {})
+    for key in RETENTION_LIMITS + ("keep_last_per_playbook",):
+        policy.setdefault(key, None)
+    policy.setdefault("interval_seconds", DEFAULT_COMPACTION_INTERVAL)
+    return policy
+
+
+def validate_retention_policy(policy):
+    """Return a cleaned copy of a retention policy or raise ValueError."""
+    if not isinstance(policy, dict):
+        raise ValueError("Retention policy must be an object")
+
+    def limit(name, value):
+        if value is None or value == "":
+            return None
+        if isinstance(value, bool):
+            raise ValueError("%s must be a positive integer" % name)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError("%s must be a positive integer" % name)
+        if value < 1:
+            raise ValueError("%s must be a positive integer" % name)
+        return value
+
+    cleaned = {key: limit(key, policy.get(key)) for key in RETENTION_LIMITS}
+    keep_last = policy.get("keep_last_per_playbook")
+    if isinstance(keep_last, dict):
+        cleaned["keep_last_per_playbook"] = {
+            str(name): limit("keep_last_per_playbook[%s]" % name, value)
+            for name, value in keep_last.items()
+        }
+    else:
+        cleaned["keep_last_per_playbook"] = limit("keep_last_per_playbook", keep_last)
+    cleaned["interval_seconds"] = limit("interval_seconds", policy.get("interval_seconds")) \
+        or DEFAULT_COMPACTION_INTERVAL
+    return cleaned
+
+
+def _history_db_size(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return {
+        "bytes": conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+        "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+    }
+
+
+def _delete_run_batches(conn, select_ids):
+    """Delete runs in small transactions. select_ids(limit) returns the next ids."""
+    deleted = 0
+    while True:
+        with conn:
+            ids = select_ids(COMPACTION_BATCH_SIZE)
+            if not ids:
+                return deleted
+            placeholders = ",".join("?" * len(ids))
+            deleted += _delete_runs(conn, "id IN (%s)" % placeholders, ids)
+
+
+def _finished_ids(conn, where, params, limit):
+    # Runs still streaming (no output_hash yet) are never removed.
+    return [row[0] for row in conn.execute(
+        "SELECT id FROM playbook_runs WHERE output_hash IS NOT NULL AND %s ORDER BY id LIMIT ?" % where,
+        list(params) + [limit]
+    ).fetchall()]
+
+
+def _enforce_keep_last(conn, keep_last):
+    if isinstance(keep_last, dict):
+        default = keep_last.get("*")
+        overrides = {name: n for name, n in keep_last.items() if name != "*"}
+    else:
+        default, overrides = keep_last, {}
+    deleted = 0
+    for (playbook,) in conn.execute("SELECT DISTINCT playbook FROM playbook_runs").fetchall():
+        keep = overrides.get(playbook, default)
+        if not keep:
+            continue
+        # The newest id that falls outside the keep window, via the (playbook, id) index.
+        row = conn.execute(
+            "SELECT id FROM playbook_runs WHERE playbook = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+            (playbook, keep)
+        ).fetchone()
+        if row is not None:
+            deleted += _delete_run_batches(conn, lambda limit, p=playbook, last=row[0]: _finished_ids(
+                conn, "playbook = ? AND id <= ?", (p, last), limit))
+    return deleted
+
+
+def _enforce_max_output_bytes(conn, max_bytes):
+    """Delete the oldest runs until the stored output blobs fit in max_bytes.
+
+    The total is summed once; each deleted run then only counts against the
+    excess when it releases the last reference to its blob. The total is
+    summed again only when that estimate says the excess is gone.
+    """
+    state = {"excess": 0, "after": 0}
+    references = {}
+
+    def select_ids(limit):
+        if state["excess"] <= 0:
+            state["excess"] = conn.execute(
+                "SELECT COALESCE(SUM(length(data)), 0) FROM run_outputs"
+            ).fetchone()[0] - max_bytes
+            if state["excess"] <= 0:
+                return []
+        ids = []
+        for run_id, digest, size in conn.execute("""
+            SELECT r.id, r.output_hash, length(o.data) FROM playbook_runs r
+            JOIN run_outputs o ON o.hash = r.output_hash
+            WHERE r.id > ? ORDER BY r.id LIMIT ?
+        """, (state["after"], limit)).fetchall():
+            ids.append(run_id)
+            if digest not in references:
+                references[digest] = conn.execute(
+                    "SELECT COUNT(*) FROM playbook_runs WHERE output_hash = ?", (digest,)
+                ).fetchone()[0]
+            references[digest] -= 1
+            if references[digest] == 0:
+                state["excess"] -= size
+                if state["excess"] <= 0:
+                    break
+        if ids:
+            state["after"] = ids[-1]
+        return ids
+    return _delete_run_batches(conn, select_ids)
+
+
+def _incremental_vacuum(conn):
+    """Return free pages to the filesystem a batch at a time."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Databases created before incremental vacuum was enabled need one
+        # full VACUUM to switch modes; later runs only free pages.
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return
+    while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+        conn.execute("PRAGMA incremental_vacuum(%d)" % VACUUM_BATCH_PAGES).fetchall()
+
+
+def compact_history(policy=None):
+    """Apply a retention policy to the run history and reclaim the space.
+
+    Each limit is enforced separately, oldest runs first, and a run is
+    removed once it falls outside any of them. Returns the recorded stats.
+    """
+    policy = validate_retention_policy(get_retention_policy() if policy is None else policy)
+    conn = get_history_db_connection()
+    started = time.time()
+    size_before = _history_db_size(conn)
+    with conn:
+        outputs_before = conn.execute("SELECT COUNT(*) FROM run_outputs").fetchone()[0]
+
+    deleted = 0
+    if policy["max_age_days"]:
+        cutoff = (datetime.now() - timedelta(days=policy["max_age_days"])).strftime("%Y-%m-%d %H:%M:%S")
+        deleted += _delete_run_batches(conn, lambda limit: _finished_ids(conn, "time < ?", (cutoff,), limit))
+    if policy["max_rows"]:
+        with conn:
+            row = conn.execute("SELECT id FROM playbook_runs ORDER BY id DESC LIMIT 1 OFFSET ?",
+                               (policy["max_rows"],)).fetchone()
+        if row is not None:
+            deleted += _delete_run_batches(conn, lambda limit: _finished_ids(conn, "id <= ?", (row[0],), limit))
+    if policy["keep_last_per_playbook"]:
+        deleted += _enforce_keep_last(conn, policy["keep_last_per_playbook"])
+    if policy["max_output_bytes"]:
+        deleted += _enforce_max_output_bytes(conn, policy["max_output_bytes"])
+
+    _incremental_vacuum(conn)
+    size_after = _history_db_size(conn)
+    stats = {
+        "started_at": datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S"),
+        "duration": round(time.time() - started, 3),
+        "runs_deleted": deleted,
+        "outputs_deleted": outputs_before - conn.execute("SELECT COUNT(*) FROM run_outputs").fetchone()[0],
+        "bytes_before": size_before["bytes"],
+        "bytes_after": size_after["bytes"],
+        "reclaimed_bytes": size_before["bytes"] - size_after["bytes"],
+    }
+    with conn:
+        conn.execute("""
+            INSERT INTO history_compactions
+            (started_at, duration, runs_deleted, outputs_deleted, bytes_before, bytes_after, reclaimed_bytes)
+            VALUES (:started_at, :duration, :runs_deleted, :outputs_deleted, :bytes_before, :bytes_after, :reclaimed_bytes)
+        """, stats)
+    logger.info("History compacted: %d runs removed, %d bytes reclaimed", deleted, stats["reclaimed_bytes"])
+    return stats
+
+
+def get_compaction_stats(limit=10):
+    """Return recent compactions (newest first), their totals and the database size."""
+    with get_history_db_connection() as conn:
+        recent = [dict(row) for row in conn.execute(
+            "SELECT * FROM history_compactions ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()]
+        totals = dict(conn.execute("""
+            SELECT COUNT(*) AS compactions,
+                   COALESCE(SUM(runs_deleted), 0) AS runs_deleted,
+                   COALESCE(SUM(reclaimed_bytes), 0) AS reclaimed_bytes
+            FROM history_compactions
+        """).fetchone())
+        database = _history_db_size(conn)
+        database["runs"] = conn.execute("SELECT COUNT(*) FROM playbook_runs").fetchone()[0]
+    return {"recent": recent, "totals": totals, "database": database}
+
+
+def _execute_compaction_job(job):
+    """Job handler: compact now, waiting for a compaction in another worker."""
+    with HistoryCompactor.locked(blocking=True):
+        compact_history()
+    return "succeeded", None
+
+
+job_manager.register("compact", _execute_compaction_job)
+
+
+class HistoryCompactor:
+    """Background thread that compacts history when the policy is due.
+
+    Every Gunicorn worker runs one, but a file lock and the time of the
+    last recorded compaction make sure only one of them does the work.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @staticmethod
+    @contextlib.contextmanager
+    def locked(blocking=False):
+        """Hold the cross-process compaction lock; yields False if busy."""
+        with open(get_history_db_file() + ".compact.lock", "a") as lock:
+            if fcntl is None:
+                yield True
+                return
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def ensure_running(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._loop, name="ansiblepower-compactor", daemon=True).start()
+
+    def _due(self, policy):
+        if not any(policy[key] for key in RETENTION_LIMITS + ("keep_last_per_playbook",)):
+            return False
+        with get_history_db_connection() as conn:
+            row = conn.execute("SELECT MAX(started_at) FROM history_compactions").fetchone()
+        if not row[0]:
+            return True
+        last = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
+        return (datetime.now() - last).total_seconds() >= policy["interval_seconds"]
+
+    def _loop(self):
+        while True:
+            time.sleep(COMPACTION_POLL_INTERVAL)
+            try:
+                policy = validate_retention_policy(get_retention_policy())
+                if not self._due(policy):
+                    continue
+                with self.locked() as acquired:
+                    # Re-check under the lock: another worker may just have finished.
+                    if acquired and self._due(policy):
+                        compact_history(policy)
+            except Exception:
+                logger.exception("History compaction failed")
+
+
+history_compactor = HistoryCompactor()
+
+
+# =============================================================================
+# System Sampler
+# A background thread samples the control node every SYSTEM_SAMPLE_INTERVAL
+# seconds into a fixed-size ring buffer, so status requests never wait on
+# psutil and can return recent history for graphs.
+# =============================================================================
+SYSTEM_SAMPLE_INTERVAL = 5
+SYSTEM_SAMPLE_HISTORY = 3600  # seconds kept in the ring buffer
+SYSTEM_STATUS_WINDOW = 900
+
+
+def _count_ansible_processes():
+    """Count ansible-playbook processes started by this process, with their forked workers."""
+    try:
+        children = psutil.Process().children(recursive=True)
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return 0
+    count = 0
+    for proc in children:
+        try:
+            # A script run through its interpreter shows up as "python .../ansible-playbook".
+            names = [proc.exe()] + proc.cmdline()[1:2]
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        if any(os.path.basename(name) == "ansible-playbook" for name in names):
+            count += 1
+    return count
+
+
+def sample_system():
+    """Take one sample of the control node. Never blocks on CPU measurement."""
+    try:
+        load = [round(float(value), 2) for value in os.getloadavg()]
+    except (AttributeError, OSError):
+        load = None
+    try:
+        disk = float(psutil.disk_usage(os.path.dirname(get_history_db_file()) or ".").percent)
+    except OSError:
+        disk = None
+    return {
+        "time": int(time.time()),
+        "cpu": float(psutil.cpu_percent(interval=None)),
+        "memory": float(psutil.virtual_memory().percent),
+        "load": load,
+        "disk": disk,
+        "ansible_processes": int(_count_ansible_processes()),
+    }
+
+
+class SystemSampler:
+    """Per-process background sampler with a ring buffer of recent samples."""
+
+    def __init__(self, interval=SYSTEM_SAMPLE_INTERVAL, history=SYSTEM_SAMPLE_HISTORY):
+        self.interval = interval
+        self._samples = deque(maxlen=max(1, int(history // interval)))
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_running(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._samples.clear()
+            threading.Thread(target=self._loop, name="ansiblepower-sampler", daemon=True).start()
+
+    def _record(self):
+        sample = sample_system()
+        with self._lock:
+            self._samples.append(sample)
+        return sample
+
+    def _loop(self):
+        # cpu_percent(None) measures since the previous call; prime it first.
+        psutil.cpu_percent(interval=None)
+        time.sleep(1)
+        while True:
+            try:
+                self._record()
+            except Exception:
+                logger.exception("System sampling failed")
+            time.sleep(self.interval)
+
+    def latest(self):
+        """Return the newest sample, taking one now if there is none yet."""
+        with self._lock:
+            if self._samples:
+                return self._samples[-1]
+        return self._record()
+
+    def window(self, seconds):
+        """Return the samples of the last seconds, oldest first."""
+        cutoff = time.time() - seconds
+        with self._lock:
+            return [sample for sample in self._samples if sample["time"] >= cutoff]
+
+
+system_sampler = SystemSampler()
+
+
+# =============================================================================
+# Playbook Index
+# The playbooks directory is walked once and then kept up to date from
+# directory and file mtimes, so listing playbooks costs no filesystem work
+# on the request path.
+# =============================================================================
+PLAYBOOK_EXTENSIONS = (".yml", ".yaml")
+PLAYBOOK_INDEX_CHECK_INTERVAL = 2.0
+PLAYBOOK_FILE_CHECK_INTERVAL = 30.0
+PLAYBOOK_PARSE_LIMIT = 1024 * 1024
+# Directories that hold Ansible content other than playbooks.
+PLAYBOOK_SKIP_DIRS = {"roles", "group_vars", "host_vars", "collections", "__pycache__"}
+
+
+def parse_playbook_summary(text):
+    """Return (play names, hosts patterns) from a playbook's top-level plays.
+
+    Only the keys of top-level list items are read, line by line, so this
+    stays cheap for large files and does not need a YAML library.
+    """
+    names, hosts, in_play = [], [], False
+    for line in text.splitlines():
+        if line.startswith("- "):
+            in_play, line = True, "  " + line[2:]
+        elif line[:1] not in ("", " ", "#"):
+            in_play = False
+        if not in_play or not line.startswith("  ") or line[2:3] in (" ", "#", ""):
+            continue
+        key, sep, value = line[2:].partition(":")
+        value = value.split(" #")[0].strip().strip("'\"")
+        if sep and value and key in ("name", "hosts"):
+            (names if key == "name" else hosts).append(value)
+    return names, hosts
+
+
+class PlaybookIndex:
+    """In-memory index of the playbooks under a directory, including subfolders.
+
+    get() serves a snapshot and, at most every PLAYBOOK_INDEX_CHECK_INTERVAL
+    seconds, re-lists only the directories whose mtime changed. Files are
+    re-parsed when their mtime or size changed; files in unchanged
+    directories (edited in place) are checked every PLAYBOOK_FILE_CHECK_INTERVAL
+    seconds. Playbooks in the top-level
+    directory are always listed; in subfolders, only files that declare
+    ``hosts`` or ``import_playbook`` are, so task files are left out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._root = None
+        self._dirs = {}
+        self._files = {}
+        self._checked = 0.0
+        self._files_checked = 0.0
+        self._snapshot = None
+
+    def get(self, root):
+        """Return {"playbooks": [...], "error": ..., "missing": ...} for root."""
+        snapshot = self._snapshot
+        if (snapshot is not None and self._root == root
+                and time.monotonic() - self._checked < PLAYBOOK_INDEX_CHECK_INTERVAL):
+            return snapshot
+        with self._lock:
+            if self._root != root:
+                self._root, self._dirs, self._files = root, {}, {}
+            self._refresh()
+            return self._snapshot
+
+    def _refresh(self):
+        self._checked = time.monotonic()
+        check_all_files = self._checked - self._files_checked >= PLAYBOOK_FILE_CHECK_INTERVAL
+        if check_all_files:
+            self._files_checked = self._checked
+        root = self._root
+        if not os.path.isdir(root):
+            self._dirs, self._files = {}, {}
+            self._snapshot = {"playbooks": [], "error": None, "missing": True}
+            return
+        if not (os.access(root, os.R_OK) and os.access(root, os.W_OK)):
+            self._snapshot = {"playbooks": [], "missing": False, "error": (
+                f"Insufficient permissions for the playbooks directory '{root}'. "
+                "Ensure the directory is readable and writable by the current user.")}
+            return
+
+        changed_dirs = set()
+        pending = list(self._dirs) or [""]
+        seen_dirs = set()
+        while pending:
+            rel_dir = pending.pop()
+            if rel_dir in seen_dirs:
+                continue
+            path = os.path.join(root, rel_dir)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue  # removed; dropped below with its files
+            seen_dirs.add(rel_dir)
+            if self._dirs.get(rel_dir) == mtime:
+                continue
+            changed_dirs.add(rel_dir)
+            self._dirs[rel_dir] = mtime
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.name.startswith("."):
+                            continue
+                        rel = os.path.join(rel_dir, entry.name)
+                        # Symlinked directories are not followed, so links cannot loop.
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in PLAYBOOK_SKIP_DIRS:
+                                pending.append(rel)
+                        elif entry.name.endswith(PLAYBOOK_EXTENSIONS) and rel not in self._files:
+                            self._files[rel] = None
+            except OSError as e:
+                logger.error("Error listing playbooks in %s: %s", path, e)
+
+        changed = bool(changed_dirs)
+        for rel_dir in [d for d in self._dirs if d not in seen_dirs]:
+            del self._dirs[rel_dir]
+            changed = True
+        for rel in list(self._files):
+            rel_dir = os.path.dirname(rel)
+            if rel_dir not in seen_dirs:
+                del self._files[rel]
+                changed = True
+            elif check_all_files or rel_dir in changed_dirs:
+                changed |= self._update_file(rel)
+
+        if changed or self._snapshot is None:
+            playbooks = [state[3] for _, state in sorted(self._files.items()) if state[2]]
+            self._snapshot = {"playbooks": playbooks, "error": None, "missing": False}
+
+    def _update_file(self, rel):
+        """Re-parse a file if it changed. Returns True if the index changed."""
+        path = os.path.join(self._root, rel)
+        try:
+            st = os.stat(path)
+        except OSError:
+            del self._files[rel]
+            return True
+        state = self._files[rel]
+        if state is not None and state[:2] == (st.st_size, st.st_mtime_ns):
+            return False
+        try:
+            with open(path, "r", errors="replace") as f:
+                text = f.read(PLAYBOOK_PARSE_LIMIT)
+        except OSError:
+            text = ""
+        names, hosts = parse_playbook_summary(text)
+        listed = os.sep not in rel or bool(hosts) or "import_playbook:" in text
+        entry = {
+            "name": rel.replace(os.sep, "/"),
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "plays": names,
+            "hosts": hosts,
+        }
+        self._files[rel] = (st.st_size, st.st_mtime_ns, listed, entry)
+        return True
+
+
+playbook_index = PlaybookIndex()
+
+
+# =============================================================================
+# File Content Cache
+# Playbook and inventory bodies are kept in memory keyed by their stat
+# signature and served with strong ETags, so repeat views cost one stat().
+# =============================================================================
+CONTENT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+
+class FileContentCache:
+    """LRU cache of small text files, bounded by total size.
+
+    An entry is reused while the file's size, mtime and inode are unchanged.
+    Each entry carries a strong ETag derived from the content itself. Files
+    larger than the whole budget are read but never cached.
+    """
+
+    def __init__(self, max_bytes=CONTENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return (content, etag). Raises OSError if the file cannot be read."""
+        st = os.stat(path)
+        signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                return entry[1], entry[2]
+
+        with open(path, "r") as f:
+            content = f.read()
+        etag = hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+        with self._lock:
+            self._discard(path)
+            if st.st_size <= self.max_bytes:
+                self._entries[path] = (signature, content, etag)
+                self._size += st.st_size
+                while self._size > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+        return content, etag
+
+    def invalidate(self, path):
+        with self._lock:
+            self._discard(path)
+
+    def _discard(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._size -= entry[0][0]
+
+
+content_cache = FileContentCache()
+
+
+def _conditional_content_response(content, etag):
+    """JSON response for a file body, or 304 when the client's copy is current."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({"content": content})
+    response.set_etag(etag)
+    # Clients keep their own copy and must revalidate it on every use.
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+# =============================================================================
+# Inventory Model
+# The hosts file is parsed once per content version into groups, hosts,
+# children and vars, so host patterns can be resolved without Ansible.
+# =============================================================================
+INVENTORY_YAML_EXTENSIONS = (".yml", ".yaml", ".json")
+INVENTORY_SECTION = re.compile(r"^\[([^:\]\s]+)(?::(\w+))?\]\s*(?:[#;].*)?$")
+INVENTORY_HOST_RANGE = re.compile(r"^(.*?)\[([0-9a-zA-Z]+):([0-9a-zA-Z]+)(?::(\d+))?\](.*)$")
+INVENTORY_SUBSCRIPT = re.compile(r"^(.+)\[(-?\d+)(?::(-?\d*))?\]$")
+
+
+class InventoryError(ValueError):
+    """Raised for an inventory that Ansible would refuse to load."""
+
+
+def expand_host_range(pattern):
+    """Expand Ansible host ranges such as web[01:10].example.com or db-[a:c]."""
+    match = INVENTORY_HOST_RANGE.match(pattern)
+    if not match:
+        return [pattern]
+    head, start, end, step, tail = match.groups()
+    step = int(step or 1)
+    if start.isdigit() and end.isdigit():
+        # A leading zero pads every generated number to the same width.
+        width = len(start) if start.startswith("0") and len(start) > 1 else 0
+        values = ["%0*d" % (width, n) for n in range(int(start), int(end) + 1, step)]
+    elif len(start) == 1 and len(end) == 1 and start.isalpha() and end.isalpha():
+        values = [chr(c) for c in range(ord(start), ord(end) + 1, step)]
+    else:
+        raise InventoryError("Invalid host range: %s" % pattern)
+    if not values:
+        raise InventoryError("Empty host range: %s" % pattern)
+    return [host for value in values for host in expand_host_range(head + value + tail)]
+
+
+class Inventory:
+    """Groups, hosts and vars of an inventory, with Ansible host pattern lookups."""
+
+    def __init__(self):
+        self.hosts = {}    # host -> vars, in inventory order
+        self.groups = {}   # group -> {"hosts": [...], "children": [...], "vars": {...}}
+        self._members = {}
+        for name in ("all", "ungrouped"):
+            self.add_group(name)
+
+    def add_group(self, name):
+        return self.groups.setdefault(name, {"hosts": [], "children": [], "vars": {}})
+
+    def add_host(self, name, group, host_vars=None):
+        self.hosts.setdefault(name, {}).update(host_vars or {})
+        members = self.add_group(group)["hosts"]
+        if name not in members:
+            members.append(name)
+
+    def add_child(self, parent, child):
+        self.add_group(child)
+        children = self.add_group(parent)["children"]
+        if child not in children:
+            children.append(child)
+
+    def finalize(self):
+        """Check for cycles and precompute group membership."""
+        grouped = set()
+        for name in self.groups:
+            if name not in ("all", "ungrouped"):
+                grouped.update(self.group_hosts(name))
+        for name, group in self.groups.items():
+            if name == "ungrouped":
+                # Like Ansible, a host in any other group is not ungrouped, even if listed there.
+                group["hosts"] = [h for h in self.hosts if h not in grouped]
+        self._members["all"] = list(self.hosts)
+        return self
+
+    def group_hosts(self, name, _path=()):
+        """Hosts of a group and all of its descendants, in inventory order."""
+        if name in self._members:
+            return self._members[name]
+        if name in _path:
+            raise InventoryError("Group %s is its own child" % name)
+        group = self.groups[name]
+        seen = dict.fromkeys(group["hosts"])
+        for child in group["children"]:
+            seen.update(dict.fromkeys(self.group_hosts(child, _path + (name,))))
+        self._members[name] = list(seen)
+        return self._members[name]
+
+    def _match_term(self, term):
+        if term in ("all", "*"):
+            return self._members["all"]
+        if term in self.groups:
+            return self.group_hosts(term)
+        if term in self.hosts:
+            return [term]
+        subscript = None if term.startswith("~") else INVENTORY_SUBSCRIPT.match(term)
+        if subscript:
+            hosts = self._match_term(subscript.group(1))
+            start = int(subscript.group(2))
+            if subscript.group(3) is None:
+                return hosts[start:start + 1] if start != -1 else hosts[-1:]
+            end = int(subscript.group(3)) if subscript.group(3) else len(hosts)
+            return hosts[start:end + 1 if end != -1 else None]
+        if term.startswith("~"):
+            regex = re.compile(term[1:])
+            matches = lambda name: regex.match(name)
+        elif any(c in term for c in "*?["):
+            matches = lambda name: fnmatch.fnmatchcase(name, term)
+        else:
+            return []
+        found = {}
+        for name in self.groups:
+            if matches(name):
+                found.update(dict.fromkeys(self.group_hosts(name)))
+        found.update((h, None) for h in self.hosts if matches(h))
+        return list(found)
+
+    def resolve(self, pattern):
+        """Return the hosts an Ansible host pattern selects, in inventory order.
+
+        Supports unions (``a:b`` or ``a,b``), intersections (``&``),
+        exclusions (``!``), wildcards, ``~regex`` and subscripts (``web[0:2]``).
+        """
+        # Colons inside subscripts such as web[0:2] do not separate terms.
+        separator = "," if "," in pattern else r":(?![^\[]*\])"
+        terms = [t.strip() for t in re.split(separator, pattern) if t.strip()]
+        # Like Ansible: unions first, then intersections, then exclusions.
+        unions = [t for t in terms if t[0] not in "&!"] or ["all"]
+        selected = {}
+        for term in unions:
+            selected.update(dict.fromkeys(self._match_term(term)))
+        for term in terms:
+            if term[0] == "&":
+                keep = set(self._match_term(term[1:]))
+                selected = {h: None for h in selected if h in keep}
+        for term in terms:
+            if term[0] == "!":
+                drop = set(self._match_term(term[1:]))
+                selected = {h: None for h in selected if h not in drop}
+        order = {h: i for i, h in enumerate(self.hosts)}
+        return sorted(selected, key=order.__getitem__)
+
+    def to_dict(self):
+        return {
+            "groups": [
+                {"name": name, "hosts": len(self.group_hosts(name)), "direct_hosts": group["hosts"],
+                 "children": group["children"], "vars": group["vars"]}
+                for name, group in self.groups.items()
+            ],
+            "host_count": len(self.hosts),
+        }
+
+
+def _inventory_vars(tokens, lineno):
+    host_vars = {}
+    for token in tokens:
+        key, sep, value = token.partition("=")
+        if not sep or not key:
+            raise InventoryError("line %d: expected key=value, got %r" % (lineno, token))
+        host_vars[key] = value
+    return host_vars
+
+
+def parse_ini_inventory(text):
+    """Parse an INI inventory the way Ansible's ini plugin does."""
+    inventory = Inventory()
+    group, kind = "ungrouped", "hosts"
+    group_vars = {}  # applied at the end: [x:vars] may come before [x]
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line.startswith("["):
+            match = INVENTORY_SECTION.match(line)
+            if not match:
+                raise InventoryError("line %d: invalid section header %r" % (lineno, line))
+            group, kind = match.group(1), match.group(2) or "hosts"
+            if kind not in ("hosts", "vars", "children"):
+                raise InventoryError("line %d: unknown section type :%s" % (lineno, kind))
+            if kind == "vars":
+                group_vars.setdefault(group, (lineno, {}))
+            else:
+                inventory.add_group(group)
+            continue
+        try:
+            tokens = shlex.split(line, comments=True)
+        except ValueError as e:
+            raise InventoryError("line %d: %s" % (lineno, e))
+        if not tokens:
+            continue
+        if kind == "vars":
+            key, sep, value = line.partition("=")
+            if not sep or not key.strip():
+                raise InventoryError("line %d: expected key=value in [%s:vars]" % (lineno, group))
+            group_vars[group][1][key.strip()] = value.strip()
+        elif kind == "children":
+            if len(tokens) != 1:
+                raise InventoryError("line %d: expected one group name in [%s:children]" % (lineno, group))
+            inventory.add_child(group, tokens[0])
+        else:
+            host_vars = _inventory_vars(tokens[1:], lineno)
+            pattern = tokens[0]
+            name, sep, port = pattern.rpartition(":")
+            if sep and port.isdigit() and ":" not in re.sub(r"\[[^\]]*\]", "", name):
+                pattern, host_vars["ansible_port"] = name, port
+            for host in expand_host_range(pattern):
+                inventory.add_host(host, group, host_vars)
+    for name, (lineno, values) in group_vars.items():
+        if name not in inventory.groups:
+            raise InventoryError("line %d: [%s:vars] refers to an undefined group" % (lineno, name))
+        inventory.groups[name]["vars"].update(values)
+    return inventory.finalize()
+
+
+def parse_yaml_inventory(text):
+    """Parse a YAML (or JSON) inventory of nested hosts/children/vars maps."""
+    if yaml is None:
+        raise RuntimeError("PyYAML is required to read YAML inventories (pip install PyYAML)")
+    try:
+        data = yaml.safe_load(text) or {}
+    except yaml.YAMLError as e:
+        raise InventoryError(str(e))
+    if not isinstance(data, dict):
+        raise InventoryError("the inventory must be a mapping of groups")
+    inventory = Inventory()
+
+    def load_group(name, body):
+        if body is None:
+            body = {}
+        if not isinstance(body, dict):
+            raise InventoryError("group %s must be a mapping" % name)
+        unknown = set(body) - {"hosts", "children", "vars"}
+        if unknown:
+            raise InventoryError("group %s has unknown keys: %s" % (name, ", ".join(sorted(unknown))))
+        inventory.add_group(name)["vars"].update(body.get("vars") or {})
+        for pattern, host_vars in (body.get("hosts") or {}).items():
+            for host in expand_host_range(str(pattern)):
+                inventory.add_host(host, name, host_vars if isinstance(host_vars, dict) else {})
+        for child, child_body in (body.get("children") or {}).items():
+            inventory.add_child(name, child)
+            load_group(child, child_body)
+
+    for name, body in data.items():
+        load_group(str(name), body)
+    return inventory.finalize()
+
+
+def parse_inventory(text, filename=""):
+    """Parse inventory text, choosing the format from the extension or content."""
+    first = next((l for l in text.splitlines() if l.strip() and l.lstrip()[0] not in "#;"), "")
+    if filename.lower().endswith(INVENTORY_YAML_EXTENSIONS) or first.startswith(("---", "{")) \
+            or re.match(r"^[\w.-]+:\s*$", first):
+        return parse_yaml_inventory(text)
+    return parse_ini_inventory(text)
+
+
+_inventory_cache = {}
+_inventory_cache_lock = threading.Lock()
+
+
+def get_inventory():
+    """Return the parsed hosts file, re-parsed only when its content changes."""
+    hosts_file = get_hosts_file()
+    content, etag = content_cache.get(hosts_file)
+    cached = _inventory_cache.get(hosts_file)
+    if cached is not None and cached[0] == etag:
+        return cached[1]
+    inventory = parse_inventory(content, hosts_file)
+    with _inventory_cache_lock:
+        _inventory_cache.clear()
+        _inventory_cache[hosts_file] = (etag, inventory)
+    return inventory
+
+
+# =============================================================================
+# Fact Cache
+# Runs share a jsonfile fact cache under data/, one JSON file per host, so
+# back-to-back runs against the same hosts skip fact gathering.
+# =============================================================================
+def _fact_cache_path(host):
+    """Path of a host's cache file, or None for names that are not plain host names."""
+    if not host or host.startswith(".") or os.path.basename(host) != host:
+        return None
+    return os.path.join(get_fact_cache_dir(), host)
+
+
+def list_cached_facts():
+    """Return the hosts with cached facts, their size, age and whether they expired."""
+    timeout = get_fact_cache_settings()["timeout"]
+    now = time.time()
+    hosts = []
+    try:
+        with os.scandir(get_fact_cache_dir()) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                st = entry.stat()
+                hosts.append({
+                    "host": entry.name,
+                    "size": st.st_size,
+                    "updated": datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+                    "expired": now - st.st_mtime > timeout,
+                })
+    except FileNotFoundError:
+        pass
+    return sorted(hosts, key=lambda h: h["host"])
+
+
+def get_cached_facts(host):
+    """Return a host's cached facts, or None if there are none."""
+    path = _fact_cache_path(host)
+    if path is None:
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def invalidate_cached_facts(host):
+    """Drop one host's facts so the next run gathers them again. Returns True if removed."""
+    path = _fact_cache_path(host)
+    if path is None:
+        return False
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def purge_fact_cache():
+    """Drop every cached host and return how many were removed."""
+    removed = 0
+    for entry in list_cached_facts():
+        removed += invalidate_cached_facts(entry["host"])
+    return removed
+
+
+# =============================================================================
+# Run Results
+# The bundled ansiblepower_results callback writes each task result and the
+# final per-host recap as JSON lines; they are loaded into run_tasks and
+# run_hosts so failure and change queries are index lookups, not output scans.
+# =============================================================================
+RESULT_STATUSES = ("ok", "changed", "failed", "skipped", "unreachable")
+RESULT_BATCH_SIZE = 500
+
+
+def _iter_result_records(path):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A run killed mid-write can leave a truncated last line.
+                continue
+            if isinstance(record, dict) and isinstance(record.get("host"), str):
+                yield record
+
+
+def _count(record, key):
+    try:
+        return int(record.get(key) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _duration(record):
+    try:
+        return max(0.0, float(record["duration"]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def record_run_results(run_id, path):
+    """Load a results file into run_hosts and run_tasks. Returns (hosts, tasks) counts."""
+    if not os.path.exists(path):
+        return 0, 0
+    hosts, tasks = [], []
+    host_count = task_count = 0
+    with get_history_db_connection() as conn:
+        def flush():
+            conn.executemany("""
+                INSERT OR REPLACE INTO run_hosts
+                    (run_id, host, ok, changed, unreachable, failed, skipped, rescued, ignored)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, hosts)
+            conn.executemany("""
+                INSERT INTO run_tasks (run_id, host, play, task, action, role, status, ignored, msg, duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, tasks)
+            del hosts[:], tasks[:]
+
+        for record in _iter_result_records(path):
+            if record.get("type") == "host":
+                hosts.append((run_id, record["host"]) + tuple(
+                    _count(record, key) for key in RECAP_COUNTERS))
+                host_count += 1
+            elif record.get("type") == "task" and record.get("status") in RESULT_STATUSES:
+                tasks.append((run_id, record["host"], record.get("play"), str(record.get("task") or ""),
+                              record.get("action"), record.get("role"), record["status"],
+                              1 if record.get("ignored") else 0, record.get("msg") or None,
+                              _duration(record)))
+                task_count += 1
+            if len(hosts) + len(tasks) >= RESULT_BATCH_SIZE:
+                flush()
+        flush()
+    return host_count, task_count
+
+
+def get_run_results(run_id):
+    """Return a run's per-host recap and task results."""
+    with get_history_db_connection() as conn:
+        hosts = conn.execute("""
+            SELECT host, ok, changed, unreachable, failed, skipped, rescued, ignored
+            FROM run_hosts WHERE run_id = ? ORDER BY host
+        """, (run_id,)).fetchall()
+        tasks = conn.execute("""
+            SELECT id, host, play, task, action, role, status, ignored, msg, duration
+            FROM run_tasks WHERE run_id = ? ORDER BY id
+        """, (run_id,)).fetchall()
+    return {"hosts": [dict(row) for row in hosts], "tasks": [dict(row) for row in tasks]}
+
+
+def query_task_results(status=None, task=None, host=None, playbook=None, before_id=None, limit=50):
+    """Return task results across runs, newest first, with their run's playbook and time.
+
+    Filters are exact matches on indexed columns. Pagination is keyset-based
+    on the result id, like list_history_runs.
+    """
+    where, params = [], []
+    for column, value in (("t.status", status), ("t.task", task), ("t.host", host)):
+        if value:
+            where.append("%s = ?" % column)
+            params.append(value)
+    if playbook:
+        where.append("t.run_id IN (SELECT id FROM playbook_runs WHERE playbook = ?)")
+        params.append(playbook)
+    if before_id is not None:
+        where.append("t.id < ?")
+        params.append(before_id)
+    query = """
+        SELECT t.id, t.run_id, r.playbook, r.time, t.host, t.play, t.task, t.action,
+               t.role, t.status, t.ignored, t.msg
+        FROM run_tasks t JOIN playbook_runs r ON r.id = t.run_id
+    """
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY t.id DESC LIMIT ?"
+    params.append(limit)
+    with get_history_db_connection() as conn:
+        return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+
+# -----------------------------------------------------------------------------
+# Timing reports: where a playbook spends its time. A task's time in a run is
+# its slowest host, since hosts run a task in parallel; a role's time is the
+# sum of its tasks.
+# -----------------------------------------------------------------------------
+TIMING_REPORT_RUNS = 20
+TIMING_REPORT_TOP = 10
+TIMING_REGRESSION_DAYS = 7
+TIMING_REGRESSION_RATIO = 1.2
+TIMING_REGRESSION_MIN_SECONDS = 1.0
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    return values[max(0, int(math.ceil(pct / 100.0 * len(values))) - 1)]
+
+
+def _timed_run_ids(conn, playbook, since=None, until=None, limit=None):
+    query = """
+        SELECT id FROM playbook_runs r WHERE playbook = ?
+        AND EXISTS (SELECT 1 FROM run_tasks t WHERE t.run_id = r.id AND t.duration IS NOT NULL)
+    """
+    params = [playbook]
+    if since:
+        query += " AND time >= ?"
+        params.append(since)
+    if until:
+        query += " AND time < ?"
+        params.append(until)
+    query += " ORDER BY id DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return [row[0] for row in conn.execute(query, params).fetchall()]
+
+
+def _task_durations(conn, run_ids):
+    """Return {(role, task): [seconds per run]} and {role: [seconds per run]}."""
+    tasks, roles = {}, {}
+    if not run_ids:
+        return tasks, roles
+    rows = conn.execute("""
+        SELECT run_id, role, task, MAX(seconds) FROM (
+            SELECT run_id, role, task, host, SUM(duration) AS seconds FROM run_tasks
+            WHERE run_id IN (%s) AND duration IS NOT NULL
+            GROUP BY run_id, role, task, host
+        ) GROUP BY run_id, role, task
+    """ % ",".join("?" * len(run_ids)), run_ids).fetchall()
+    per_run_roles = {}
+    for run_id, role, task, seconds in rows:
+        tasks.setdefault((role, task), []).append(seconds)
+        if role:
+            per_run_roles[(run_id, role)] = per_run_roles.get((run_id, role), 0.0) + seconds
+    for (_, role), seconds in per_run_roles.items():
+        roles.setdefault(role, []).append(seconds)
+    return tasks, roles
+
+
+def _timing_summary(samples):
+    values = sorted(samples)
+    return {
+        "runs": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(_percentile(values, 50), 3),
+        "p95": round(_percentile(values, 95), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def get_timing_report(playbook, runs=TIMING_REPORT_RUNS, top=TIMING_REPORT_TOP):
+    """Slowest tasks and roles of a playbook over its last runs, and recent regressions.
+
+    A task regressed when its median this week is at least
+    TIMING_REGRESSION_RATIO times (and TIMING_REGRESSION_MIN_SECONDS more
+    than) its median the week before.
+    """
+    now = datetime.now()
+    week_start = (now - timedelta(days=TIMING_REGRESSION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+    previous_start = (now - timedelta(days=2 * TIMING_REGRESSION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+    with get_history_db_connection() as conn:
+        run_ids = _timed_run_ids(conn, playbook, limit=runs)
+        tasks, roles = _task_durations(conn, run_ids)
+        current, _ = _task_durations(conn, _timed_run_ids(conn, playbook, since=week_start))
+        previous, _ = _task_durations(conn, _timed_run_ids(conn, playbook, since=previous_start,
+                                                          until=week_start))
+
+    task_rows = [dict(task=task, role=role, **_timing_summary(samples))
+                 for (role, task), samples in tasks.items()]
+    role_rows = [dict(role=role, **_timing_summary(samples)) for role, samples in roles.items()]
+    regressions = []
+    for key, samples in current.items():
+        if key not in previous:
+            continue
+        before = _percentile(sorted(previous[key]), 50)
+        after = _percentile(sorted(samples), 50)
+        if after >= before * TIMING_REGRESSION_RATIO and after - before >= TIMING_REGRESSION_MIN_SECONDS:
+            regressions.append({"task": key[1], "role": key[0], "previous_p50": round(before, 3),
+                                "current_p50": round(after, 3),
+                                "change": round(after / before, 2) if before else None})
+    by_p50 = lambda row: row["p50"]
+    return {
+        "playbook": playbook,
+        "runs": len(run_ids),
+        "slowest_tasks": sorted(task_rows, key=by_p50, reverse=True)[:top],
+        "slowest_roles": sorted(role_rows, key=by_p50, reverse=True)[:top],
+        "regressions": sorted(regressions, key=lambda row: row["current_p50"] - row["previous_p50"],
+                              reverse=True),
+    }
+
+
+def list_timed_playbooks():
+    """Playbooks that have at least one run with task timings."""
+    with get_history_db_connection() as conn:
+        return [row[0] for row in conn.execute("""
+            SELECT DISTINCT r.playbook FROM run_tasks t JOIN playbook_runs r ON r.id = t.run_id
+            WHERE t.duration IS NOT NULL ORDER BY r.playbook
+        """).fetchall()]
 
-    def emit(self, record):
-        try:
-            msg = self.format(record)
-            if os.path.exists(self.filename):
-                with open(self.filename, "r") as f:
-                    lines = f.readlines()
-            else:
-                lines = []
-            new_lines = [msg + "\n"] + lines
-            new_lines = new_lines[:self.max_lines]
-            with open(self.filename, "w") as f:
-                f.writelines(new_lines)
-        except Exception:
-            self.handleError(record)
 
 # =============================================================================
-# Configuration Variables
+# Request Profiling
+# Opt-in, per request: phase timings returned as a Server-Timing header and,
+# in cprofile mode, a cProfile of the request. The slowest profiles are kept
+# on disk for download as .pstats files.
 # =============================================================================
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILING_MODES = ("off", "timing", "cprofile")
+PROFILE_HEADER = "X-AnsiblePower-Profile"
+PROFILE_TOKEN_HEADER = "X-AnsiblePower-Profile-Token"
+PROFILE_STORE_SIZE = 20
+PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
 
-logger = logging.getLogger("ansiblePower")
-logger.setLevel(logging.INFO)
-log_handler = CustomRotatingLogHandler(os.path.join(BASE_DIR, "logs/app.log"), max_lines=200)
-formatter = logging.Formatter("%(asctime)s %(levelname)s: %(message)s")
-log_handler.setFormatter(formatter)
-logger.addHandler(log_handler)
-CONFIG_FILE = os.path.join(BASE_DIR, "data/config.json")
-DEFAULT_PLAYBOOKS_DIR = os.path.join(BASE_DIR, "playbooks")
-HOSTS_FILE = os.path.join(BASE_DIR, "data/hosts")
-HISTORY_FILE = os.path.join(BASE_DIR, "data/history.json")
+# Before Python 3.12 cProfile is per thread, but from 3.12 only one profiler
+# can be active in the process; requests that find it busy get timings only.
+_cprofile_lock = threading.Lock()
 
-# Resolve ansible-playbook: prefer the venv binary, then system PATH, then env override
-def _find_ansible_playbook():
-    # 1. Respect explicit environment override
-    env_override = os.environ.get("ANSIBLE_PLAYBOOK_BIN")
-    if env_override:
-        return env_override
-    # 2. Check venv next to this file (most common dev setup)
-    venv_bin = os.path.join(BASE_DIR, "venv", "bin", "ansible-playbook")
-    if os.path.isfile(venv_bin):
-        return venv_bin
-    # 3. Fall back to whatever is on PATH
-    system_bin = shutil.which("ansible-playbook")
-    if system_bin:
-        return system_bin
-    return "ansible-playbook"  # will raise a clear error at runtime
 
-ANSIBLE_PLAYBOOK = _find_ansible_playbook()
-app = Flask(__name__)
-app.secret_key = os.environ.get("FLASK_SECRET_KEY", os.urandom(24).hex())
+def get_profiling_mode():
+    """Profiling mode applied to every request, from config.json ("off" by default)."""
+    mode = config_cache.get().get("profiling", "off")
+    return mode if mode in PROFILING_MODES else "off"
 
-csrf = CSRFProtect(app)
 
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except Exception as e:
-                logger.error("Error loading config: %s", e)
-                return {"playbooks_dir": DEFAULT_PLAYBOOKS_DIR}
-    return {"playbooks_dir": DEFAULT_PLAYBOOKS_DIR}
+def _request_profiling_mode():
+    """Mode for the current request: the configured one, or a stronger one asked
+    for in the profile header with the token from ANSIBLEPOWER_PROFILE_TOKEN."""
+    mode = get_profiling_mode()
+    requested = request.headers.get(PROFILE_HEADER)
+    if requested in PROFILING_MODES and PROFILING_MODES.index(requested) > PROFILING_MODES.index(mode):
+        token = os.environ.get("ANSIBLEPOWER_PROFILE_TOKEN")
+        supplied = request.headers.get(PROFILE_TOKEN_HEADER, "")
+        if token and hmac.compare_digest(supplied.encode("utf-8"), token.encode("utf-8")):
+            mode = requested
+    return mode
 
-def save_config(config):
-    try:
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(config, f, indent=2)
-    except Exception as e:
-        logger.error("Error saving config: %s", e)
 
-def get_playbooks_dir():
-    config = load_config()
-    return config.get("playbooks_dir", DEFAULT_PLAYBOOKS_DIR)
+def _server_timing(phases, total):
+    parts = ['%s;dur=%.3f;desc="%d calls"' % (phase, seconds * 1000, calls)
+             for phase, (seconds, calls) in sorted(phases.items(), key=lambda item: -item[1][0])]
+    parts.append("total;dur=%.3f" % (total * 1000))
+    return ", ".join(parts)
 
-def get_hosts_file():
-    config = load_config()
-    return config.get("hosts_file", HOSTS_FILE)
 
-def get_history_db_file():
-    """Return the SQLite database path for playbook history."""
-    return os.path.splitext(HISTORY_FILE)[0] + ".db"
+class ProfileStore:
+    """The PROFILE_STORE_SIZE slowest request profiles: <id>.pstats plus <id>.json metadata."""
 
+    def __init__(self, size=PROFILE_STORE_SIZE):
+        self.size = size
 
-def get_history_db_connection():
-    """Create a SQLite connection for history storage."""
-    history_db_file = get_history_db_file()
-    history_dir = os.path.dirname(history_db_file)
+    @staticmethod
+    def directory():
+        return os.path.join(os.path.dirname(get_history_db_file()), "profiles")
 
-    if history_dir and not os.path.exists(history_dir):
-        os.makedirs(history_dir)
+    def list(self):
+        """Metadata of the stored profiles, slowest first."""
+        entries = []
+        try:
+            names = os.listdir(self.directory())
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory(), name), "r") as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(entries, key=lambda entry: entry["duration_ms"], reverse=True)
 
-    conn = sqlite3.connect(history_db_file)
-    conn.row_factory = sqlite3.Row
-    return conn
+    def add(self, profiler, meta):
+        """Store a profile if it is among the slowest. Returns its id, or None."""
+        directory = self.directory()
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, ".lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = self.list()
+                if len(entries) >= self.size and meta["duration_ms"] <= entries[self.size - 1]["duration_ms"]:
+                    return None
+                profile_id = uuid.uuid4().hex
+                meta = dict(meta, id=profile_id)
+                profiler.dump_stats(os.path.join(directory, profile_id + ".pstats"))
+                with open(os.path.join(directory, profile_id + ".json"), "w") as f:
+                    json.dump(meta, f)
+                for entry in sorted(entries + [meta], key=lambda e: e["duration_ms"], reverse=True)[self.size:]:
+                    self._remove(entry["id"])
+                return profile_id
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
 
+    def path(self, profile_id):
+        """Path of a stored .pstats file, or None."""
+        if not PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.directory(), profile_id + ".pstats")
+        return path if os.path.exists(path) else None
 
-def _history_records_to_rows(history):
-    """Convert history dictionaries to SQLite insert rows."""
-    return [
-        (
-            record.get("action", ""),
-            record.get("playbook", ""),
-            record.get("output", ""),
-            record.get("time", "")
-        )
-        for record in history
-        if isinstance(record, dict)
-    ]
+    def _remove(self, profile_id):
+        for extension in (".pstats", ".json"):
+            try:
+                os.remove(os.path.join(self.directory(), profile_id + extension))
+            except FileNotFoundError:
+                pass
 
+    def clear(self):
+        entries = self.list()
+        for entry in entries:
+            self._remove(entry["id"])
+        return len(entries)
 
-def init_history_db():
-    """Initialize SQLite history storage and migrate existing JSON history."""
-    try:
-        with get_history_db_connection() as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS playbook_runs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    action TEXT NOT NULL,
-                    playbook TEXT NOT NULL,
-                    output TEXT NOT NULL,
-                    time TEXT NOT NULL
-                )
-            """)
 
-            row_count = conn.execute(
-                "SELECT COUNT(*) FROM playbook_runs"
-            ).fetchone()[0]
+profile_store = ProfileStore()
 
-            if row_count == 0 and os.path.exists(HISTORY_FILE):
-                try:
-                    with open(HISTORY_FILE, "r") as f:
-                        history = json.load(f)
-
-                    if isinstance(history, list):
-                        conn.executemany("""
-                            INSERT INTO playbook_runs
-                            (action, playbook, output, time)
-                            VALUES (?, ?, ?, ?)
-                        """, _history_records_to_rows(history))
-                        logger.info("Migrated existing history.json records to SQLite")
-                except Exception as e:
-                    logger.error("Error migrating history.json to SQLite: %s", e)
-    except Exception as e:
-        logger.error("Error initializing history database: %s", e)
 
+def _template_render_started(sender, template, context, **extra):
+    _profile_local.render_started = time.perf_counter()
 
-def load_history():
-    """Load playbook run history from SQLite as a list of dictionaries."""
-    try:
-        init_history_db()
 
-        with get_history_db_connection() as conn:
-            rows = conn.execute("""
-                SELECT action, playbook, output, time
-                FROM playbook_runs
-                ORDER BY id ASC
-            """).fetchall()
+def _template_rendered(sender, template, context, **extra):
+    started = getattr(_profile_local, "render_started", None)
+    if started is not None:
+        _profile_local.render_started = None
+        _record_phase("render", time.perf_counter() - started)
 
-        return [dict(row) for row in rows]
-    except Exception as e:
-        logger.error("Error loading history from SQLite: %s", e)
-        return []
 
+before_render_template.connect(_template_render_started, app)
+template_rendered.connect(_template_rendered, app)
 
-def save_history(history):
-    """Replace playbook run history in SQLite with the provided records."""
-    try:
-        init_history_db()
 
-        with get_history_db_connection() as conn:
-            conn.execute("DELETE FROM playbook_runs")
-            conn.executemany("""
-                INSERT INTO playbook_runs (action, playbook, output, time)
-                VALUES (?, ?, ?, ?)
-            """, _history_records_to_rows(history))
-    except Exception as e:
-        logger.error("Error saving history to SQLite: %s", e)
+def _start_request_profile():
+    mode = _request_profiling_mode()
+    if mode == "off":
+        return
+    _profile_local.phases = {}
+    g.profile_mode = mode
+    if mode == "cprofile" and _cprofile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiling tool is active
+            _cprofile_lock.release()
+        else:
+            g.profiler = profiler
 
 
-def add_history_record(record):
-    """Insert a single playbook run history record into SQLite."""
-    try:
-        init_history_db()
+def _finish_request_profile(response, started):
+    if "profile_mode" not in g:
+        return
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _cprofile_lock.release()
+    total = time.perf_counter() - started
+    phases = _profile_local.phases
+    _profile_local.phases = None
+    response.headers["Server-Timing"] = _server_timing(phases, total)
+    if profiler is not None:
+        profile_id = profile_store.add(profiler, {
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "endpoint": request.url_rule.endpoint if request.url_rule else None,
+            "status": response.status_code,
+            "time": _current_time(),
+            "duration_ms": round(total * 1000, 3),
+            "phases": {phase: {"ms": round(seconds * 1000, 3), "calls": calls}
+                       for phase, (seconds, calls) in phases.items()},
+        })
+        if profile_id:
+            response.headers["X-AnsiblePower-Profile-Id"] = profile_id
 
-        with get_history_db_connection() as conn:
-            conn.execute("""
-                INSERT INTO playbook_runs (action, playbook, output, time)
-                VALUES (?, ?, ?, ?)
-            """, (
-                record.get("action", ""),
-                record.get("playbook", ""),
-                record.get("output", ""),
-                record.get("time", "")
-            ))
-    except Exception as e:
-        logger.error("Error adding history record to SQLite: %s", e)
 
 # =============================================================================
 # Flask App Setup
 # =============================================================================
+@app.before_request
+def _start_background_services():
+    history_compactor.ensure_running()
+    system_sampler.ensure_running()
+    g.request_started = time.perf_counter()
+    _start_request_profile()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        _finish_request_profile(response, started)
+        endpoint = request.url_rule.endpoint if request.url_rule else "unmatched"
+        metrics.inc("ansiblepower_http_requests_total",
+                    (("endpoint", endpoint), ("method", request.method), ("status", str(response.status_code))))
+        metrics.observe("ansiblepower_http_request_duration_seconds", time.perf_counter() - started,
+                        (("endpoint", endpoint), ("method", request.method)))
+        metrics.write()
+    return response
+
+
+@app.teardown_request
+def _clear_request_profile(exc):
+    # A request that failed before after_request must not leave profiling on.
+    _profile_local.phases = None
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _cprofile_lock.release()
 
 
 # =============================================================================
@@ -237,43 +3703,70 @@ def add_history_record(record):
 main_bp = Blueprint('main', __name__)
 history_bp = Blueprint('history', __name__, url_prefix='/history')
 settings_bp = Blueprint('settings', __name__, url_prefix='/settings')
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
 
 @main_bp.route("/health")
 def health():
     return jsonify({"status": "ok"})
 
+def _history_gauges():
+    """Gauges read from the shared history database at scrape time."""
+    with get_history_db_connection() as conn:
+        size = _history_db_size(conn)
+        runs = conn.execute("SELECT COUNT(*) FROM playbook_runs").fetchone()[0]
+        jobs = conn.execute("""
+            SELECT kind, status, COUNT(*) FROM playbook_jobs
+            WHERE status IN ('queued', 'running') GROUP BY kind, status
+        """).fetchall()
+    in_progress = sum(count for kind, status, count in jobs if kind == "playbook" and status == "running")
+    return [
+        ("ansiblepower_playbook_runs_in_progress", "Playbook runs currently executing.",
+         [((), in_progress)]),
+        ("ansiblepower_jobs", "Queued and running background jobs by kind and status.",
+         [((("kind", kind), ("status", status)), count) for kind, status, count in jobs]),
+        ("ansiblepower_history_db_bytes", "Size of the history database file.", [((), size["bytes"])]),
+        ("ansiblepower_history_db_free_bytes", "Unused pages in the history database.",
+         [((), size["free_bytes"])]),
+        ("ansiblepower_history_runs", "Runs stored in history.", [((), runs)]),
+    ]
+
+@main_bp.route("/metrics")
+def metrics_endpoint():
+    try:
+        body = format_metrics(metrics.collect(), _history_gauges())
+    except Exception:
+        logger.exception("Error collecting metrics")
+        return Response("# error collecting metrics\n", status=500, mimetype="text/plain")
+    return Response(body, content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @main_bp.route("/")
 def homepage():
     dark_mode = session.get("dark_mode", False)
     playbooks_dir = get_playbooks_dir()
-    error = None
-    prompt_for_dir = False
+    index = playbook_index.get(playbooks_dir)
+    return render_template("index.html", playbooks=index["playbooks"], dark_mode=dark_mode,
+                          error=index["error"], prompt_for_dir=index["missing"], playbooks_dir=playbooks_dir)
 
-    if not os.path.exists(playbooks_dir):
-        prompt_for_dir = True
-        playbooks = []
-    elif not (os.access(playbooks_dir, os.R_OK) and os.access(playbooks_dir, os.W_OK)):
-        error = (f"Insufficient permissions for the playbooks directory '{playbooks_dir}'. "
-                 "Ensure the directory is readable and writable by the current user.")
-        playbooks = []
-    else:
-        try:
-            playbooks = [f for f in os.listdir(playbooks_dir)
-                         if f.endswith('.yml') or f.endswith('.yaml')]
-        except Exception as e:
-            logger.exception("Error listing playbooks: %s", e)
-            playbooks = []
-            error = "An error occurred while accessing the playbooks directory."
-    
-    return render_template("index.html", playbooks=playbooks, dark_mode=dark_mode, 
-                          error=error, prompt_for_dir=prompt_for_dir, playbooks_dir=playbooks_dir)
+@main_bp.route("/playbooks")
+def list_playbooks():
+    playbooks_dir = get_playbooks_dir()
+    index = playbook_index.get(playbooks_dir)
+    if index["missing"]:
+        return jsonify({"error": "Playbooks directory does not exist"}), 404
+    if index["error"]:
+        return jsonify({"error": index["error"]}), 403
+    playbooks = index["playbooks"]
+    query = request.args.get("q", "").strip().lower()
+    if query:
+        playbooks = [p for p in playbooks if query in p["name"].lower()
+                     or any(query in name.lower() for name in p["plays"])]
+    return jsonify({"playbooks_dir": playbooks_dir, "count": len(playbooks), "playbooks": playbooks})
 
-@main_bp.route("/run_playbook", methods=["POST"])
-def run_playbook():
-    playbook_name = request.form.get("playbook")
+def _resolve_playbook(playbook_name, action):
+    """Return (path, None) for a playbook inside the playbooks directory, or (None, error response)."""
     if not playbook_name:
-        logger.error("No playbook specified in run_playbook")
-        return jsonify({"error": "No playbook specified"}), 400
+        logger.error("No playbook specified in %s", action)
+        return None, (jsonify({"error": "No playbook specified"}), 400)
 
     playbooks_dir = get_playbooks_dir()
     playbook_path = os.path.join(playbooks_dir, playbook_name)
@@ -286,84 +3779,68 @@ def run_playbook():
             raise ValueError("outside")
     except ValueError:
         logger.error("Path traversal attempt blocked: %s", playbook_name)
-        return jsonify({"error": "Invalid playbook path"}), 400
+        return None, (jsonify({"error": "Invalid playbook path"}), 400)
 
     # Prevent directories from being passed as playbook names
     if os.path.isdir(real_playbook):
         logger.error("Directory passed as playbook name: %s", playbook_name)
-        return jsonify({"error": "Invalid playbook path"}), 400
+        return None, (jsonify({"error": "Invalid playbook path"}), 400)
 
     if not os.path.exists(playbook_path):
         logger.error("Playbook does not exist: %s", playbook_path)
-        return jsonify({"error": "Playbook does not exist"}), 404
-
-    cmd = [ANSIBLE_PLAYBOOK, playbook_path]
-
-    # Pass the inventory/hosts file if configured
-    hosts_file = get_hosts_file()
-    if os.path.exists(hosts_file):
-        cmd += ["-i", hosts_file]
-    else:
-        # No hosts file — fall back to localhost for convenience
-        cmd += ["-i", "localhost,", "--connection=local"]
-    try:
-        output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, timeout=300)
-        output = output.decode("utf-8")
-    except subprocess.CalledProcessError as e:
-        # Even if the play fails (e.g. unreachable host), record the output.
-        output = e.output.decode("utf-8")
-    except subprocess.TimeoutExpired:
-        logger.warning("Playbook %s timed out after 300 seconds", playbook_name)
-        output = "⏱ Playbook timed out after 5 minutes (300 s). The process was killed.\nCheck your inventory and connection settings, or increase the timeout."
-    except Exception as e:
-        logger.exception("Unexpected error running playbook %s", playbook_name)
-        output = "Unexpected error occurred: " + str(e)
-    if not output.strip():
-        output = "No output produced."
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    add_history_record({
-        "action": "run",
-        "playbook": playbook_name,
-        "output": output,
-        "time": timestamp
-    })
-    logger.info("Recorded playbook run: %s", playbook_name)
-    return jsonify({"output": output})
+        return None, (jsonify({"error": "Playbook does not exist"}), 404)
+    return playbook_path, None
 
-@main_bp.route("/show_playbook", methods=["POST"])
-def show_playbook():
+@main_bp.route("/run_playbook", methods=["POST"])
+def run_playbook():
     playbook_name = request.form.get("playbook")
-    if not playbook_name:
-        logger.error("No playbook specified in show_playbook")
-        return jsonify({"error": "No playbook specified"}), 400
+    playbook_path, error = _resolve_playbook(playbook_name, "run_playbook")
+    if error:
+        return error
 
-    playbooks_dir = get_playbooks_dir()
-    playbook_path = os.path.join(playbooks_dir, playbook_name)
+    priority = request.form.get("priority", "normal")
+    if priority not in JOB_PRIORITIES:
+        return jsonify({"error": "Invalid priority. Use one of: " + ", ".join(JOB_PRIORITIES)}), 400
 
-    # Path traversal protection: ensure resolved path is inside playbooks_dir
-    real_playbook = os.path.realpath(playbook_path)
-    real_dir = os.path.realpath(playbooks_dir)
+    profile = request.form.get("profile") or None
+    if profile is not None and profile not in get_performance_profiles()[0]:
+        return jsonify({"error": "Unknown performance profile"}), 400
+    fanout = request.form.get("fanout") in ("1", "true", "on")
     try:
-        if os.path.commonpath([real_playbook, real_dir]) != real_dir:
-            raise ValueError("outside")
+        shards = int(request.form.get("shards") or 0)
+        if shards < 0:
+            raise ValueError
     except ValueError:
-        logger.error("Path traversal attempt blocked: %s", playbook_name)
-        return jsonify({"error": "Invalid playbook path"}), 400
+        return jsonify({"error": "Invalid shard count"}), 400
 
-    # Prevent directories from being passed as playbook names
-    if os.path.isdir(real_playbook):
-        logger.error("Directory passed as playbook name: %s", playbook_name)
-        return jsonify({"error": "Invalid playbook path"}), 400
+    try:
+        job_id = job_manager.submit("playbook", playbook_name, priority=priority, options={
+            "playbook_path": playbook_path,
+            "fanout": fanout,
+            "shards": shards or None,
+            "profile": profile,
+        })
+    except JobQueueFull:
+        logger.warning("Job queue full, rejected run of %s", playbook_name)
+        return jsonify({"error": "Too many queued runs. Please try again later."}), 503
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": url_for("jobs.job_status", job_id=job_id)
+    }), 202
 
-    if not os.path.exists(playbook_path):
-        logger.error("Playbook does not exist: %s", playbook_path)
-        return jsonify({"error": "Playbook does not exist"}), 404
+@main_bp.route("/show_playbook", methods=["GET", "POST"])
+def show_playbook():
+    # GET supports If-None-Match; POST is kept for older clients.
+    playbook_name = request.values.get("playbook")
+    playbook_path, error = _resolve_playbook(playbook_name, "show_playbook")
+    if error:
+        return error
 
     try:
-        with open(playbook_path, "r") as f:
-            content = f.read()
+        content, etag = content_cache.get(playbook_path)
         logger.info("Displayed playbook: %s", playbook_name)
-        return jsonify({"content": content})
+        return _conditional_content_response(content, etag)
     except Exception as e:
         logger.exception("Error reading playbook %s", playbook_name)
         return jsonify({"error": "Error reading playbook"}), 500
@@ -371,13 +3848,157 @@ def show_playbook():
 @history_bp.route("/")
 def history():
     dark_mode = session.get("dark_mode", False)
-    history_data = load_history()
-    return render_template("history.html", history=history_data, dark_mode=dark_mode)
+    return render_template("history.html", dark_mode=dark_mode)
+
+@history_bp.route("/api/runs")
+def history_runs():
+    sort = request.args.get("sort", "id")
+    if sort not in RUN_SORT_COLUMNS:
+        return jsonify({"error": "Invalid sort. Use one of: %s" % ", ".join(RUN_SORT_COLUMNS)}), 400
+    order = request.args.get("order", "desc")
+    if order not in ("asc", "desc"):
+        return jsonify({"error": "Invalid order. Use asc or desc."}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+        before_id = request.args.get("before_id")
+        before_id = int(before_id) if before_id else None
+        before_value = request.args.get("before_value")
+        before_value = float(before_value) if before_value else None
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+    filters = {}
+    try:
+        for name in RUN_FILTERS:
+            value = request.args.get(name)
+            if not value:
+                continue
+            if name == "playbook":
+                filters[name] = value
+            elif name == "failed":
+                filters[name] = value.lower() in ("1", "true", "yes")
+            elif name == "return_code":
+                filters[name] = int(value)
+            else:
+                filters[name] = float(value)
+    except ValueError:
+        return jsonify({"error": "Invalid value for filter %s" % name}), 400
+    try:
+        runs = list_history_runs(before_id=before_id, limit=limit, sort=sort,
+                                 descending=order == "desc", before_value=before_value,
+                                 filters=filters)
+    except Exception:
+        logger.exception("Error listing history runs")
+        return jsonify({"error": "Error loading history"}), 500
+    last = runs[-1] if len(runs) == limit else None
+    return jsonify({
+        "runs": runs,
+        "next_before_id": last["id"] if last else None,
+        "next_before_value": last[sort] if last and sort != "id" else None,
+    })
+
+@history_bp.route("/api/search")
+def history_search():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Search query cannot be empty"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+    raw_syntax = request.args.get("syntax") == "fts"
+    sort = request.args.get("sort", "rank")
+    if sort not in ("rank", "recent"):
+        return jsonify({"error": "Invalid sort. Use rank or recent."}), 400
+    try:
+        results, has_more = search_history(query, limit=limit, offset=offset,
+                                           raw_syntax=raw_syntax, sort=sort)
+    except sqlite3.OperationalError as e:
+        return jsonify({"error": "Invalid search query: %s" % e}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+    except Exception:
+        logger.exception("Error searching history")
+        return jsonify({"error": "Error searching history"}), 500
+    return jsonify({
+        "results": results,
+        "next_offset": offset + limit if has_more else None
+    })
+
+@history_bp.route("/api/runs/<int:run_id>")
+def history_run(run_id):
+    try:
+        run = get_history_run(run_id)
+    except Exception:
+        logger.exception("Error loading history run %s", run_id)
+        return jsonify({"error": "Error loading history"}), 500
+    if run is None:
+        return jsonify({"error": "Run not found"}), 404
+    return jsonify(run)
+    
+@history_bp.route("/api/runs/<int:run_id>/results")
+def history_run_results(run_id):
+    try:
+        if get_history_run(run_id) is None:
+            return jsonify({"error": "Run not found"}), 404
+        return jsonify(get_run_results(run_id))
+    except Exception:
+        logger.exception("Error loading results of run %s", run_id)
+        return jsonify({"error": "Error loading history"}), 500
+
+@history_bp.route("/timing")
+def timing():
+    dark_mode = session.get("dark_mode", False)
+    try:
+        playbooks = list_timed_playbooks()
+    except Exception:
+        logger.exception("Error listing playbooks with timings")
+        playbooks = []
+    return render_template("timing.html", dark_mode=dark_mode, playbooks=playbooks,
+                           default_runs=TIMING_REPORT_RUNS)
+
+@history_bp.route("/api/timing")
+def timing_report():
+    playbook = request.args.get("playbook", "").strip()
+    if not playbook:
+        return jsonify({"error": "Playbook is required"}), 400
+    try:
+        runs = min(max(int(request.args.get("runs", TIMING_REPORT_RUNS)), 1), 500)
+        top = min(max(int(request.args.get("top", TIMING_REPORT_TOP)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "runs and top must be integers"}), 400
+    try:
+        return jsonify(get_timing_report(playbook, runs=runs, top=top))
+    except Exception:
+        logger.exception("Error building timing report for %s", playbook)
+        return jsonify({"error": "Error building timing report"}), 500
+
+@history_bp.route("/api/results")
+def history_results():
+    status = request.args.get("status") or None
+    if status and status not in RESULT_STATUSES:
+        return jsonify({"error": "Invalid status. Use one of: %s" % ", ".join(RESULT_STATUSES)}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+        before_id = request.args.get("before_id")
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        return jsonify({"error": "Invalid pagination parameters"}), 400
+    try:
+        results = query_task_results(status=status, task=request.args.get("task"),
+                                     host=request.args.get("host"),
+                                     playbook=request.args.get("playbook"),
+                                     before_id=before_id, limit=limit)
+    except Exception:
+        logger.exception("Error querying task results")
+        return jsonify({"error": "Error loading history"}), 500
+    next_before_id = results[-1]["id"] if len(results) == limit else None
+    return jsonify({"results": results, "next_before_id": next_before_id})
     
 @settings_bp.route("/")
 def settings():
     dark_mode = session.get("dark_mode", False)
-    config = load_config()
+    config = config_cache.get()
     playbooks_dir = config.get("playbooks_dir", DEFAULT_PLAYBOOKS_DIR)
     hosts_file = config.get("hosts_file", HOSTS_FILE)
     return render_template("settings.html", dark_mode=dark_mode, playbooks_dir=playbooks_dir, hosts_file=hosts_file)
@@ -412,10 +4033,10 @@ def update_hosts_file():
     if not new_hosts_file:
         return jsonify({"error": "Hosts file path cannot be empty"}), 400
 
-    # Security: restrict hosts file to paths inside BASE_DIR/data only.
+    # Security: restrict hosts file to paths inside DATA_DIR only.
     # Allowing arbitrary absolute paths enables arbitrary file read/write (e.g. ~/.ssh/id_rsa)
     real_new_hosts = os.path.realpath(new_hosts_file)
-    safe_data_dir = os.path.realpath(os.path.join(BASE_DIR, "data"))
+    safe_data_dir = os.path.realpath(DATA_DIR)
     try:
         if os.path.commonpath([real_new_hosts, safe_data_dir]) != safe_data_dir:
             raise ValueError("outside safe dir")
@@ -439,10 +4060,9 @@ def get_hosts():
         if not os.access(hosts_file, os.R_OK):
             logger.error("Read permission denied for hosts file: %s", hosts_file)
             return jsonify({"error": "Add read permission to user to file"}), 403
-        with open(hosts_file, "r") as f:
-            content = f.read()
+        content, etag = content_cache.get(hosts_file)
         logger.info("Hosts file read successfully")
-        return jsonify({"content": content})
+        return _conditional_content_response(content, etag)
     except Exception as e:
         logger.exception("Error getting hosts file")
         return jsonify({"error": "Unexpected error occurred"}), 500
@@ -452,6 +4072,13 @@ def save_hosts():
     new_content = request.form.get("content", "")
     try:
         hosts_file = get_hosts_file()
+        try:
+            parse_inventory(new_content, hosts_file)
+        except InventoryError as e:
+            logger.warning("Rejected invalid inventory: %s", e)
+            return jsonify({"error": "Invalid inventory: %s" % e}), 400
+        except RuntimeError as e:
+            logger.warning("Saving hosts file without validation: %s", e)
         if not os.path.exists(hosts_file):
             logger.error("Hosts file not found: %s", hosts_file)
             return jsonify({"error": "Hosts file not found. Please check the path in settings."}), 404
@@ -460,24 +4087,171 @@ def save_hosts():
             return jsonify({"error": "Please add write permission to host file"}), 403
         with open(hosts_file, "w") as f:
             f.write(new_content)
+        content_cache.invalidate(hosts_file)
         logger.info("Hosts file saved successfully")
         return jsonify({"status": "ok"})
     except Exception as e:
         logger.exception("Error saving hosts file")
         return jsonify({"error": "Error saving hosts file"}), 500
 
+def _inventory_or_error():
+    """Return (inventory, None), or (None, error response)."""
+    try:
+        return get_inventory(), None
+    except FileNotFoundError:
+        return None, (jsonify({"error": "Hosts file not found"}), 404)
+    except InventoryError as e:
+        return None, (jsonify({"error": "Invalid inventory: %s" % e}), 422)
+    except RuntimeError as e:
+        return None, (jsonify({"error": str(e)}), 501)
+
+@settings_bp.route("/inventory", methods=["GET"])
+def inventory_groups():
+    inventory, error = _inventory_or_error()
+    if error:
+        return error
+    return jsonify(inventory.to_dict())
+
+@settings_bp.route("/inventory/resolve", methods=["GET"])
+def inventory_resolve():
+    pattern = request.args.get("pattern", "all")
+    inventory, error = _inventory_or_error()
+    if error:
+        return error
+    try:
+        hosts = inventory.resolve(pattern)
+    except re.error as e:
+        return jsonify({"error": "Invalid pattern: %s" % e}), 400
+    if request.args.get("count_only") in ("1", "true"):
+        return jsonify({"pattern": pattern, "count": len(hosts)})
+    return jsonify({"pattern": pattern, "count": len(hosts), "hosts": hosts})
+
+@settings_bp.route("/performance_profiles", methods=["GET"])
+def performance_profiles():
+    profiles, active = get_performance_profiles()
+    return jsonify({"profiles": profiles, "active": active, "builtin": sorted(BUILTIN_PERFORMANCE_PROFILES)})
+
+@settings_bp.route("/performance_profiles", methods=["POST"])
+def update_performance_profiles():
+    data = request.get_json(silent=True) or {}
+    config = load_config()
+    try:
+        if "profiles" in data:
+            if not isinstance(data["profiles"], dict):
+                raise ValueError("profiles must be an object")
+            config["performance_profiles"] = {
+                name: validate_performance_profile(name, profile)
+                for name, profile in data["profiles"].items()
+            }
+        if "active" in data:
+            known = set(BUILTIN_PERFORMANCE_PROFILES) | set(config.get("performance_profiles") or {})
+            if data["active"] not in known:
+                raise ValueError("Unknown profile: %s" % data["active"])
+            config["active_profile"] = data["active"]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    save_config(config)
+    logger.info("Updated performance profiles (active: %s)", config.get("active_profile", "default"))
+    profiles, active = get_performance_profiles()
+    return jsonify({"status": "ok", "profiles": profiles, "active": active})
+
+@settings_bp.route("/fact_cache", methods=["GET"])
+def fact_cache():
+    return jsonify(dict(get_fact_cache_settings(), hosts=list_cached_facts()))
+
+@settings_bp.route("/fact_cache", methods=["POST"])
+def update_fact_cache():
+    data = request.get_json(silent=True) or {}
+    settings = get_fact_cache_settings()
+    if "enabled" in data:
+        settings["enabled"] = bool(data["enabled"])
+    if "timeout" in data:
+        try:
+            settings["timeout"] = int(data["timeout"])
+            if settings["timeout"] < 1:
+                raise ValueError
+        except (TypeError, ValueError):
+            return jsonify({"error": "timeout must be a positive number of seconds"}), 400
+    config = load_config()
+    config["fact_cache"] = settings
+    save_config(config)
+    logger.info("Updated fact cache settings: %s", settings)
+    return jsonify({"status": "ok", "settings": settings})
+
+@settings_bp.route("/fact_cache/<host>", methods=["GET"])
+def fact_cache_host(host):
+    facts = get_cached_facts(host)
+    if facts is None:
+        return jsonify({"error": "No cached facts for this host"}), 404
+    return jsonify({"host": host, "facts": facts})
+
+@settings_bp.route("/fact_cache/<host>/invalidate", methods=["POST"])
+def fact_cache_invalidate(host):
+    if not invalidate_cached_facts(host):
+        return jsonify({"error": "No cached facts for this host"}), 404
+    logger.info("Invalidated cached facts for %s", host)
+    return jsonify({"status": "ok"})
+
+@settings_bp.route("/fact_cache/purge", methods=["POST"])
+def fact_cache_purge():
+    removed = purge_fact_cache()
+    logger.info("Purged fact cache (%d hosts)", removed)
+    return jsonify({"status": "ok", "removed": removed})
+
+@settings_bp.route("/profiling", methods=["GET"])
+def profiling():
+    return jsonify({"mode": get_profiling_mode(), "modes": list(PROFILING_MODES),
+                    "profiles": profile_store.list()})
+
+@settings_bp.route("/profiling", methods=["POST"])
+def update_profiling():
+    mode = (request.get_json(silent=True) or {}).get("mode")
+    if mode not in PROFILING_MODES:
+        return jsonify({"error": "mode must be one of: %s" % ", ".join(PROFILING_MODES)}), 400
+    config = load_config()
+    config["profiling"] = mode
+    save_config(config)
+    logger.info("Request profiling set to %s", mode)
+    return jsonify({"status": "ok", "mode": mode})
+
+@settings_bp.route("/profiling/profiles/<profile_id>.pstats", methods=["GET"])
+def download_profile(profile_id):
+    path = profile_store.path(profile_id)
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True,
+                     download_name="ansiblepower-%s.pstats" % profile_id)
+
+@settings_bp.route("/profiling/profiles/clear", methods=["POST"])
+def clear_profiles():
+    removed = profile_store.clear()
+    logger.info("Cleared %d stored profiles", removed)
+    return jsonify({"status": "ok", "removed": removed})
+
 @settings_bp.route("/system_status", methods=["GET"])
 def system_status():
     try:
-        cpu_percent = psutil.cpu_percent(interval=1)
-        mem = psutil.virtual_memory()
-        memory_percent = mem.percent
-        logger.info("System status: CPU %s%%, Memory %s%%", cpu_percent, memory_percent)
-        return jsonify({"cpu": cpu_percent, "memory": memory_percent})
+        window = min(max(int(request.args.get("window", SYSTEM_STATUS_WINDOW)), 0), SYSTEM_SAMPLE_HISTORY)
+    except ValueError:
+        return jsonify({"error": "window must be a number of seconds"}), 400
+    try:
+        status = dict(system_sampler.latest())
+        status["interval"] = system_sampler.interval
+        status["window"] = window
+        status["series"] = system_sampler.window(window) if window else []
+        return jsonify(status)
     except Exception as e:
         logger.exception("Error fetching system status")
         return jsonify({"error": "Error fetching system status"}), 500
 
+@settings_bp.route("/logs", methods=["GET"])
+def recent_logs():
+    try:
+        limit = min(max(int(request.args.get("limit", log_handler.max_lines)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    return jsonify({"logs": log_handler.read_recent(limit)})
+
 @settings_bp.route("/clear_history", methods=["POST"])
 def clear_history():
     try:
@@ -488,6 +4262,34 @@ def clear_history():
         logger.exception("Error clearing history")
         return jsonify({"error": "Error clearing history"}), 500
 
+@settings_bp.route("/history_retention", methods=["GET"])
+def history_retention():
+    return jsonify({"policy": get_retention_policy(), "stats": get_compaction_stats()})
+
+@settings_bp.route("/history_retention", methods=["POST"])
+def update_history_retention():
+    try:
+        policy = validate_retention_policy(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    config = load_config()
+    config["history_retention"] = policy
+    save_config(config)
+    logger.info("Updated history retention policy: %s", policy)
+    return jsonify({"status": "ok", "policy": policy})
+
+@settings_bp.route("/compact_history", methods=["POST"])
+def compact_history_now():
+    try:
+        job_id = job_manager.submit("compact", "history", priority="low")
+    except JobQueueFull:
+        return jsonify({"error": "Too many queued jobs. Please try again later."}), 503
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": url_for("jobs.job_status", job_id=job_id)
+    }), 202
+
 @settings_bp.route("/toggle_dark_mode", methods=["POST"])
 def toggle_dark_mode():
     try:
@@ -502,27 +4304,100 @@ def toggle_dark_mode():
 # ---------------------------------------------------------------------------
 # History Export and Import Endpoints (accessed from the History page)
 # ---------------------------------------------------------------------------
-@history_bp.route("/export_history")
-def export_history():
-    export_format = request.args.get("format", "json")
-    history_data = load_history()
+EXPORT_FORMATS = {
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+}
+EXPORT_CHUNK_RECORDS = 50
+
+
+def _parse_export_time(value, end_of_day=False):
+    """Validate a YYYY-MM-DD[ HH:MM:SS] filter value in the history time format."""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d" and end_of_day:
+            return parsed.strftime("%Y-%m-%d 23:59:59")
+        return parsed.strftime("%Y-%m-%d %H:%M:%S")
+    raise ValueError(value)
+
+
+def _export_chunks(records, export_format):
+    """Serialize records as text chunks of about EXPORT_CHUNK_RECORDS each."""
     if export_format == "csv":
         si = StringIO()
         cw = csv.writer(si)
         cw.writerow(["time", "playbook", "action", "output"])
-        for record in history_data:
-            cw.writerow([
-                record.get("time", ""),
-                record.get("playbook", ""),
-                record.get("action", ""),
-                record.get("output", "")
-            ])
-        output = si.getvalue()
-        return Response(output, mimetype="text/csv",
-                        headers={"Content-Disposition": "attachment;filename=history.csv"})
+        for count, record in enumerate(records, 1):
+            cw.writerow([record["time"], record["playbook"], record["action"], record["output"]])
+            if count % EXPORT_CHUNK_RECORDS == 0:
+                yield si.getvalue()
+                si.seek(0)
+                si.truncate()
+        yield si.getvalue()
+    elif export_format == "ndjson":
+        batch = []
+        for record in records:
+            batch.append(json.dumps(record) + "\n")
+            if len(batch) >= EXPORT_CHUNK_RECORDS:
+                yield "".join(batch)
+                batch = []
+        yield "".join(batch)
     else:
-        return Response(json.dumps(history_data, indent=2), mimetype="application/json",
-                        headers={"Content-Disposition": "attachment;filename=history.json"})
+        # A JSON array written element by element, laid out like json.dumps(indent=2).
+        batch = []
+        separator = "[\n"
+        for record in records:
+            batch.append(separator + "  " + json.dumps(record, indent=2).replace("\n", "\n  "))
+            separator = ",\n"
+            if len(batch) >= EXPORT_CHUNK_RECORDS:
+                yield "".join(batch)
+                batch = []
+        batch.append("[]" if separator == "[\n" else "\n]")
+        yield "".join(batch)
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@history_bp.route("/export_history")
+def export_history():
+    export_format = request.args.get("format", "json")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Unsupported format. Use json, ndjson or csv."}), 400
+    try:
+        since = _parse_export_time(request.args.get("since"))
+        until = _parse_export_time(request.args.get("until"), end_of_day=True)
+    except ValueError:
+        return jsonify({"error": "Invalid time filter. Use YYYY-MM-DD or YYYY-MM-DD HH:MM:SS."}), 400
+
+    records = iter_history(
+        playbook=request.args.get("playbook") or None,
+        action=request.args.get("action") or None,
+        since=since,
+        until=until,
+    )
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    chunks = _export_chunks(records, export_format)
+    filename = "history." + extension
+    if request.args.get("compress") == "gzip":
+        chunks = _gzip_chunks(chunks)
+        mimetype = "application/gzip"
+        filename += ".gz"
+    logger.info("Exporting history as %s", filename)
+    return Response(chunks, mimetype=mimetype,
+                    headers={"Content-Disposition": "attachment;filename=" + filename})
 
 @history_bp.route("/import_history", methods=["POST"])
 def import_history():
@@ -531,41 +4406,82 @@ def import_history():
     file = request.files["file"]
     if file.filename == "":
         return jsonify({"error": "Empty file name"}), 400
+    file_type = _import_file_type(file.filename)
+    if file_type is None:
+        return jsonify({"error": "Unsupported file type. Use .json, .ndjson or .csv, optionally gzipped."}), 400
+    mode = request.form.get("mode", "replace")
+    if mode not in IMPORT_MODES:
+        return jsonify({"error": "Invalid mode. Use one of: " + ", ".join(IMPORT_MODES)}), 400
+
     try:
-        if file.filename.endswith(".json"):
-            data = json.load(file)
-        elif file.filename.endswith(".csv"):
-            data = []
-            stream = StringIO(file.stream.read().decode("UTF8"), newline=None)
-            csv_input = csv.DictReader(stream)
-            for row in csv_input:
-                data.append(row)
-        else:
-            return jsonify({"error": "Unsupported file type. Only .json and .csv allowed."}), 400
-
-        # Validate imported data structure
-        if not isinstance(data, list):
-            return jsonify({"error": "Invalid data format: expected a list of records."}), 400
-        valid_keys = {"action", "playbook", "output", "time"}
-        for record in data:
-            if not isinstance(record, dict):
-                return jsonify({"error": "Invalid record format: each entry must be a dictionary."}), 400
-            # Sanitize: only keep known keys
-            for key in list(record.keys()):
-                if key not in valid_keys:
-                    del record[key]
-
-        save_history(data)
-        logger.info("History imported from %s", file.filename)
-        return jsonify({"status": "ok", "message": "History imported successfully."})
+        # Spool the upload to disk in chunks; the import job streams from there.
+        import_dir = os.path.join(os.path.dirname(get_history_db_file()), "imports")
+        os.makedirs(import_dir, exist_ok=True)
+        upload_path = os.path.join(import_dir, uuid.uuid4().hex + ".upload")
+        file.save(upload_path)
+        job_id = job_manager.submit("import", os.path.basename(file.filename), options={
+            "path": upload_path,
+            "format": file_type[0],
+            "compressed": file_type[1],
+            "mode": mode,
+        })
+    except JobQueueFull:
+        os.remove(upload_path)
+        return jsonify({"error": "Too many queued jobs. Please try again later."}), 503
     except Exception as e:
         logger.exception("Error importing history")
         return jsonify({"error": "Error processing file: " + str(e)}), 500
+    logger.info("Queued history import from %s (%s)", file.filename, mode)
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": url_for("jobs.job_status", job_id=job_id)
+    }), 202
+
+# ---------------------------------------------------------------------------
+# Job Endpoints (state and results of queued playbook runs)
+# ---------------------------------------------------------------------------
+@jobs_bp.route("/")
+def jobs_list():
+    status = request.args.get("status")
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    return jsonify({"jobs": list_jobs(status=status, limit=limit)})
+
+@jobs_bp.route("/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@jobs_bp.route("/<job_id>/stream")
+def job_stream(job_id):
+    if get_job_summary(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    try:
+        offset = max(int(request.headers.get("Last-Event-ID") or request.args.get("offset", 0)), 0)
+    except ValueError:
+        return jsonify({"error": "Invalid offset"}), 400
+    return Response(stream_job_output(job_id, offset), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@jobs_bp.route("/<job_id>/cancel", methods=["POST"])
+def job_cancel(job_id):
+    if get_job_summary(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    if not cancel_job(job_id):
+        return jsonify({"error": "Only queued jobs can be cancelled"}), 409
+    logger.info("Cancelled job %s", job_id)
+    return jsonify({"status": "cancelled"})
 
 # Register blueprints (moved outside of main block for testing)
 app.register_blueprint(main_bp)
 app.register_blueprint(history_bp)
 app.register_blueprint(settings_bp)
+app.register_blueprint(jobs_bp)
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -585,9 +4501,8 @@ def internal_server_error(error):
 # Gunicorn/Docker (which imports the module but never enters __main__).
 # =============================================================================
 def _ensure_dirs():
-    data_dir = os.path.join(BASE_DIR, "data")
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
     if not os.path.exists(DEFAULT_PLAYBOOKS_DIR):
         os.makedirs(DEFAULT_PLAYBOOKS_DIR)
         sample_playbook = os.path.join(DEFAULT_PLAYBOOKS_DIR, "sample.yml")
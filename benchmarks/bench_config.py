@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Config Overhead Benchmark for AnsiblePower
+
+Measures how long the config lookups made by a single request take, using
+the pre-cache behaviour (open and parse config.json on every call) as the
+baseline and the mtime-invalidated ConfigCache as the current behaviour.
+
+Usage:
+    python benchmarks/bench_config.py [--iterations N] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+# Add the parent directory to the path to import ansiblePower
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ansiblePower
+
+# Config lookups made while handling one POST /run_playbook request.
+LOOKUPS_PER_REQUEST = 4
+
+
+def legacy_load_config():
+    """The original load_config(): parse the file on every call."""
+    if os.path.exists(ansiblePower.CONFIG_FILE):
+        with open(ansiblePower.CONFIG_FILE, "r") as f:
+            try:
+                return json.load(f)
+            except Exception:
+                return {"playbooks_dir": ansiblePower.DEFAULT_PLAYBOOKS_DIR}
+    return {"playbooks_dir": ansiblePower.DEFAULT_PLAYBOOKS_DIR}
+
+
+def legacy_request():
+    for _ in range(LOOKUPS_PER_REQUEST):
+        legacy_load_config().get("playbooks_dir")
+
+
+def cached_request():
+    for _ in range(LOOKUPS_PER_REQUEST):
+        ansiblePower.config_cache.get().get("playbooks_dir")
+
+
+def measure(func, iterations):
+    """Return the best per-call time in microseconds over five repeats."""
+    best = min(timeit.repeat(func, number=iterations, repeat=5))
+    return best / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        ansiblePower.CONFIG_FILE = os.path.join(test_dir, "config.json")
+        ansiblePower.config_cache.invalidate()
+        ansiblePower.save_config({
+            "playbooks_dir": os.path.join(test_dir, "playbooks"),
+            "hosts_file": os.path.join(test_dir, "hosts"),
+            "job_workers": 2,
+            "playbook_timeout": 3600,
+        })
+
+        before = measure(legacy_request, args.iterations)
+        after = measure(cached_request, args.iterations)
+
+    results = {
+        "benchmark": "config_per_request",
+        "lookups_per_request": LOOKUPS_PER_REQUEST,
+        "iterations": args.iterations,
+        "before_us": round(before, 2),
+        "after_us": round(after, 2),
+        "speedup": round(before / after, 1) if after else None,
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
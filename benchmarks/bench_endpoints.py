@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Endpoint Benchmark for AnsiblePower
+
+Measures latency and memory of the hot endpoints (/, /run_playbook,
+/history/, export/import and system_status) against history databases of
+increasing size. Playbooks run through benchmarks/stub_ansible_playbook.py
+via the ANSIBLE_PLAYBOOK_BIN override, so Ansible is not needed.
+
+Requests go through Flask's test client, so the numbers cover the
+application only; benchmarks/loadtest.py measures a running server.
+
+Usage:
+    python benchmarks/bench_endpoints.py [--sizes 1000,10000,100000] [--requests N]
+        [--stub-lines N] [--stub-seconds S] [--output results.json]
+        [--baseline previous.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STUB = os.path.join(BENCH_DIR, "stub_ansible_playbook.py")
+
+# ansiblePower resolves the playbook binary at import time.
+os.environ["ANSIBLE_PLAYBOOK_BIN"] = STUB
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import ansiblePower
+
+POPULATE_BATCH = 5000
+IMPORT_RECORDS = 1000
+JOB_TIMEOUT = 600
+# A run counts as a regression against --baseline when it is this much slower.
+REGRESSION_RATIO = 1.25
+
+
+def populate_history(count):
+    """Insert count runs with distinct, realistically sized output."""
+    conn = ansiblePower.get_history_db_connection()
+    for start in range(0, count, POPULATE_BATCH):
+        with conn:
+            for i in range(start, min(start + POPULATE_BATCH, count)):
+                ansiblePower._insert_history_record(conn, {
+                    "action": "run",
+                    "playbook": "site-%d.yml" % (i % 20),
+                    "time": "2024-%02d-%02d %02d:%02d:00" % (i % 12 + 1, i % 28 + 1, i % 24, i % 60),
+                    "output": "PLAY [site] ***\nTASK [deploy] ***\nok: [web%d]\nchanged: [db%d]\n"
+                              "PLAY RECAP ***\nweb%d : ok=%d changed=1 failed=0\n" % (i, i, i, i % 50),
+                })
+
+
+def wait_for_job(client, job_id):
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        job = client.get("/jobs/%s" % job_id).get_json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.01)
+    raise RuntimeError("Job %s did not finish in time" % job_id)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def measure(request, repeat):
+    """Time request() repeat times, then trace the memory of one more call."""
+    request()  # warm caches and connections
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        request()
+        latencies.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        request()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = summarize(latencies)
+    result["peak_alloc_kib"] = round(peak / 1024, 1)
+    return result
+
+
+def check(response, status=200):
+    if response.status_code != status:
+        raise RuntimeError("%s returned %d: %s" % (response.request.path, response.status_code,
+                                                   response.get_data(as_text=True)[:200]))
+    return response
+
+
+def bench_size(size, args, work_dir):
+    data_dir = os.path.join(work_dir, "data-%d" % size)
+    playbooks_dir = os.path.join(data_dir, "playbooks")
+    os.makedirs(playbooks_dir)
+    with open(os.path.join(playbooks_dir, "bench.yml"), "w") as f:
+        f.write("- name: Benchmark\n  hosts: all\n  tasks:\n    - ping:\n")
+    with open(os.path.join(data_dir, "hosts"), "w") as f:
+        f.write("[bench]\nlocalhost ansible_connection=local\n")
+    ansiblePower.CONFIG_FILE = os.path.join(data_dir, "config.json")
+    ansiblePower.HISTORY_FILE = os.path.join(data_dir, "history.json")
+    ansiblePower.config_cache.invalidate()
+    ansiblePower.save_config({"playbooks_dir": playbooks_dir, "hosts_file": os.path.join(data_dir, "hosts")})
+
+    started = time.perf_counter()
+    populate_history(size)
+    populate_seconds = time.perf_counter() - started
+    client = ansiblePower.app.test_client()
+    # Pages still in the write-ahead log count too, unlike the main file's size.
+    db_bytes = ansiblePower._history_db_size(ansiblePower.get_history_db_connection())["bytes"]
+    results = {"populate_seconds": round(populate_seconds, 2), "db_bytes": db_bytes}
+
+    results["homepage"] = measure(lambda: check(client.get("/")), args.requests)
+    results["history_page"] = measure(lambda: check(client.get("/history/")), args.requests)
+    results["history_runs_api"] = measure(lambda: check(client.get("/history/api/runs?limit=200")),
+                                          args.requests)
+    results["system_status"] = measure(lambda: check(client.get("/settings/system_status")), args.requests)
+
+    job_ids = []
+
+    def submit():
+        response = check(client.post("/run_playbook", data={"playbook": "bench.yml"}), 202)
+        job_ids.append(response.get_json()["job_id"])
+    results["run_playbook_submit"] = measure(submit, args.runs)
+    durations = []
+    for index, job_id in enumerate(job_ids):
+        job = wait_for_job(client, job_id)
+        if job["status"] != "succeeded":
+            raise RuntimeError("Benchmark run failed: %s" % job.get("error"))
+        # The first and last submissions are measure()'s warm-up and memory trace.
+        if 0 < index < len(job_ids) - 1:
+            durations.append(client.get("/history/api/runs/%d" % job["run_id"]).get_json()["duration"])
+    results["run_playbook_run"] = summarize(durations)
+    results["run_playbook_run"]["stub_lines"] = args.stub_lines
+
+    export_bytes = []
+
+    def export():
+        body = check(client.get("/history/export_history?format=ndjson")).get_data()
+        export_bytes.append(len(body))
+    results["export_ndjson"] = measure(export, args.heavy_requests)
+    results["export_ndjson"]["bytes"] = export_bytes[-1]
+
+    records = "".join(json.dumps({"action": "run", "playbook": "imported.yml", "time": "2025-01-01 00:00:%02d" % (i % 60),
+                                  "output": "imported run %d\n" % i}) + "\n" for i in range(IMPORT_RECORDS))
+
+    def import_merge():
+        response = check(client.post("/history/import_history", data={
+            "file": (io.BytesIO(records.encode("utf-8")), "runs.ndjson"), "mode": "merge"},
+            content_type="multipart/form-data"), 202)
+        job = wait_for_job(client, response.get_json()["job_id"])
+        if job["status"] != "succeeded":
+            raise RuntimeError("Benchmark import failed: %s" % job.get("error"))
+    results["import_merge_%d" % IMPORT_RECORDS] = measure(import_merge, args.heavy_requests)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results):
+    """Return the endpoints whose p50 grew by REGRESSION_RATIO or more."""
+    regressions = []
+    for size, endpoints in results["sizes"].items():
+        for name, current in endpoints.items():
+            previous = baseline.get("sizes", {}).get(size, {}).get(name)
+            if not isinstance(current, dict) or not isinstance(previous, dict):
+                continue
+            before, after = previous.get("p50_ms"), current.get("p50_ms")
+            if before and after and after >= before * REGRESSION_RATIO:
+                regressions.append({"size": size, "endpoint": name, "before_p50_ms": before,
+                                    "after_p50_ms": after, "ratio": round(after / before, 2)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Comma-separated history sizes (rows); add 1000000 for the full run")
+    parser.add_argument("--requests", type=int, default=20, help="Timed requests per light endpoint")
+    parser.add_argument("--heavy-requests", type=int, default=3, help="Timed exports and imports")
+    parser.add_argument("--runs", type=int, default=5, help="Playbook runs to submit and execute end to end")
+    parser.add_argument("--stub-lines", type=int, default=200, help="Output lines per stub run")
+    parser.add_argument("--stub-seconds", type=float, default=0.0, help="Duration of each stub run")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    args = parser.parse_args()
+
+    os.environ["STUB_OUTPUT_LINES"] = str(args.stub_lines)
+    os.environ["STUB_DURATION"] = str(args.stub_seconds)
+    ansiblePower.app.config["WTF_CSRF_ENABLED"] = False
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    results = {
+        "benchmark": "endpoints",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"requests": args.requests, "heavy_requests": args.heavy_requests, "runs": args.runs,
+                       "stub_lines": args.stub_lines, "stub_seconds": args.stub_seconds},
+        "sizes": {},
+    }
+    work_dir = tempfile.mkdtemp(prefix="ansiblepower-bench-")
+    try:
+        for size in sizes:
+            print("Benchmarking %d rows..." % size, file=sys.stderr)
+            results["sizes"][str(size)] = bench_size(size, args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["regressions"] = compare(json.load(f), results)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    if results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
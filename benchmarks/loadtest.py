@@ -0,0 +1,585 @@
+#!/usr/bin/env python3
+"""
+Load Test for AnsiblePower under Gunicorn
+
+Starts the app under Gunicorn the way the Dockerfile does, with
+benchmarks/stub_ansible_playbook.py as the playbook binary and a throwaway
+data directory, then drives mixed traffic from concurrent virtual users:
+playbook runs followed over their output stream, history browsing, system
+status polling and hosts file edits. Every concurrency level reports
+throughput, latency percentiles, errors and how saturated the workers were,
+so worker and thread counts can be sized from data. Each combination of
+--workers and --threads gets a server of its own.
+
+Usage:
+    python benchmarks/loadtest.py [--workers 2] [--threads 8] [--concurrency 1,8,32]
+        [--duration 20] [--mix run=1,history=4,status=4,hosts=1]
+        [--history-rows N] [--stub-lines N] [--stub-seconds S] [--output results.json]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+import psutil
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB = os.path.join(BENCH_DIR, "stub_ansible_playbook.py")
+
+PLAYBOOK = "loadtest.yml"
+INVENTORY = "[loadtest]\nlocalhost ansible_connection=local\n"
+# The Dockerfile's request timeout.
+GUNICORN_TIMEOUT = 120
+STARTUP_TIMEOUT = 30
+# Workers save their metrics at most this often (ansiblePower.METRICS_WRITE_INTERVAL).
+METRICS_WRITE_INTERVAL = 5.0
+SETTLE_ATTEMPTS = 20
+# Requests that only exist for the harness do not count as server work.
+HARNESS_ENDPOINTS = ("main.health", "main.metrics_endpoint")
+DURATION_METRIC = re.compile(r'^ansiblepower_http_request_duration_seconds_(sum|count)\{([^}]*)\} (\S+)$')
+CSRF_META = re.compile(r'<meta name="csrf-token" content="([^"]+)"')
+
+# A level counts as saturated when any of these is reached.
+SATURATED_WORKER_CPU = 0.85
+SATURATED_THREAD_DEMAND = 0.8
+SATURATED_ERROR_RATE = 0.01
+# Waiting for a thread must also exceed this, so client overhead is not mistaken for queueing.
+SATURATED_QUEUE_WAIT_MS = 10.0
+# Above this the load generator itself, not the server, may be the limit.
+CLIENT_CPU_LIMIT = 0.9
+
+
+class OperationAborted(Exception):
+    """A request of an operation failed; the rest of the operation is skipped."""
+
+
+class Client:
+    """A browser-like session: one keep-alive connection and a session cookie."""
+
+    def __init__(self, port, timeout):
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+        self.cookie = None
+        self.csrf_token = None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _headers(self, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        return headers
+
+    def request(self, method, path, body=None, headers=None):
+        """Return (status, body); retries once when a kept-alive connection was dropped."""
+        headers = self._headers(headers)
+        for attempt in (1, 2):
+            reused = self.connection is not None
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if reused and attempt == 1:
+                    continue
+                raise
+            except Exception:
+                self.close()
+                raise
+            cookie = response.getheader("Set-Cookie")
+            if cookie:
+                self.cookie = cookie.split(";", 1)[0]
+            return response.status, data
+
+    def start_session(self):
+        status, body = self.request("GET", "/settings/")
+        match = CSRF_META.search(body.decode("utf-8", "replace"))
+        if status != 200 or not match:
+            raise RuntimeError("Could not start a session: /settings/ returned %d" % status)
+        self.csrf_token = match.group(1)
+
+    def follow_stream(self, job_id):
+        """Read a job's event stream until its done event and return the final status."""
+        # Like EventSource, the stream gets a connection of its own.
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+        try:
+            connection.request("GET", "/jobs/%s/stream" % job_id, headers=self._headers())
+            response = connection.getresponse()
+            if response.status != 200:
+                raise OperationAborted("http_%d" % response.status)
+            event = None
+            while True:
+                line = response.readline()
+                if not line:
+                    raise OperationAborted("stream_closed")
+                line = line.decode("utf-8", "replace").rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:") and event == "done":
+                    return json.loads(line[5:])["status"]
+                elif not line:
+                    event = None
+        finally:
+            connection.close()
+
+
+class VirtualUser(threading.Thread):
+    """Picks operations from the mix until stopped and records every request."""
+
+    def __init__(self, index, client, mix, stop, seed):
+        super().__init__(name="loadtest-user-%d" % index, daemon=True)
+        self.index = index
+        self.client = client
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.stop = stop
+        self.random = random.Random(seed + index)
+        self.started = None
+        # (request name, offset from the level start, seconds, error kind or None)
+        self.samples = []
+        self.runs = {}
+        self.stream_seconds = 0.0
+
+    def record(self, name, started, kind=None):
+        now = time.perf_counter()
+        self.samples.append((name, now - self.started, now - started, kind))
+        if kind:
+            raise OperationAborted(kind)
+
+    def call(self, name, method, path, form=None, expect=200):
+        headers = {}
+        body = None
+        if method == "POST":
+            body = urlencode(form or {})
+            headers = {"Content-Type": "application/x-www-form-urlencoded", "X-CSRFToken": self.client.csrf_token}
+        started = time.perf_counter()
+        try:
+            status, data = self.client.request(method, path, body, headers)
+        except socket.timeout:
+            self.record(name, started, "timeout")
+        except (OSError, http.client.HTTPException):
+            self.record(name, started, "connection")
+        self.record(name, started, None if status == expect else "http_%d" % status)
+        return data
+
+    def op_run(self):
+        body = self.call("run_submit", "POST", "/run_playbook", {"playbook": PLAYBOOK}, expect=202)
+        job_id = json.loads(body)["job_id"]
+        started = time.perf_counter()
+        try:
+            status = self.client.follow_stream(job_id)
+        except OperationAborted as e:
+            status = str(e)
+        except socket.timeout:
+            status = "timeout"
+        except (OSError, http.client.HTTPException):
+            status = "connection"
+        finally:
+            self.stream_seconds += time.perf_counter() - started
+        self.runs[status] = self.runs.get(status, 0) + 1
+        self.record("run_complete", started, None if status == "succeeded" else "run_" + status)
+
+    def op_history(self):
+        self.call("history_page", "GET", "/history/")
+        runs = json.loads(self.call("history_runs_api", "GET", "/history/api/runs?limit=50"))["runs"]
+        if runs:
+            self.call("history_run_detail", "GET", "/history/api/runs/%d" % self.random.choice(runs)["id"])
+
+    def op_status(self):
+        self.call("system_status", "GET", "/settings/system_status")
+
+    def op_hosts(self):
+        self.call("hosts_get", "GET", "/settings/get_hosts")
+        content = INVENTORY + "# saved by virtual user %d at %.3f\n" % (self.index, time.time())
+        self.call("hosts_save", "POST", "/settings/save_hosts", {"content": content})
+
+    def run(self):
+        self.started = time.perf_counter()
+        while not self.stop.is_set():
+            operation = self.random.choices(self.operations, self.weights)[0]
+            try:
+                getattr(self, "op_" + operation)()
+            except OperationAborted:
+                pass
+        self.client.close()
+
+
+OPERATIONS = ("run", "history", "status", "hosts")
+
+
+class GunicornServer:
+    """The app under Gunicorn on a free local port, with its own data directory."""
+
+    def __init__(self, data_dir, workers, threads, args):
+        self.data_dir = data_dir
+        self.workers = workers
+        self.threads = threads
+        self.args = args
+        self.process = None
+        self.port = None
+        self.log_path = os.path.join(data_dir, "gunicorn.log")
+
+    def start(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        env = dict(os.environ)
+        env.update({
+            "ANSIBLEPOWER_DATA_DIR": self.data_dir,
+            "ANSIBLEPOWER_LOG_DIR": os.path.join(self.data_dir, "logs"),
+            "ANSIBLE_PLAYBOOK_BIN": STUB,
+            "STUB_OUTPUT_LINES": str(self.args.stub_lines),
+            "STUB_DURATION": str(self.args.stub_seconds),
+            # Workers must share the key, or a CSRF token from one fails on another.
+            "FLASK_SECRET_KEY": "loadtest-" + uuid.uuid4().hex,
+        })
+        if self.args.job_workers:
+            env["ANSIBLEPOWER_JOB_WORKERS"] = str(self.args.job_workers)
+        command = [sys.executable, "-m", "gunicorn", "--bind", "127.0.0.1:%d" % self.port,
+                   "--workers", str(self.workers), "--threads", str(self.threads),
+                   "--timeout", str(GUNICORN_TIMEOUT), "ansiblePower:app"]
+        with open(self.log_path, "w") as log:
+            self.process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log,
+                                            stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if self.get("/health")[0] == 200 and len(self.worker_processes()) == self.workers:
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError("Gunicorn did not start:\n" + self.log_tail())
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def log_tail(self, lines=20):
+        with open(self.log_path, errors="replace") as f:
+            return "".join(f.readlines()[-lines:])
+
+    def count_log(self, text):
+        with open(self.log_path, errors="replace") as f:
+            return sum(text in line for line in f)
+
+    def get(self, path):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.args.timeout)
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def worker_processes(self):
+        try:
+            return psutil.Process(self.process.pid).children()
+        except psutil.NoSuchProcess:
+            return []
+
+    def worker_usage(self):
+        """Return {pid: (cpu seconds, rss bytes)} of the current workers."""
+        usage = {}
+        for worker in self.worker_processes():
+            try:
+                with worker.oneshot():
+                    times = worker.cpu_times()
+                    usage[worker.pid] = (times.user + times.system, worker.memory_info().rss)
+            except psutil.NoSuchProcess:
+                pass
+        return usage
+
+    def server_time(self):
+        """Return (seconds, requests) the app spent serving load-test requests."""
+        status, body = self.get("/metrics")
+        if status != 200:
+            raise RuntimeError("/metrics returned %d" % status)
+        totals = {"sum": 0.0, "count": 0.0}
+        for line in body.decode("utf-8").splitlines():
+            match = DURATION_METRIC.match(line)
+            if match and not any('endpoint="%s"' % name in match.group(2) for name in HARNESS_ENDPOINTS):
+                totals[match.group(1)] += float(match.group(3))
+        return totals["sum"], totals["count"]
+
+    def settle_metrics(self, since):
+        """Get every worker to save its metrics, so /metrics covers all requests up to since."""
+        time.sleep(METRICS_WRITE_INTERVAL + 0.5)
+        metrics_dir = os.path.join(self.data_dir, "metrics")
+        for _ in range(SETTLE_ATTEMPTS):
+            try:
+                written = {int(name.split("-", 1)[0]) for name in os.listdir(metrics_dir)
+                           if name[0].isdigit() and os.path.getmtime(os.path.join(metrics_dir, name)) >= since}
+            except OSError:
+                written = set()
+            pending = [worker for worker in self.worker_processes() if worker.pid not in written]
+            if not pending:
+                return True
+            # New connections are spread over the workers by the kernel.
+            for _ in range(len(pending) * 4):
+                self.get("/health")
+        return False
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def latency_summary(seconds):
+    ordered = sorted(seconds)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p90_ms": round(percentile(ordered, 0.90) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def run_level(server, concurrency, mix, args):
+    users = []
+    stop = threading.Event()
+    for index in range(concurrency):
+        client = Client(server.port, args.timeout)
+        client.start_session()
+        users.append(VirtualUser(index, client, mix, stop, args.seed))
+    busy_before, served_before = server.server_time()
+    usage_before = server.worker_usage()
+    timeouts_before = server.count_log("WORKER TIMEOUT")
+    client_before = sum(psutil.Process().cpu_times()[:2])
+
+    started = time.perf_counter()
+    for user in users:
+        user.start()
+    time.sleep(args.duration)
+    stop.set()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - started
+    finished = time.time()
+
+    client_cpu = (sum(psutil.Process().cpu_times()[:2]) - client_before) / elapsed
+    usage_after = server.worker_usage()
+    settled = server.settle_metrics(finished)
+    busy_after, served_after = server.server_time()
+
+    samples = [sample for user in users for sample in user.samples]
+    in_window = [sample for sample in samples if sample[1] <= args.duration]
+    errors = {}
+    by_name = {}
+    for name, _, seconds, kind in samples:
+        entry = by_name.setdefault(name, {"seconds": [], "errors": 0})
+        if kind:
+            errors[kind] = errors.get(kind, 0) + 1
+            entry["errors"] += 1
+        else:
+            entry["seconds"].append(seconds)
+    operations = {}
+    for name, entry in sorted(by_name.items()):
+        operations[name] = latency_summary(entry["seconds"])
+        operations[name]["errors"] = entry["errors"]
+    requests = [sample for sample in samples if sample[0] != "run_complete"]
+    request_seconds = [seconds for name, _, seconds, kind in requests if not kind]
+    runs = {}
+    for user in users:
+        for status, count in user.runs.items():
+            runs[status] = runs.get(status, 0) + count
+
+    # Streams hold a worker thread until the run ends but are not timed by the app.
+    # Thread demand is busy thread-seconds per available one; above 1 requests wait.
+    stream_seconds = sum(user.stream_seconds for user in users)
+    busy = busy_after - busy_before
+    served = served_after - served_before
+    server_mean = busy / served if served else 0.0
+    client_mean = sum(request_seconds) / len(request_seconds) if request_seconds else 0.0
+    worker_cpu = [round((usage_after[pid][0] - usage_before[pid][0]) / elapsed, 3)
+                  for pid in sorted(usage_after) if pid in usage_before]
+    saturation = {
+        "worker_cpu": worker_cpu,
+        "max_worker_cpu": max(worker_cpu) if worker_cpu else None,
+        "worker_rss_mib": [round(usage_after[pid][1] / 2 ** 20, 1) for pid in sorted(usage_after)],
+        "thread_demand": round((busy + stream_seconds) / (elapsed * server.workers * server.threads), 3),
+        "server_mean_ms": round(server_mean * 1000, 2),
+        "queue_wait_ms": round(max(client_mean - server_mean, 0.0) * 1000, 2),
+        "worker_timeouts": server.count_log("WORKER TIMEOUT") - timeouts_before,
+        "worker_restarts": len(set(usage_before) - set(usage_after)),
+        "metrics_complete": settled,
+    }
+    error_count = sum(errors.values())
+    reasons = []
+    if worker_cpu and max(worker_cpu) >= SATURATED_WORKER_CPU:
+        reasons.append("worker_cpu")
+    if saturation["thread_demand"] >= SATURATED_THREAD_DEMAND:
+        reasons.append("threads_busy")
+    if saturation["queue_wait_ms"] > max(saturation["server_mean_ms"], SATURATED_QUEUE_WAIT_MS):
+        reasons.append("requests_queued")
+    if samples and error_count / len(samples) >= SATURATED_ERROR_RATE:
+        reasons.append("errors")
+    if saturation["worker_timeouts"]:
+        reasons.append("worker_timeouts")
+    saturation["saturated"] = bool(reasons)
+    saturation["reasons"] = reasons
+
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "requests": len(requests),
+        "throughput_rps": round(sum(1 for sample in in_window if sample[0] != "run_complete")
+                                / args.duration, 2),
+        "errors": error_count,
+        "error_rate": round(error_count / len(samples), 4) if samples else 0.0,
+        "error_kinds": errors,
+        "latency_ms": latency_summary(request_seconds),
+        "operations": operations,
+        "runs": runs,
+        "saturation": saturation,
+        "client_cpu": round(client_cpu, 3),
+        "client_limited": client_cpu >= CLIENT_CPU_LIMIT,
+    }
+
+
+def seed_data_dir(seed_dir, rows):
+    """Create a history database with rows runs for every server to start from."""
+    os.environ["ANSIBLEPOWER_DATA_DIR"] = seed_dir
+    os.environ["ANSIBLEPOWER_LOG_DIR"] = os.path.join(seed_dir, "logs")
+    # Imported here so the app creates its files in the seed directory.
+    import bench_endpoints
+    bench_endpoints.populate_history(rows)
+    # Copies of the seed directory then need no write-ahead log.
+    bench_endpoints.ansiblePower.get_history_db_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return bench_endpoints.git_commit()
+
+
+def prepare_data_dir(seed_dir, data_dir):
+    shutil.copytree(seed_dir, data_dir, ignore=shutil.ignore_patterns("config.json", "logs", "metrics"))
+    playbooks_dir = os.path.join(data_dir, "playbooks")
+    os.makedirs(playbooks_dir)
+    with open(os.path.join(playbooks_dir, PLAYBOOK), "w") as f:
+        f.write("- name: Load test\n  hosts: all\n  tasks:\n    - ping:\n")
+    hosts_file = os.path.join(data_dir, "hosts")
+    with open(hosts_file, "w") as f:
+        f.write(INVENTORY)
+    with open(os.path.join(data_dir, "config.json"), "w") as f:
+        json.dump({"playbooks_dir": playbooks_dir, "hosts_file": hosts_file}, f, indent=2)
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError("unknown operation %r, use %s" % (name, ", ".join(OPERATIONS)))
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid weight for %s: %r" % (name, weight))
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=parse_list, default=[2], help="Comma-separated Gunicorn worker counts")
+    parser.add_argument("--threads", type=parse_list, default=[8], help="Comma-separated threads per worker")
+    parser.add_argument("--concurrency", type=parse_list, default=[1, 8, 32],
+                        help="Comma-separated numbers of concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of traffic per concurrency level")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("run=1,history=4,status=4,hosts=1"),
+                        help="Operation weights, from %s" % ", ".join(OPERATIONS))
+    parser.add_argument("--history-rows", type=int, default=10000, help="Runs in history before the test")
+    parser.add_argument("--stub-lines", type=int, default=200, help="Output lines per stub run")
+    parser.add_argument("--stub-seconds", type=float, default=2.0, help="Duration of each stub run")
+    parser.add_argument("--job-workers", type=int, help="ANSIBLEPOWER_JOB_WORKERS for the server")
+    parser.add_argument("--timeout", type=float, default=GUNICORN_TIMEOUT, help="Client timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the operation choices")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="ansiblepower-loadtest-")
+    try:
+        seed_dir = os.path.join(work_dir, "seed")
+        print("Seeding %d history rows..." % args.history_rows, file=sys.stderr)
+        commit = seed_data_dir(seed_dir, args.history_rows)
+        results = {
+            "benchmark": "loadtest",
+            "commit": commit,
+            "parameters": {"duration": args.duration, "mix": args.mix, "history_rows": args.history_rows,
+                           "stub_lines": args.stub_lines, "stub_seconds": args.stub_seconds,
+                           "job_workers": args.job_workers, "cpu_count": os.cpu_count()},
+            "servers": [],
+        }
+        for workers in args.workers:
+            for threads in args.threads:
+                data_dir = os.path.join(work_dir, "w%d-t%d" % (workers, threads))
+                prepare_data_dir(seed_dir, data_dir)
+                server = GunicornServer(data_dir, workers, threads, args).start()
+                levels = []
+                try:
+                    server.settle_metrics(time.time())
+                    for concurrency in args.concurrency:
+                        print("workers=%d threads=%d concurrency=%d..." % (workers, threads, concurrency),
+                              file=sys.stderr)
+                        levels.append(run_level(server, concurrency, args.mix, args))
+                finally:
+                    server.stop()
+                peak = max(levels, key=lambda level: level["throughput_rps"])
+                saturated = [level["concurrency"] for level in levels if level["saturation"]["saturated"]]
+                results["servers"].append({
+                    "workers": workers,
+                    "threads": threads,
+                    "peak_throughput_rps": peak["throughput_rps"],
+                    "peak_concurrency": peak["concurrency"],
+                    "saturated_at": saturated[0] if saturated else None,
+                    "levels": levels,
+                })
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Stand-in for ansible-playbook used by the benchmarks.
+
+Prints ansible-like output for every target host and, like the bundled
+results callback, appends task results to ANSIBLEPOWER_RESULTS_FILE. Point
+ANSIBLE_PLAYBOOK_BIN at this file to run AnsiblePower without Ansible.
+
+Environment:
+    STUB_OUTPUT_LINES   lines of task output to print (default 200)
+    STUB_DURATION       seconds to spread the output over (default 0)
+    STUB_EXIT_CODE      exit code to return (default 0)
+"""
+
+import json
+import os
+import sys
+import time
+
+
+def main():
+    args = sys.argv[1:]
+    lines = int(os.environ.get("STUB_OUTPUT_LINES", "200"))
+    duration = float(os.environ.get("STUB_DURATION", "0"))
+    hosts = ["localhost"]
+    if "--limit" in args:
+        with open(args[args.index("--limit") + 1].lstrip("@")) as f:
+            hosts = f.read().split()
+
+    print("PLAY [Benchmark] " + "*" * 60)
+    delay = duration / lines if lines else 0
+    for i in range(lines):
+        host = hosts[i % len(hosts)]
+        print("TASK [step %d] %s" % (i, "*" * 50))
+        print("ok: [%s] => {\"msg\": \"benchmark output line %d\"}" % (host, i))
+        if delay:
+            sys.stdout.flush()
+            time.sleep(delay)
+    if duration and not lines:
+        time.sleep(duration)
+
+    counts = {host: len(range(index, lines, len(hosts))) for index, host in enumerate(hosts)}
+    print()
+    print("PLAY RECAP " + "*" * 60)
+    for host in hosts:
+        print("%s : ok=%d changed=0 unreachable=0 failed=0 skipped=0 rescued=0 ignored=0"
+              % (host, counts[host]))
+
+    results = os.environ.get("ANSIBLEPOWER_RESULTS_FILE")
+    if results:
+        with open(results, "a") as f:
+            for i in range(lines):
+                f.write(json.dumps({"type": "task", "host": hosts[i % len(hosts)], "task": "step %d" % i,
+                                    "status": "ok", "duration": delay}) + "\n")
+            for host in hosts:
+                f.write(json.dumps({"type": "host", "host": host, "ok": counts[host]}) + "\n")
+    return int(os.environ.get("STUB_EXIT_CODE", "0"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
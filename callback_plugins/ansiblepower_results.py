@@ -0,0 +1,106 @@
+"""Ansible callback that records per-host task results for AnsiblePower.
+
+AnsiblePower enables this callback next to the normal stdout callback, so the
+run output stays human-readable while every task result and the final recap
+are also appended, one JSON object per line, to the file named by the
+ANSIBLEPOWER_RESULTS_FILE environment variable. The app loads that file into
+its history database once the run has finished. Task results carry how long
+the task took on that host.
+"""
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = """
+    name: ansiblepower_results
+    type: aggregate
+    short_description: Write per-host task results as JSON lines
+    description:
+      - Appends one JSON object per task result and per host recap to the
+        file named by ANSIBLEPOWER_RESULTS_FILE.
+    requirements:
+      - enabled in callbacks_enabled
+"""
+
+MESSAGE_LIMIT = 1000
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "ansiblepower_results"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self._play = None
+        self._task_started = {}
+        self._fd = None
+        path = os.environ.get("ANSIBLEPOWER_RESULTS_FILE")
+        if path:
+            # O_APPEND with one write per line lets the shards of a fan-out
+            # run share a file without interleaving records.
+            self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+    def _emit(self, record):
+        if self._fd is not None:
+            os.write(self._fd, (json.dumps(record, default=str) + "\n").encode("utf-8"))
+
+    def _result(self, result, status, ignored=False):
+        task = result._task
+        role = getattr(task, "_role", None)
+        message = result._result.get("msg") or result._result.get("stderr") or ""
+        started = self._task_started.get(task._uuid)
+        self._emit({
+            "type": "task",
+            "play": self._play,
+            "task": task.get_name(),
+            "action": task.action,
+            "role": role.get_name() if role else None,
+            "host": result._host.get_name(),
+            "status": status,
+            "ignored": ignored,
+            "msg": str(message)[:MESSAGE_LIMIT],
+            "duration": round(time.time() - started, 3) if started else None,
+        })
+
+    def v2_playbook_on_play_start(self, play):
+        self._play = play.get_name()
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._task_started[task._uuid] = time.time()
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._task_started[task._uuid] = time.time()
+
+    def v2_runner_on_ok(self, result):
+        self._result(result, "changed" if result._result.get("changed") else "ok")
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._result(result, "failed", ignored=ignore_errors)
+
+    def v2_runner_on_skipped(self, result):
+        self._result(result, "skipped")
+
+    def v2_runner_on_unreachable(self, result):
+        self._result(result, "unreachable")
+
+    def v2_playbook_on_stats(self, stats):
+        for host in sorted(stats.processed):
+            summary = stats.summarize(host)
+            self._emit({
+                "type": "host",
+                "host": host,
+                "ok": summary.get("ok", 0),
+                "changed": summary.get("changed", 0),
+                "unreachable": summary.get("unreachable", 0),
+                "failed": summary.get("failures", 0),
+                "skipped": summary.get("skipped", 0),
+                "rescued": summary.get("rescued", 0),
+                "ignored": summary.get("ignored", 0),
+            })
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
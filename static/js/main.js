@@ -49,13 +49,16 @@ document.addEventListener("DOMContentLoaded", function(){
                     "Content-Type": "application/x-www-form-urlencoded",
                     "X-CSRFToken": csrfToken
                 },
-                body: "playbook=" + encodeURIComponent(playbook)
+                body: "playbook=" + encodeURIComponent(playbook) + (btn.dataset.fanout ? "&fanout=1" : "")
             })
             .then(res => res.json())
             .then(data => {
-                setTimeout(() => {
-                    outputEl.textContent = data.output || data.error;
-                }, 1000);
+                if(!data.job_id) {
+                    outputEl.textContent = data.error || "Error starting playbook.";
+                    return;
+                }
+                outputEl.textContent = "Queued, waiting for a free worker...";
+                streamJob(data.job_id, outputEl);
             })
             .catch(err => {
                 outputEl.textContent = "Error: Could not connect to server. " + err.message;
@@ -63,6 +66,53 @@ document.addEventListener("DOMContentLoaded", function(){
         });
     });
 
+    // Stream a background job's output live over Server-Sent Events
+    function streamJob(jobId, outputEl) {
+        const source = new EventSource("/jobs/" + encodeURIComponent(jobId) + "/stream");
+        let started = false;
+        source.addEventListener("status", function(e) {
+            const status = JSON.parse(e.data).status;
+            if(!started && status === "running") {
+                outputEl.textContent = "";
+                started = true;
+            }
+        });
+        source.onmessage = function(e) {
+            if(!started) {
+                outputEl.textContent = "";
+                started = true;
+            }
+            outputEl.textContent += e.data + "\n";
+            outputEl.scrollTop = outputEl.scrollHeight;
+        };
+        source.addEventListener("done", function(e) {
+            source.close();
+            const status = JSON.parse(e.data).status;
+            if(status !== "succeeded") {
+                showToast("Playbook run " + status + ".", "error");
+            }
+        });
+    }
+
+    // File bodies the server has sent, revalidated with If-None-Match so an
+    // unchanged file is answered with an empty 304.
+    const contentCache = new Map();
+    function fetchContent(url) {
+        const cached = contentCache.get(url);
+        return fetch(url, {
+            cache: "no-store",
+            headers: cached ? {"If-None-Match": cached.etag} : {}
+        })
+        .then(res => {
+            if(res.status === 304 && cached) return {content: cached.content};
+            return res.json().then(data => {
+                const etag = res.headers.get("ETag");
+                if(res.ok && etag) contentCache.set(url, {etag: etag, content: data.content});
+                return data;
+            });
+        });
+    }
+
     // Show playbook content
     document.querySelectorAll(".show-btn").forEach(btn => {
         btn.addEventListener("click", function(){
@@ -72,15 +122,7 @@ document.addEventListener("DOMContentLoaded", function(){
             outputEl.style.display = "block";
             outputEl.textContent = "Loading...";
 
-            fetch("/show_playbook", {
-                method: "POST",
-                headers: {
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "X-CSRFToken": csrfToken
-                },
-                body: "playbook=" + encodeURIComponent(playbook)
-            })
-            .then(res => res.json())
+            fetchContent("/show_playbook?playbook=" + encodeURIComponent(playbook))
             .then(data => {
                 outputEl.textContent = data.content || data.error || "Error fetching content.";
             })
@@ -100,8 +142,7 @@ document.addEventListener("DOMContentLoaded", function(){
 
     if(showHostsBtn && editHostsBtn && hostsBox && hostsContent && saveHostsBtn && hostsError) {
         showHostsBtn.addEventListener("click", function(){
-            fetch("/settings/get_hosts")
-            .then(r => r.json())
+            fetchContent("/settings/get_hosts")
             .then(data => {
                 if(data.content) {
                     hostsError.textContent = "";
@@ -117,8 +158,7 @@ document.addEventListener("DOMContentLoaded", function(){
         });
 
         editHostsBtn.addEventListener("click", function(){
-            fetch("/settings/get_hosts")
-            .then(r => r.json())
+            fetchContent("/settings/get_hosts")
             .then(data => {
                 if(data.content) {
                     hostsError.textContent = "";
@@ -153,18 +193,78 @@ document.addEventListener("DOMContentLoaded", function(){
         });
     }
 
+    // Resolve an inventory host pattern
+    const resolveForm = document.getElementById("inventory-resolve-form");
+    if(resolveForm) {
+        const resultEl = document.getElementById("inventory-resolve-result");
+        resolveForm.addEventListener("submit", function(e){
+            e.preventDefault();
+            const pattern = document.getElementById("inventory-pattern").value || "all";
+            fetch("/settings/inventory/resolve?pattern=" + encodeURIComponent(pattern))
+            .then(r => r.json())
+            .then(data => {
+                resultEl.textContent = data.error
+                    ? data.error
+                    : data.count + " host(s): " + data.hosts.join(", ");
+            });
+        });
+    }
+
     // System status
     const statusBtn = document.getElementById("status-btn");
     const statusBox = document.getElementById("status-box");
     if(statusBtn && statusBox) {
-        statusBtn.addEventListener("click", function(){
+        const SVG_NS = "http://www.w3.org/2000/svg";
+        let statusTimer = null;
+
+        // Percentages over the sampled window as an inline line chart
+        function sparkline(series, key, color) {
+            const svg = document.createElementNS(SVG_NS, "svg");
+            svg.setAttribute("viewBox", "0 0 300 50");
+            svg.setAttribute("class", "mr-3");
+            svg.style.width = "300px";
+            svg.style.height = "50px";
+            const line = document.createElementNS(SVG_NS, "polyline");
+            const step = series.length > 1 ? 300 / (series.length - 1) : 0;
+            line.setAttribute("points", series.map((sample, i) =>
+                (i * step).toFixed(1) + "," + (50 - (sample[key] || 0) / 2).toFixed(1)).join(" "));
+            line.setAttribute("fill", "none");
+            line.setAttribute("stroke", color);
+            svg.appendChild(line);
+            return svg;
+        }
+
+        function loadStatus() {
             fetch("/settings/system_status")
             .then(r => r.json())
             .then(data => {
+                if(data.error) {
+                    statusBox.textContent = data.error;
+                    return;
+                }
                 statusBox.style.display = "block";
-                statusBox.textContent = "CPU: " + data.cpu + "% | Memory: " + data.memory + "%";
+                const summary = document.createElement("div");
+                summary.textContent = "CPU: " + data.cpu + "% | Memory: " + data.memory + "%"
+                    + (data.load ? " | Load: " + data.load.join(" ") : "")
+                    + (data.disk !== null ? " | Disk: " + data.disk + "%" : "")
+                    + " | Ansible processes: " + data.ansible_processes;
+                const charts = document.createElement("div");
+                charts.className = "mt-2";
+                if(data.series.length > 1) {
+                    charts.appendChild(sparkline(data.series, "cpu", "#17a2b8"));
+                    charts.appendChild(sparkline(data.series, "memory", "#6f42c1"));
+                    const legend = document.createElement("small");
+                    legend.className = "text-muted d-block";
+                    legend.textContent = "CPU (teal) and memory (purple), last " + Math.round(data.window / 60) + " minutes";
+                    charts.appendChild(legend);
+                }
+                statusBox.replaceChildren(summary, charts);
+                clearTimeout(statusTimer);
+                statusTimer = setTimeout(loadStatus, data.interval * 1000);
             });
-        });
+        }
+
+        statusBtn.addEventListener("click", loadStatus);
     }
 
     // Clear history
@@ -185,6 +285,458 @@ document.addEventListener("DOMContentLoaded", function(){
         });
     }
 
+    // Performance profiles: edited as JSON, one of them active
+    const profilesForm = document.getElementById("profiles-form");
+    if(profilesForm) {
+        const editor = document.getElementById("profiles-json");
+        const activeSelect = document.getElementById("profiles-active");
+        const messageEl = document.getElementById("profiles-message");
+        const showProfiles = data => {
+            // Built-in profiles are always available and not saved to config.json.
+            const custom = {};
+            Object.keys(data.profiles).forEach(name => {
+                if(!data.builtin || !data.builtin.includes(name)) custom[name] = data.profiles[name];
+            });
+            editor.value = JSON.stringify(custom, null, 2);
+            activeSelect.innerHTML = "";
+            Object.keys(data.profiles).forEach(name => {
+                const option = document.createElement("option");
+                option.value = name;
+                option.textContent = name + " " + JSON.stringify(data.profiles[name]);
+                option.selected = name === data.active;
+                activeSelect.appendChild(option);
+            });
+        };
+        fetch("/settings/performance_profiles").then(r => r.json()).then(showProfiles);
+
+        profilesForm.addEventListener("submit", function(e){
+            e.preventDefault();
+            let profiles;
+            try {
+                profiles = JSON.parse(editor.value || "{}");
+            } catch(err) {
+                messageEl.textContent = "Invalid JSON: " + err.message;
+                return;
+            }
+            fetch("/settings/performance_profiles", {
+                method: "POST",
+                headers: {"Content-Type": "application/json", "X-CSRFToken": csrfToken},
+                body: JSON.stringify({profiles: profiles, active: activeSelect.value})
+            })
+            .then(r => r.json())
+            .then(data => {
+                if(data.error) {
+                    messageEl.textContent = data.error;
+                    return;
+                }
+                messageEl.textContent = "Saved.";
+                fetch("/settings/performance_profiles").then(r => r.json()).then(showProfiles);
+            });
+        });
+    }
+
+    // Fact cache settings and cached hosts
+    const factCacheForm = document.getElementById("fact-cache-form");
+    if(factCacheForm) {
+        const hostsList = document.getElementById("fact-cache-hosts");
+        const post = (url, body) => fetch(url, {
+            method: "POST",
+            headers: {"Content-Type": "application/json", "X-CSRFToken": csrfToken},
+            body: body ? JSON.stringify(body) : null
+        }).then(r => r.json());
+        const loadFactCache = () => fetch("/settings/fact_cache")
+            .then(r => r.json())
+            .then(data => {
+                document.getElementById("fact-cache-enabled").checked = data.enabled;
+                document.getElementById("fact-cache-timeout").value = data.timeout;
+                hostsList.innerHTML = "";
+                if(!data.hosts.length) {
+                    hostsList.textContent = "No hosts cached yet.";
+                }
+                data.hosts.forEach(entry => {
+                    const item = document.createElement("li");
+                    item.textContent = entry.host + " (updated " + entry.updated + (entry.expired ? ", expired" : "") + ") ";
+                    const btn = document.createElement("button");
+                    btn.className = "btn btn-sm btn-link p-0";
+                    btn.textContent = "Invalidate";
+                    btn.addEventListener("click", () => {
+                        post("/settings/fact_cache/" + encodeURIComponent(entry.host) + "/invalidate").then(loadFactCache);
+                    });
+                    item.appendChild(btn);
+                    hostsList.appendChild(item);
+                });
+            });
+
+        factCacheForm.addEventListener("submit", function(e){
+            e.preventDefault();
+            post("/settings/fact_cache", {
+                enabled: document.getElementById("fact-cache-enabled").checked,
+                timeout: parseInt(document.getElementById("fact-cache-timeout").value, 10)
+            }).then(data => {
+                if(data.error) alert(data.error);
+                loadFactCache();
+            });
+        });
+        document.getElementById("fact-cache-purge-btn").addEventListener("click", function(){
+            post("/settings/fact_cache/purge").then(loadFactCache);
+        });
+        loadFactCache();
+    }
+
+    // Request profiling mode and the slowest stored profiles
+    const profilingForm = document.getElementById("profiling-form");
+    if(profilingForm) {
+        const profilesList = document.getElementById("profiles-list");
+        const post = (url, body) => fetch(url, {
+            method: "POST",
+            headers: {"Content-Type": "application/json", "X-CSRFToken": csrfToken},
+            body: body ? JSON.stringify(body) : null
+        }).then(r => r.json());
+        const loadProfiling = () => fetch("/settings/profiling")
+            .then(r => r.json())
+            .then(data => {
+                document.getElementById("profiling-mode").value = data.mode;
+                profilesList.replaceChildren();
+                data.profiles.forEach(profile => {
+                    const item = document.createElement("li");
+                    const link = document.createElement("a");
+                    link.href = "/settings/profiling/profiles/" + profile.id + ".pstats";
+                    link.textContent = profile.duration_ms.toFixed(1) + " ms";
+                    item.appendChild(link);
+                    item.appendChild(document.createTextNode(" " + profile.method + " " + profile.path + " (" + profile.time + ")"));
+                    profilesList.appendChild(item);
+                });
+            });
+
+        profilingForm.addEventListener("submit", function(e){
+            e.preventDefault();
+            post("/settings/profiling", {mode: document.getElementById("profiling-mode").value}).then(data => {
+                if(data.error) alert(data.error);
+                loadProfiling();
+            });
+        });
+        document.getElementById("profiles-clear-btn").addEventListener("click", function(){
+            post("/settings/profiling/profiles/clear").then(loadProfiling);
+        });
+        loadProfiling();
+    }
+
+    // History retention policy and compaction
+    const retentionForm = document.getElementById("retention-form");
+    if(retentionForm) {
+        const statsEl = document.getElementById("retention-stats");
+        const fields = ["max_age_days", "max_rows", "max_output_bytes", "keep_last_per_playbook"];
+        let currentPolicy = {};
+        const loadRetention = () => fetch("/settings/history_retention")
+            .then(r => r.json())
+            .then(data => {
+                currentPolicy = data.policy;
+                fields.forEach(name => {
+                    const value = data.policy[name];
+                    retentionForm.elements[name].value = typeof value === "number" ? value : "";
+                });
+                const db = data.stats.database;
+                const totals = data.stats.totals;
+                statsEl.textContent = db.runs + " runs, " + (db.bytes / 1048576).toFixed(1) + " MB. "
+                    + totals.compactions + " compactions removed " + totals.runs_deleted + " runs and reclaimed "
+                    + (totals.reclaimed_bytes / 1048576).toFixed(1) + " MB.";
+            });
+
+        retentionForm.addEventListener("submit", function(e){
+            e.preventDefault();
+            // Per-playbook overrides are only editable in config.json; keep them.
+            const policy = Object.assign({}, currentPolicy);
+            fields.forEach(name => {
+                const value = retentionForm.elements[name].value;
+                if(value || typeof currentPolicy[name] !== "object" || currentPolicy[name] === null) {
+                    policy[name] = value ? parseInt(value, 10) : null;
+                }
+            });
+            fetch("/settings/history_retention", {
+                method: "POST",
+                headers: {"Content-Type": "application/json", "X-CSRFToken": csrfToken},
+                body: JSON.stringify(policy)
+            })
+            .then(r => r.json())
+            .then(data => {
+                if(data.error) alert(data.error);
+                loadRetention();
+            });
+        });
+
+        document.getElementById("compact-history-btn").addEventListener("click", function(){
+            statsEl.textContent = "Compacting...";
+            fetch("/settings/compact_history", {method: "POST", headers: {"X-CSRFToken": csrfToken}})
+            .then(r => r.json())
+            .then(data => {
+                const poll = () => fetch(data.status_url).then(r => r.json()).then(job => {
+                    if(job.status === "queued" || job.status === "running") {
+                        setTimeout(poll, 1000);
+                    } else {
+                        loadRetention();
+                    }
+                });
+                poll();
+            });
+        });
+        loadRetention();
+    }
+
+    // Task timing report
+    const timingForm = document.getElementById("timing-form");
+    if(timingForm) {
+        function fillRows(tbodyId, rows, columns) {
+            const tbody = document.getElementById(tbodyId);
+            tbody.replaceChildren();
+            if(!rows.length) {
+                const td = document.createElement("td");
+                td.colSpan = columns.length;
+                td.className = "text-muted";
+                td.textContent = "None";
+                tbody.appendChild(document.createElement("tr")).appendChild(td);
+            }
+            rows.forEach(row => {
+                const tr = document.createElement("tr");
+                columns.forEach(column => {
+                    const td = document.createElement("td");
+                    td.textContent = row[column] === null || row[column] === undefined ? "—" : row[column];
+                    tr.appendChild(td);
+                });
+                tbody.appendChild(tr);
+            });
+        }
+
+        function loadTiming() {
+            const playbook = document.getElementById("timing-playbook").value;
+            if(!playbook) return;
+            const runs = document.getElementById("timing-runs").value;
+            fetch("/history/api/timing?playbook=" + encodeURIComponent(playbook) + "&runs=" + encodeURIComponent(runs))
+            .then(r => r.json())
+            .then(data => {
+                if(data.error) {
+                    showToast(data.error, "error");
+                    return;
+                }
+                document.getElementById("timing-report").style.display = "block";
+                document.getElementById("timing-summary").textContent =
+                    "Based on the last " + data.runs + " timed run(s) of " + data.playbook + ".";
+                fillRows("timing-regressions", data.regressions.map(r => Object.assign({}, r, {change: r.change ? "×" + r.change : null})),
+                         ["task", "role", "previous_p50", "current_p50", "change"]);
+                fillRows("timing-tasks", data.slowest_tasks, ["task", "role", "runs", "mean", "p50", "p95", "max"]);
+                fillRows("timing-roles", data.slowest_roles, ["role", "runs", "mean", "p50", "p95", "max"]);
+            })
+            .catch(err => showToast("Could not load timing report: " + err.message, "error"));
+        }
+
+        timingForm.addEventListener("submit", function(e){
+            e.preventDefault();
+            loadTiming();
+        });
+        loadTiming();
+    }
+
+    // History page: virtualized list, pages fetched by keyset as you scroll
+    const historyViewport = document.getElementById("history-viewport");
+    if(historyViewport) {
+        const ROW_HEIGHT = 36;
+        const OVERSCAN = 10;
+        const PAGE_SIZE = 200;
+        const rowsEl = document.getElementById("history-rows");
+        const emptyEl = document.getElementById("history-empty");
+        const detailEl = document.getElementById("history-detail");
+        const detailTitle = document.getElementById("history-detail-title");
+        const detailOutput = document.getElementById("history-detail-output");
+        const outputCache = new Map();
+        let runs = [];
+        let nextBeforeId = null;
+        let loading = false;
+        let exhausted = false;
+
+        function spacer(height) {
+            const tr = document.createElement("tr");
+            tr.className = "spacer";
+            const td = document.createElement("td");
+            td.colSpan = 5;
+            td.style.height = height + "px";
+            tr.appendChild(td);
+            return tr;
+        }
+
+        function renderRows() {
+            const first = Math.max(0, Math.floor(historyViewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+            const visible = Math.ceil(historyViewport.clientHeight / ROW_HEIGHT) + 2 * OVERSCAN;
+            const last = Math.min(runs.length, first + visible);
+            const fragment = document.createDocumentFragment();
+            fragment.appendChild(spacer(first * ROW_HEIGHT));
+            for(let i = first; i < last; i++) {
+                const run = runs[i];
+                const tr = document.createElement("tr");
+                const duration = run.duration === null || run.duration === undefined ? "" : run.duration.toFixed(1) + " s";
+                const exitCode = run.return_code === null || run.return_code === undefined ? "" : run.return_code;
+                [run.time, run.playbook, run.action, duration, exitCode].forEach(value => {
+                    const td = document.createElement("td");
+                    td.textContent = value;
+                    tr.appendChild(td);
+                });
+                tr.addEventListener("click", () => showRun(run));
+                fragment.appendChild(tr);
+            }
+            fragment.appendChild(spacer((runs.length - last) * ROW_HEIGHT));
+            rowsEl.replaceChildren(fragment);
+            if(last >= runs.length - OVERSCAN) {
+                loadMore();
+            }
+        }
+
+        function loadMore() {
+            if(loading || exhausted) return;
+            loading = true;
+            let url = "/history/api/runs?limit=" + PAGE_SIZE;
+            if(nextBeforeId !== null) url += "&before_id=" + nextBeforeId;
+            fetch(url)
+            .then(r => r.json())
+            .then(data => {
+                loading = false;
+                runs = runs.concat(data.runs || []);
+                nextBeforeId = data.next_before_id;
+                exhausted = nextBeforeId === null || nextBeforeId === undefined;
+                emptyEl.style.display = runs.length ? "none" : "block";
+                historyViewport.style.display = runs.length ? "block" : "none";
+                renderRows();
+            })
+            .catch(err => {
+                loading = false;
+                showToast("Could not load history: " + err.message, "error");
+            });
+        }
+
+        function showRun(run) {
+            detailEl.style.display = "block";
+            detailTitle.textContent = run.time + " — " + run.playbook + " (" + run.action + ")"
+                + (run.profile ? " · profile " + run.profile : "")
+                + (run.cpu_seconds !== null && run.cpu_seconds !== undefined ? " · CPU " + run.cpu_seconds.toFixed(1) + " s" : "")
+                + (run.peak_rss ? " · peak RSS " + (run.peak_rss / 1048576).toFixed(0) + " MiB" : "");
+            if(outputCache.has(run.id)) {
+                detailOutput.textContent = outputCache.get(run.id);
+                return;
+            }
+            detailOutput.textContent = "Loading...";
+            fetch("/history/api/runs/" + run.id)
+            .then(r => r.json())
+            .then(data => {
+                const output = data.output !== undefined ? data.output : (data.error || "");
+                outputCache.set(run.id, output);
+                detailOutput.textContent = output;
+            })
+            .catch(err => {
+                detailOutput.textContent = "Error: Could not connect to server. " + err.message;
+            });
+        }
+
+        // Full-text search; snippets arrive HTML-escaped with <mark> highlights
+        const searchForm = document.getElementById("history-search-form");
+        const searchInput = document.getElementById("history-search");
+        const searchResults = document.getElementById("history-search-results");
+        const searchMore = document.getElementById("history-search-more");
+        let searchOffset = 0;
+
+        function runSearch(append) {
+            const query = searchInput.value.trim();
+            if(!query) {
+                searchResults.style.display = "none";
+                searchMore.style.display = "none";
+                return;
+            }
+            if(!append) searchOffset = 0;
+            fetch("/history/api/search?q=" + encodeURIComponent(query) + "&offset=" + searchOffset)
+            .then(r => r.json())
+            .then(data => {
+                if(!append) searchResults.replaceChildren();
+                if(data.error) {
+                    showToast(data.error, "error");
+                    return;
+                }
+                (data.results || []).forEach(run => {
+                    const item = document.createElement("button");
+                    item.type = "button";
+                    item.className = "list-group-item list-group-item-action";
+                    const title = document.createElement("div");
+                    title.className = "font-weight-bold";
+                    title.textContent = run.time + " — " + run.playbook;
+                    const snippet = document.createElement("small");
+                    snippet.innerHTML = run.snippet_html;
+                    item.appendChild(title);
+                    item.appendChild(snippet);
+                    item.addEventListener("click", () => showRun(run));
+                    searchResults.appendChild(item);
+                });
+                if(!searchResults.children.length) {
+                    searchResults.textContent = "No runs match your search.";
+                }
+                searchResults.style.display = "block";
+                searchOffset = data.next_offset;
+                searchMore.style.display = data.next_offset ? "inline-block" : "none";
+            })
+            .catch(err => showToast("Search failed: " + err.message, "error"));
+        }
+
+        searchForm.addEventListener("submit", function(e){
+            e.preventDefault();
+            runSearch(false);
+        });
+        searchMore.addEventListener("click", () => runSearch(true));
+
+        let scrollPending = false;
+        historyViewport.addEventListener("scroll", function(){
+            if(scrollPending) return;
+            scrollPending = true;
+            requestAnimationFrame(() => {
+                scrollPending = false;
+                renderRows();
+            });
+        });
+        loadMore();
+    }
+
+    // Import history as a background job and report its progress
+    const importForm = document.getElementById("import-history-form");
+    if(importForm) {
+        const progressEl = document.getElementById("import-progress");
+        importForm.addEventListener("submit", function(e){
+            e.preventDefault();
+            progressEl.textContent = "Uploading...";
+            fetch(importForm.action, {
+                method: "POST",
+                headers: {"X-CSRFToken": csrfToken},
+                body: new FormData(importForm)
+            })
+            .then(r => r.json())
+            .then(data => {
+                if(!data.job_id) {
+                    progressEl.textContent = data.error || "Import failed.";
+                    return;
+                }
+                const poll = () => fetch(data.status_url)
+                    .then(r => r.json())
+                    .then(job => {
+                        const p = job.progress;
+                        if(job.status === "succeeded") {
+                            progressEl.textContent = "Imported " + p.inserted + " runs, skipped " + p.skipped + ".";
+                            location.reload();
+                        } else if(["failed", "cancelled", "lost"].includes(job.status)) {
+                            progressEl.textContent = "Import " + job.status + (job.error ? ": " + job.error : ".");
+                        } else {
+                            progressEl.textContent = p && p.total_bytes
+                                ? "Importing... " + Math.floor(100 * p.bytes_read / p.total_bytes) + "% (" + p.processed + " records)"
+                                : "Waiting to start...";
+                            setTimeout(poll, 1000);
+                        }
+                    });
+                poll();
+            });
+        });
+    }
+
     // Toggle dark mode
     const toggleDarkModeBtn = document.getElementById("toggle-dark-mode");
     if(toggleDarkModeBtn) {
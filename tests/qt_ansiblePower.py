@@ -4,6 +4,12 @@ import json
 import sys
 import tempfile
 import shutil
+import time
+import gzip
+import csv
+import io
+import pstats
+from unittest.mock import patch
 
 # Add parent directory to path to import ansiblePower
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -47,6 +53,9 @@ class TestFlaskRoutes(unittest.TestCase):
         ansiblePower.app.config["TESTING"] = True
         ansiblePower.app.config["WTF_CSRF_ENABLED"] = False
         self.client = ansiblePower.app.test_client()
+        patcher_metrics = patch.object(ansiblePower, "metrics", ansiblePower.MetricsRegistry())
+        patcher_metrics.start()
+        self.addCleanup(patcher_metrics.stop)
 
     def tearDown(self):
         ansiblePower.CONFIG_FILE = self.original_config
@@ -61,6 +70,19 @@ class TestFlaskRoutes(unittest.TestCase):
         response = self.client.get("/")
         self.assertIn(b"test.yml", response.data)
 
+    def test_playbooks_endpoint_includes_subfolders(self):
+        os.makedirs(os.path.join(self.playbooks_dir, "web"))
+        with open(os.path.join(self.playbooks_dir, "web", "deploy.yml"), "w") as f:
+            f.write("- name: Deploy web\n  hosts: web\n")
+
+        data = self.client.get("/playbooks").get_json()
+
+        self.assertEqual([p["name"] for p in data["playbooks"]], ["test.yml", "web/deploy.yml"])
+        self.assertEqual(data["playbooks"][1]["hosts"], ["web"])
+        filtered = self.client.get("/playbooks?q=deploy").get_json()
+        self.assertEqual(filtered["count"], 1)
+        self.assertIn(b"web/deploy.yml", self.client.get("/").data)
+
     def test_history_page_returns_200(self):
         response = self.client.get("/history/")
         self.assertEqual(response.status_code, 200)
@@ -76,6 +98,21 @@ class TestFlaskRoutes(unittest.TestCase):
         self.assertIn("content", data)
         self.assertIn("Test", data["content"])
 
+    def test_show_playbook_get_revalidates_with_etag(self):
+        response = self.client.get("/show_playbook?playbook=test.yml")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+
+        cached = self.client.get("/show_playbook?playbook=test.yml", headers={"If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.data, b"")
+
+        with open(os.path.join(self.playbooks_dir, "test.yml"), "a") as f:
+            f.write("# changed\n")
+        changed = self.client.get("/show_playbook?playbook=test.yml", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertIn("# changed", changed.get_json()["content"])
+
     def test_show_playbook_missing_name_returns_400(self):
         response = self.client.post("/show_playbook", data={})
         self.assertEqual(response.status_code, 400)
@@ -98,12 +135,400 @@ class TestFlaskRoutes(unittest.TestCase):
         response = self.client.post("/run_playbook", data={"playbook": "../../../etc/shadow"})
         self.assertEqual(response.status_code, 400)
 
+    def _wait_for_job(self, job_id, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = self.client.get(f"/jobs/{job_id}").get_json()
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(0.05)
+        self.fail(f"Job {job_id} did not finish in time")
+
+    def _use_fake_ansible(self):
+        # Prints one line per host from --limit @file, then a PLAY RECAP, and
+        # writes what the results callback would: "deploy" fails on web3.
+        fake = os.path.join(self.test_dir, "fake-ansible-playbook")
+        with open(fake, "w") as f:
+            f.write("#!%s\n" % sys.executable + (
+                "import json, os, sys\n"
+                "args = sys.argv[1:]\n"
+                "print('forks=%s' % os.environ.get('ANSIBLE_FORKS'))\n"
+                "hosts = ['localhost']\n"
+                "if '--limit' in args:\n"
+                "    hosts = open(args[args.index('--limit') + 1][1:]).read().split()\n"
+                "for h in hosts:\n"
+                "    print('ok: [%s]' % h)\n"
+                "print()\n"
+                "print('PLAY RECAP ***')\n"
+                "for h in hosts:\n"
+                "    print('%s : ok=2 changed=1 unreachable=0 failed=0' % h)\n"
+                "print()\n"
+                "results = os.environ.get('ANSIBLEPOWER_RESULTS_FILE')\n"
+                "if results:\n"
+                "    with open(results, 'a') as f:\n"
+                "        for h in hosts:\n"
+                "            status = 'failed' if h == 'web3' else 'changed'\n"
+                "            f.write(json.dumps({'type': 'task', 'host': h, 'task': 'ping', 'status': 'ok'}) + '\\n')\n"
+                "            f.write(json.dumps({'type': 'task', 'host': h, 'task': 'deploy', 'status': status,\n"
+                "                                'role': 'app', 'duration': 1.5}) + '\\n')\n"
+                "            f.write(json.dumps({'type': 'host', 'host': h, 'ok': 2, 'changed': 1,\n"
+                "                                'failed': int(status == 'failed')}) + '\\n')\n"
+            ))
+        os.chmod(fake, 0o755)
+        original_bin = ansiblePower.ANSIBLE_PLAYBOOK
+        ansiblePower.ANSIBLE_PLAYBOOK = fake
+        self.addCleanup(setattr, ansiblePower, "ANSIBLE_PLAYBOOK", original_bin)
+
+    def test_fanout_run_merges_shards_and_recap(self):
+        self._use_fake_ansible()
+        with open(self.hosts_file, "w") as f:
+            f.write("[web]\nweb[1:5]\n")
+
+        response = self.client.post("/run_playbook", data={"playbook": "test.yml", "fanout": "1", "shards": "2"})
+        job = self._wait_for_job(response.get_json()["job_id"])
+
+        self.assertEqual(job["status"], "succeeded")
+        output = job["output"]
+        self.assertIn("Fan-out: 5 hosts in 2 shards", output)
+        self.assertIn("[shard 1/2] ok: [web1]", output)
+        self.assertIn("[shard 2/2] ok: [web5]", output)
+        recap = output.split("PLAY RECAP (combined, 2 shards)")[1]
+        self.assertEqual([line.split()[0] for line in recap.splitlines()[1:6]],
+                         ["web1", "web2", "web3", "web4", "web5"])
+        self.assertIn("Totals: ok=10  changed=5", recap)
+        self.assertIn("Shard exit codes: 1:0, 2:0", recap)
+
+    def test_run_results_are_stored_per_host_and_task(self):
+        self._use_fake_ansible()
+        with open(self.hosts_file, "w") as f:
+            f.write("[web]\nweb[1:5]\n")
+
+        response = self.client.post("/run_playbook", data={"playbook": "test.yml", "fanout": "1", "shards": "2"})
+        job = self._wait_for_job(response.get_json()["job_id"])
+
+        results = self.client.get(f"/history/api/runs/{job['run_id']}/results").get_json()
+        self.assertEqual([h["host"] for h in results["hosts"]], ["web1", "web2", "web3", "web4", "web5"])
+        self.assertEqual(len(results["tasks"]), 10)
+        failures = self.client.get("/history/api/results?status=failed&task=deploy").get_json()["results"]
+        self.assertEqual([(r["host"], r["run_id"], r["playbook"]) for r in failures],
+                         [("web3", job["run_id"], "test.yml")])
+        changed = self.client.get("/history/api/results?status=changed&playbook=test.yml&limit=2").get_json()
+        self.assertEqual(len(changed["results"]), 2)
+        self.assertIsNotNone(changed["next_before_id"])
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, "results")), [])
+        self.assertEqual(self.client.get("/history/api/results?status=broken").status_code, 400)
+        self.assertEqual(self.client.get("/history/api/runs/999/results").status_code, 404)
+
+    def test_timing_report_page_and_api(self):
+        self._use_fake_ansible()
+        job_id = self.client.post("/run_playbook", data={"playbook": "test.yml"}).get_json()["job_id"]
+        self._wait_for_job(job_id)
+
+        page = self.client.get("/history/timing")
+        self.assertEqual(page.status_code, 200)
+        self.assertIn(b'<option value="test.yml">', page.data)
+        report = self.client.get("/history/api/timing?playbook=test.yml").get_json()
+        self.assertEqual(report["runs"], 1)
+        self.assertEqual([(t["task"], t["p50"]) for t in report["slowest_tasks"]], [("deploy", 1.5)])
+        self.assertEqual(report["slowest_roles"][0]["role"], "app")
+        self.assertEqual(self.client.get("/history/api/timing").status_code, 400)
+        self.assertEqual(self.client.get("/history/api/timing?playbook=test.yml&runs=x").status_code, 400)
+
+    def test_runs_record_exit_code_and_resource_use(self):
+        self._use_fake_ansible()
+        job_id = self.client.post("/run_playbook", data={"playbook": "test.yml"}).get_json()["job_id"]
+        run = self.client.get(f"/history/api/runs/{self._wait_for_job(job_id)['run_id']}").get_json()
+
+        self.assertEqual(run["return_code"], 0)
+        self.assertGreater(run["duration"], 0)
+        self.assertGreater(run["cpu_seconds"], 0)
+        self.assertGreater(run["peak_rss"], 1024 * 1024)
+        self.assertIsNotNone(run["finished_at"])
+        runs = self.client.get("/history/api/runs?sort=peak_rss&min_duration=0&return_code=0").get_json()["runs"]
+        self.assertEqual([r["id"] for r in runs], [run["id"]])
+        self.assertEqual(self.client.get("/history/api/runs?failed=1").get_json()["runs"], [])
+        self.assertEqual(self.client.get("/history/api/runs?sort=output").status_code, 400)
+        self.assertEqual(self.client.get("/history/api/runs?min_duration=slow").status_code, 400)
+
+    def test_metrics_endpoint_reports_requests_runs_and_history(self):
+        self._use_fake_ansible()
+        job_id = self.client.post("/run_playbook", data={"playbook": "test.yml"}).get_json()["job_id"]
+        self._wait_for_job(job_id)
+        self.client.get("/health")
+
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        body = response.get_data(as_text=True)
+        self.assertIn('ansiblepower_http_requests_total{endpoint="main.health",method="GET",status="200"} 1.0', body)
+        self.assertIn('ansiblepower_http_request_duration_seconds_count{endpoint="main.health",method="GET"} 1', body)
+        self.assertIn('ansiblepower_playbook_runs_total{outcome="succeeded"} 1.0', body)
+        self.assertIn('ansiblepower_phase_duration_seconds_bucket{phase="sqlite",le="+Inf"}', body)
+        self.assertIn("ansiblepower_history_runs 1.0", body)
+        self.assertIn("ansiblepower_playbook_runs_in_progress 0.0", body)
+
+    def test_system_status_answers_from_sampler(self):
+        started = time.monotonic()
+        data = self.client.get("/settings/system_status?window=60").get_json()
+
+        self.assertLess(time.monotonic() - started, 0.5)
+        for key in ("cpu", "memory", "load", "disk", "ansible_processes", "series"):
+            self.assertIn(key, data)
+        self.assertEqual(data["window"], 60)
+        self.assertEqual(self.client.get("/settings/system_status?window=soon").status_code, 400)
+
+    def test_profile_header_needs_token_and_returns_server_timing(self):
+        self.assertNotIn("Server-Timing", self.client.get("/").headers)
+        with patch.dict(os.environ, {"ANSIBLEPOWER_PROFILE_TOKEN": "s3cret"}):
+            wrong = self.client.get("/", headers={"X-AnsiblePower-Profile": "timing",
+                                                  "X-AnsiblePower-Profile-Token": "guess"})
+            self.assertNotIn("Server-Timing", wrong.headers)
+            headers = {"X-AnsiblePower-Profile": "timing", "X-AnsiblePower-Profile-Token": "s3cret"}
+            page = self.client.get("/settings/", headers=headers)
+            api = self.client.get("/history/api/runs", headers=headers)
+
+        for phase in ("config;dur=", "render;dur=", "total;dur="):
+            self.assertIn(phase, page.headers["Server-Timing"])
+        self.assertIn("sqlite;dur=", api.headers["Server-Timing"])
+        self.assertNotIn("X-AnsiblePower-Profile-Id", page.headers)
+
+    def test_cprofile_mode_stores_downloadable_profiles(self):
+        self.assertEqual(self.client.post("/settings/profiling", json={"mode": "loud"}).status_code, 400)
+        self.client.post("/settings/profiling", json={"mode": "cprofile"})
+
+        profile_id = self.client.get("/").headers["X-AnsiblePower-Profile-Id"]
+        listed = self.client.get("/settings/profiling").get_json()
+        self.client.post("/settings/profiling", json={"mode": "off"})
+
+        self.assertIn(profile_id, [p["id"] for p in listed["profiles"]])
+        path = os.path.join(self.test_dir, "downloaded.pstats")
+        with self.client.get(f"/settings/profiling/profiles/{profile_id}.pstats") as download:
+            self.assertEqual(download.status_code, 200)
+            with open(path, "wb") as f:
+                f.write(download.data)
+        self.assertGreater(pstats.Stats(path).total_calls, 0)
+        self.assertEqual(self.client.get("/settings/profiling/profiles/nope.pstats").status_code, 404)
+        self.assertGreaterEqual(self.client.post("/settings/profiling/profiles/clear").get_json()["removed"], 1)
+
+    def test_fanout_falls_back_to_single_run_for_one_host(self):
+        self._use_fake_ansible()
+
+        response = self.client.post("/run_playbook", data={"playbook": "test.yml", "fanout": "1"})
+        job = self._wait_for_job(response.get_json()["job_id"])
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertIn("running as a single process", job["output"])
+        self.assertIn("ok: [localhost]", job["output"])
+        self.assertEqual(self.client.post("/run_playbook", data={"playbook": "test.yml", "shards": "x"}).status_code, 400)
+
+    def test_run_playbook_returns_job_id_and_records_output(self):
+        original_bin = ansiblePower.ANSIBLE_PLAYBOOK
+        ansiblePower.ANSIBLE_PLAYBOOK = shutil.which("echo")
+        self.addCleanup(setattr, ansiblePower, "ANSIBLE_PLAYBOOK", original_bin)
+
+        response = self.client.post("/run_playbook", data={"playbook": "test.yml"})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()["job_id"]
+
+        job = self._wait_for_job(job_id)
+        self.assertEqual(job["status"], "succeeded")
+        self.assertIn("test.yml", job["output"])
+        self.assertEqual(ansiblePower.load_history()[-1]["playbook"], "test.yml")
+
+    def test_job_stream_sends_output_and_done_events(self):
+        original_bin = ansiblePower.ANSIBLE_PLAYBOOK
+        ansiblePower.ANSIBLE_PLAYBOOK = shutil.which("echo")
+        self.addCleanup(setattr, ansiblePower, "ANSIBLE_PLAYBOOK", original_bin)
+
+        job_id = self.client.post("/run_playbook", data={"playbook": "test.yml"}).get_json()["job_id"]
+        response = self.client.get(f"/jobs/{job_id}/stream")
+
+        self.assertEqual(response.mimetype, "text/event-stream")
+        body = response.get_data(as_text=True)
+        self.assertIn("test.yml", body)
+        self.assertIn('event: done\ndata: {"status": "succeeded"}', body)
+
+    def test_job_stream_resumes_from_last_event_id(self):
+        original_bin = ansiblePower.ANSIBLE_PLAYBOOK
+        ansiblePower.ANSIBLE_PLAYBOOK = shutil.which("echo")
+        self.addCleanup(setattr, ansiblePower, "ANSIBLE_PLAYBOOK", original_bin)
+
+        job_id = self.client.post("/run_playbook", data={"playbook": "test.yml"}).get_json()["job_id"]
+        output = self._wait_for_job(job_id)["output"]
+        response = self.client.get(f"/jobs/{job_id}/stream",
+                                   headers={"Last-Event-ID": str(len(output))})
+
+        self.assertNotIn("test.yml", response.get_data(as_text=True))
+
+    def test_job_stream_reads_new_chunks_while_running(self):
+        run_id = ansiblePower.start_history_run("run", "live.yml")
+        writer = ansiblePower.RunOutputWriter(run_id)
+        writer.write("one\ntw")
+        writer.flush()
+
+        def poll(status, write=None, finish=False):
+            if write:
+                writer.write(write)
+                writer.flush()
+            if finish:
+                ansiblePower.finish_history_run(run_id)
+            return {"status": status, "run_id": run_id}
+        polls = iter([lambda: poll("running"), lambda: poll("running", write="o\nthree\n"),
+                      lambda: poll("succeeded", write="four", finish=True)])
+
+        with patch("ansiblePower.get_job_summary", side_effect=lambda job_id: next(polls)()), \
+                patch("ansiblePower.STREAM_POLL_INTERVAL", 0):
+            events = list(ansiblePower.stream_job_output("job", offset=2))
+
+        output = [e for e in events if e.startswith("id:")]
+        self.assertEqual(output, ["id: 4\ndata: e\n\n", "id: 14\ndata: two\ndata: three\n\n",
+                                  "id: 18\ndata: four\n\n"])
+
+    def test_run_playbook_invalid_priority_returns_400(self):
+        response = self.client.post("/run_playbook", data={"playbook": "test.yml", "priority": "urgent"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_job_status_unknown_returns_404(self):
+        response = self.client.get("/jobs/does-not-exist")
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_hosts_etag_changes_after_save(self):
+        etag = self.client.get("/settings/get_hosts").headers["ETag"]
+        self.assertEqual(self.client.get("/settings/get_hosts", headers={"If-None-Match": etag}).status_code, 304)
+
+        self.client.post("/settings/save_hosts", data={"content": "[web]\nweb1\n"})
+
+        response = self.client.get("/settings/get_hosts", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["content"], "[web]\nweb1\n")
+
+    def test_save_hosts_rejects_invalid_inventory(self):
+        response = self.client.post("/settings/save_hosts", data={"content": "[web\nweb1\n"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid inventory", response.get_json()["error"])
+        with open(self.hosts_file) as f:
+            self.assertEqual(f.read(), "[test]\nlocalhost ansible_connection=local\n")
+
+    def test_inventory_endpoints(self):
+        self.client.post("/settings/save_hosts", data={"content": "[web]\nweb[1:3]\n[db]\ndb1\n"})
+
+        groups = self.client.get("/settings/inventory").get_json()
+        self.assertEqual(groups["host_count"], 4)
+        self.assertIn({"name": "web", "hosts": 3, "direct_hosts": ["web1", "web2", "web3"],
+                       "children": [], "vars": {}}, groups["groups"])
+
+        resolved = self.client.get("/settings/inventory/resolve?pattern=all:!web[0]").get_json()
+        self.assertEqual(resolved["hosts"], ["web2", "web3", "db1"])
+        count = self.client.get("/settings/inventory/resolve?pattern=web&count_only=1").get_json()
+        self.assertEqual(count, {"pattern": "web", "count": 3})
+        self.assertEqual(self.client.get("/settings/inventory/resolve?pattern=~(").status_code, 400)
+
     def test_get_hosts_returns_content(self):
         response = self.client.get("/settings/get_hosts")
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertIn("content", data)
 
+    def test_recent_logs_returns_list(self):
+        response = self.client.get("/settings/logs?limit=5")
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.get_json()["logs"]), 5)
+
+    def _add_runs(self, count):
+        for i in range(count):
+            ansiblePower.add_history_record({
+                "action": "run", "playbook": f"p{i}.yml", "output": f"out {i}", "time": f"2024-01-{i + 1:02d} 00:00:00"
+            })
+
+    def test_history_api_paginates_newest_first(self):
+        self._add_runs(5)
+
+        first = self.client.get("/history/api/runs?limit=2").get_json()
+        self.assertEqual([r["playbook"] for r in first["runs"]], ["p4.yml", "p3.yml"])
+        self.assertNotIn("output", first["runs"][0])
+
+        second = self.client.get(f"/history/api/runs?limit=2&before_id={first['next_before_id']}").get_json()
+        self.assertEqual([r["playbook"] for r in second["runs"]], ["p2.yml", "p1.yml"])
+
+        last = self.client.get(f"/history/api/runs?limit=2&before_id={second['next_before_id']}").get_json()
+        self.assertEqual([r["playbook"] for r in last["runs"]], ["p0.yml"])
+        self.assertIsNone(last["next_before_id"])
+
+    def test_history_api_invalid_cursor_returns_400(self):
+        response = self.client.get("/history/api/runs?before_id=abc")
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_api_run_returns_output(self):
+        self._add_runs(1)
+        run_id = self.client.get("/history/api/runs").get_json()["runs"][0]["id"]
+
+        response = self.client.get(f"/history/api/runs/{run_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["output"], "out 0")
+
+    def test_history_search_returns_highlighted_snippets(self):
+        ansiblePower.add_history_record({
+            "action": "run", "playbook": "site.yml", "time": "t1",
+            "output": "fatal: [db3]: UNREACHABLE! <ssh> timed out"
+        })
+        ansiblePower.add_history_record({
+            "action": "run", "playbook": "site.yml", "time": "t2", "output": "ok: [db3]"
+        })
+
+        data = self.client.get("/history/api/search?q=unreachable db3").get_json()
+
+        self.assertEqual(len(data["results"]), 1)
+        self.assertIn("<mark>UNREACHABLE</mark>", data["results"][0]["snippet_html"])
+        self.assertIn("&lt;ssh&gt;", data["results"][0]["snippet_html"])
+        self.assertIsNone(data["next_offset"])
+
+    def test_history_search_paginates(self):
+        self._add_runs(3)
+
+        first = self.client.get("/history/api/search?q=out&limit=2").get_json()
+        self.assertEqual(len(first["results"]), 2)
+        second = self.client.get(f"/history/api/search?q=out&limit=2&offset={first['next_offset']}").get_json()
+        self.assertEqual(len(second["results"]), 1)
+
+    def test_history_search_sort_recent_returns_newest_first(self):
+        self._add_runs(3)
+
+        data = self.client.get("/history/api/search?q=out&sort=recent").get_json()
+        self.assertEqual([r["playbook"] for r in data["results"]], ["p2.yml", "p1.yml", "p0.yml"])
+
+    def test_history_search_invalid_raw_query_returns_400(self):
+        response = self.client.get("/history/api/search?q=%22unbalanced&syntax=fts")
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_search_index_cleared_with_history(self):
+        self._add_runs(1)
+        self.client.post("/settings/clear_history")
+
+        data = self.client.get("/history/api/search?q=out").get_json()
+        self.assertEqual(data["results"], [])
+
+    def test_clear_history_keeps_running_run(self):
+        self._add_runs(1)
+        run_id = ansiblePower.start_history_run("run", "live.yml")
+        writer = ansiblePower.RunOutputWriter(run_id)
+        writer.write("before clear\n")
+        writer.flush()
+
+        self.client.post("/settings/clear_history")
+        writer.write("after clear\n")
+        writer.flush()
+        ansiblePower.finish_history_run(run_id)
+
+        runs = self.client.get("/history/api/runs").get_json()["runs"]
+        self.assertEqual([run["id"] for run in runs], [run_id])
+        response = self.client.get(f"/history/api/runs/{run_id}")
+        self.assertEqual(response.get_json()["output"], "before clear\nafter clear\n")
+
+    def test_history_api_unknown_run_returns_404(self):
+        response = self.client.get("/history/api/runs/999999")
+        self.assertEqual(response.status_code, 404)
+
     def test_clear_history(self):
         # Add a dummy history entry first
         with open(self.history_file, "w") as f:
@@ -121,6 +546,191 @@ class TestFlaskRoutes(unittest.TestCase):
         response = self.client.get("/history/export_history?format=csv")
         self.assertEqual(response.status_code, 200)
 
+    def test_export_history_json_matches_records(self):
+        self._add_runs(3)
+
+        response = self.client.get("/history/export_history?format=json")
+
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(json.loads(response.data), ansiblePower.load_history())
+        self.assertEqual(response.get_data(as_text=True),
+                         json.dumps(ansiblePower.load_history(), indent=2))
+
+    def test_export_history_empty_json_is_empty_list(self):
+        response = self.client.get("/history/export_history?format=json")
+        self.assertEqual(json.loads(response.data), [])
+
+    def test_export_history_ndjson_gzip_with_filters(self):
+        self._add_runs(3)
+        ansiblePower.add_history_record({
+            "action": "run", "playbook": "p1.yml", "output": "second", "time": "2024-05-02 10:00:00"
+        })
+
+        response = self.client.get(
+            "/history/export_history?format=ndjson&compress=gzip&playbook=p1.yml&since=2024-05-01"
+        )
+
+        self.assertEqual(response.mimetype, "application/gzip")
+        self.assertIn("history.ndjson.gz", response.headers["Content-Disposition"])
+        lines = gzip.decompress(response.data).decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line)["output"] for line in lines], ["second"])
+
+    def test_export_history_csv_rows(self):
+        self._add_runs(2)
+
+        response = self.client.get("/history/export_history?format=csv&action=run")
+
+        rows = list(csv.reader(response.get_data(as_text=True).splitlines()))
+        self.assertEqual(rows[0], ["time", "playbook", "action", "output"])
+        self.assertEqual(len(rows), 3)
+
+    def test_export_history_rejects_bad_filters(self):
+        self.assertEqual(self.client.get("/history/export_history?format=xml").status_code, 400)
+        self.assertEqual(self.client.get("/history/export_history?since=yesterday").status_code, 400)
+
+
+    def _import(self, name, payload, mode=None):
+        data = {"file": (io.BytesIO(payload), name)}
+        if mode:
+            data["mode"] = mode
+        response = self.client.post("/history/import_history", data=data, content_type="multipart/form-data")
+        self.assertEqual(response.status_code, 202)
+        return self._wait_for_job(response.get_json()["job_id"])
+
+    def test_import_history_json_replaces_by_default(self):
+        self._add_runs(2)
+        records = [{"action": "run", "playbook": "a.yml", "output": "x", "time": "2024-02-01 00:00:00", "extra": 1}]
+
+        job = self._import("history.json", json.dumps(records).encode("utf-8"))
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["progress"]["inserted"], 1)
+        self.assertEqual(job["progress"]["removed"], 2)
+        self.assertEqual(ansiblePower.load_history(), [
+            {"action": "run", "playbook": "a.yml", "output": "x", "time": "2024-02-01 00:00:00"}
+        ])
+
+    def test_import_history_replace_keeps_running_runs(self):
+        self._add_runs(2)
+        run_id = ansiblePower.start_history_run("run", "live.yml")
+        records = [{"action": "run", "playbook": "a.yml", "output": "x", "time": "2024-02-01 00:00:00"}]
+
+        job = self._import("history.json", json.dumps(records).encode("utf-8"))
+        ansiblePower.finish_history_run(run_id, duration=1.0, return_code=0)
+
+        self.assertEqual(job["progress"]["removed"], 2)
+        self.assertEqual([r["playbook"] for r in ansiblePower.load_history()], ["live.yml", "a.yml"])
+
+    def test_import_history_merge_skips_existing_runs(self):
+        self._add_runs(2)
+        lines = [json.dumps(r) for r in ansiblePower.load_history()]
+        lines.append(json.dumps({"action": "run", "playbook": "new.yml", "output": "n", "time": "2024-03-01 00:00:00"}))
+
+        job = self._import("history.ndjson.gz", gzip.compress("\n".join(lines).encode("utf-8")), mode="merge")
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual((job["progress"]["inserted"], job["progress"]["skipped"]), (1, 2))
+        self.assertEqual(len(ansiblePower.load_history()), 3)
+
+    def test_import_history_csv_append(self):
+        self._add_runs(1)
+        payload = "time,playbook,action,output\n2024-04-01 00:00:00,c.yml,run,\"a,b\"\n"
+
+        job = self._import("history.csv", payload.encode("utf-8"), mode="append")
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(ansiblePower.load_history()[-1]["output"], "a,b")
+        self.assertEqual(len(ansiblePower.load_history()), 2)
+
+    def test_import_history_invalid_file_leaves_history_untouched(self):
+        self._add_runs(2)
+        before = ansiblePower.load_history()
+
+        job = self._import("history.json", b'[{"action": "run", "playbook": "a.yml"}, "oops"]')
+
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(ansiblePower.load_history(), before)
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, "imports")), [])
+
+    def test_import_history_rejects_bad_requests(self):
+        response = self.client.post("/history/import_history", data={"file": (io.BytesIO(b"x"), "h.xml")},
+                                    content_type="multipart/form-data")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/history/import_history", data={"file": (io.BytesIO(b"[]"), "h.json"), "mode": "x"},
+                                    content_type="multipart/form-data")
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_retention_policy_roundtrip(self):
+        response = self.client.post("/settings/history_retention", json={"max_rows": 100, "max_age_days": 30})
+        self.assertEqual(response.status_code, 200)
+
+        data = self.client.get("/settings/history_retention").get_json()
+        self.assertEqual(data["policy"]["max_rows"], 100)
+        self.assertIn("reclaimed_bytes", data["stats"]["totals"])
+        self.assertEqual(self.client.post("/settings/history_retention", json={"max_rows": -1}).status_code, 400)
+
+    def test_compact_history_job_applies_policy(self):
+        self._add_runs(4)
+        self.client.post("/settings/history_retention", json={"max_rows": 1})
+
+        response = self.client.post("/settings/compact_history")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self._wait_for_job(response.get_json()["job_id"])["status"], "succeeded")
+        self.assertEqual([r["playbook"] for r in ansiblePower.load_history()], ["p3.yml"])
+
+    def test_runs_use_managed_fact_cache(self):
+        env = ansiblePower._playbook_env()
+        self.assertEqual(env["ANSIBLE_CACHE_PLUGIN"], "jsonfile")
+        self.assertEqual(env["ANSIBLE_CACHE_PLUGIN_CONNECTION"], os.path.join(self.test_dir, "fact_cache"))
+        self.assertEqual(env["ANSIBLE_GATHERING"], "smart")
+
+        self.client.post("/settings/fact_cache", json={"enabled": False})
+        self.assertNotIn("ANSIBLE_CACHE_PLUGIN", ansiblePower._playbook_env())
+        self.assertEqual(self.client.post("/settings/fact_cache", json={"timeout": 0}).status_code, 400)
+
+    def test_fact_cache_inspect_invalidate_and_purge(self):
+        cache_dir = os.path.join(self.test_dir, "fact_cache")
+        os.makedirs(cache_dir)
+        for host in ("web1", "web2"):
+            with open(os.path.join(cache_dir, host), "w") as f:
+                json.dump({"ansible_hostname": host}, f)
+
+        listing = self.client.get("/settings/fact_cache").get_json()
+        self.assertEqual([h["host"] for h in listing["hosts"]], ["web1", "web2"])
+        self.assertFalse(listing["hosts"][0]["expired"])
+        facts = self.client.get("/settings/fact_cache/web1").get_json()
+        self.assertEqual(facts["facts"]["ansible_hostname"], "web1")
+
+        self.assertEqual(self.client.post("/settings/fact_cache/web1/invalidate").status_code, 200)
+        self.assertEqual(self.client.get("/settings/fact_cache/web1").status_code, 404)
+        self.assertEqual(self.client.post("/settings/fact_cache/..%2Fconfig.json/invalidate").status_code, 404)
+        self.assertEqual(self.client.post("/settings/fact_cache/purge").get_json()["removed"], 1)
+        self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_performance_profile_applies_to_run_and_is_recorded(self):
+        self._use_fake_ansible()
+        response = self.client.post("/settings/performance_profiles", json={
+            "profiles": {"wide": {"forks": 80, "pipelining": True}}, "active": "wide"})
+        self.assertEqual(response.status_code, 200)
+
+        job_id = self.client.post("/run_playbook", data={"playbook": "test.yml"}).get_json()["job_id"]
+        job = self._wait_for_job(job_id)
+
+        self.assertIn("Performance profile: wide (forks=80, pipelining=True)", job["output"])
+        self.assertIn("forks=80", job["output"])
+        run = self.client.get(f"/history/api/runs/{job['run_id']}").get_json()
+        self.assertEqual(run["profile"], "wide")
+
+    def test_performance_profiles_reject_bad_settings(self):
+        for body in ({"profiles": {"x": {"forks": 0}}}, {"profiles": {"x": {"bogus": 1}}},
+                     {"profiles": {"x": {"local_tmp": "relative"}}}, {"active": "missing"}):
+            self.assertEqual(self.client.post("/settings/performance_profiles", json=body).status_code, 400)
+        data = self.client.get("/settings/performance_profiles").get_json()
+        self.assertEqual(data["active"], "default")
+        self.assertIn("fast", data["profiles"])
+        response = self.client.post("/run_playbook", data={"playbook": "test.yml", "profile": "missing"})
+        self.assertEqual(response.status_code, 400)
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -47,11 +47,18 @@ def test_endpoints():
 
     # 2. Run Playbook
     res = session.post(f"{BASE_URL}/run_playbook", data={"playbook": "sample.yml"}, headers=headers)
-    assert res.status_code == 200, f"run_playbook returned {res.status_code}"
-    assert "output" in res.json(), "No output in run_playbook response"
-    
-    # Wait for history to be written
-    time.sleep(1)
+    assert res.status_code == 202, f"run_playbook returned {res.status_code}"
+    job_id = res.json().get("job_id")
+    assert job_id, "No job_id in run_playbook response"
+
+    # Wait for the background job to finish and write history
+    for _ in range(60):
+        job = session.get(f"{BASE_URL}/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(1)
+    assert job["status"] in ("succeeded", "failed"), f"Job ended as {job['status']}"
+    assert "output" in job, "No output in finished job"
     
     # 3. History Page
     res = session.get(f"{BASE_URL}/history/")
@@ -1,18 +1,69 @@
 import unittest
+import cProfile
 import os
 import json
+import logging
 import sys
+import tempfile
+import threading
+import time
+import shutil
+import sqlite3
+import subprocess
+from datetime import datetime, timedelta
+from io import StringIO
 from unittest.mock import patch, mock_open
 
+import psutil
+
 # Add parent directory to path to import ansiblePower
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from ansiblePower import (
+    HISTORY_MIGRATIONS,
+    CustomRotatingLogHandler,
+    FileContentCache,
+    InventoryError,
+    JobManager,
+    JobQueueFull,
+    MetricsRegistry,
+    PlaybookIndex,
+    ProcessTreeUsage,
+    ProfileStore,
+    RunOutputWriter,
+    SystemSampler,
+    TimedConnection,
+    _count_ansible_processes,
+    _iter_json_array,
+    _profile_env,
+    _sse_event,
+    _stream_processes,
+    _worker_token,
+    add_history_record,
+    compact_history,
+    config_cache,
+    expand_host_range,
+    finish_history_run,
+    format_metrics,
+    get_history_db_connection,
+    get_compaction_stats,
     get_history_db_file,
+    get_history_run,
+    get_timing_report,
+    list_history_runs,
+    get_playbooks_dir,
     load_config,
     load_history,
+    parse_ini_inventory,
+    parse_inventory,
+    parse_playbook_summary,
+    query_task_results,
+    record_run_results,
     save_config,
     save_history,
+    start_history_run,
+    validate_performance_profile,
+    validate_retention_policy,
 )
 
 
@@ -46,8 +97,7 @@ class TestConfigAndHistory(unittest.TestCase):
             os.remove(self.test_config_file)
         if os.path.exists(self.test_history_file):
             os.remove(self.test_history_file)
-        if os.path.exists(self.test_history_db_file):
-            os.remove(self.test_history_db_file)
+        self._remove_history_db()
 
     def tearDown(self):
         # Clean up test files after each test
@@ -55,8 +105,13 @@ class TestConfigAndHistory(unittest.TestCase):
             os.remove(self.test_config_file)
         if os.path.exists(self.test_history_file):
             os.remove(self.test_history_file)
-        if os.path.exists(self.test_history_db_file):
-            os.remove(self.test_history_db_file)
+        self._remove_history_db()
+
+    def _remove_history_db(self):
+        # WAL mode keeps -wal/-shm side files next to the database.
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.test_history_db_file + suffix):
+                os.remove(self.test_history_db_file + suffix)
 
     # Test load_config
     def test_load_config_existing_valid(self):
@@ -75,7 +130,42 @@ class TestConfigAndHistory(unittest.TestCase):
 
         self.assertEqual(load_config(), {"playbooks_dir": self.default_playbooks_dir})
 
+    def test_load_config_parses_once_while_file_unchanged(self):
+        save_config({"playbooks_dir": "/cached"})
+
+        with patch("ansiblePower.json.load", wraps=json.load) as mock_load:
+            for _ in range(5):
+                self.assertEqual(get_playbooks_dir(), "/cached")
+
+        self.assertEqual(mock_load.call_count, 1)
+
+    def test_load_config_reloads_when_file_changes(self):
+        save_config({"playbooks_dir": "/before"})
+        self.assertEqual(get_playbooks_dir(), "/before")
+
+        with open(self.test_config_file, "w") as f:
+            json.dump({"playbooks_dir": "/after/changed"}, f)
+
+        self.assertEqual(get_playbooks_dir(), "/after/changed")
+
+    def test_load_config_returns_private_copy(self):
+        save_config({"playbooks_dir": "/original"})
+
+        load_config()["playbooks_dir"] = "/mutated"
+
+        self.assertEqual(config_cache.get()["playbooks_dir"], "/original")
+
     # Test save_config
+    def test_save_config_is_atomic(self):
+        save_config({"playbooks_dir": "/first"})
+        inode = os.stat(self.test_config_file).st_ino
+
+        save_config({"playbooks_dir": "/second"})
+
+        # Replaced by rename, not rewritten in place, and no temp file left.
+        self.assertNotEqual(os.stat(self.test_config_file).st_ino, inode)
+        self.assertEqual([f for f in os.listdir(".") if f.startswith(self.test_config_file + ".")], [])
+
     def test_save_config_success(self):
         config_data = {"playbooks_dir": "/new/path"}
         save_config(config_data)
@@ -139,6 +229,217 @@ class TestConfigAndHistory(unittest.TestCase):
         self.assertTrue(os.path.exists(self.test_history_db_file))
         self.assertEqual(load_history(), history_data)
 
+    def test_history_connection_is_reused(self):
+        save_history([])
+
+        with patch("ansiblePower.sqlite3.connect") as mock_connect:
+            load_history()
+            add_history_record({"action": "run", "playbook": "a.yml", "output": "", "time": "t"})
+
+        mock_connect.assert_not_called()
+
+    def test_history_db_uses_wal_and_current_schema(self):
+        conn = get_history_db_connection()
+
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], len(HISTORY_MIGRATIONS))
+
+    def test_history_json_is_migrated_only_once(self):
+        with open(self.test_history_file, "w") as f:
+            json.dump([{"action": "run", "playbook": "old.yml", "time": "t", "output": "o"}], f)
+
+        self.assertEqual(len(load_history()), 1)
+        save_history([])
+
+        self.assertEqual(load_history(), [])
+
+    def test_streamed_output_is_appended_in_chunks_then_stored(self):
+        run_id = start_history_run("run", "a.yml")
+        writer = RunOutputWriter(run_id)
+        for line in ("one\n", "two\n", "three\n"):
+            writer.write(line)
+            writer.flush()
+
+        conn = get_history_db_connection()
+        self.assertEqual(get_history_run(run_id)["output"], "one\ntwo\nthree\n")
+        self.assertEqual(conn.execute("SELECT output FROM playbook_runs").fetchone()[0], "")
+
+        finish_history_run(run_id)
+
+        self.assertEqual(get_history_run(run_id)["output"], "one\ntwo\nthree\n")
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM run_output_chunks").fetchone()[0], 0)
+
+    def test_identical_outputs_are_stored_once_compressed(self):
+        output = "TASK [ping] ok: [web1]\n" * 200
+        save_history([
+            {"action": "run", "playbook": "a.yml", "time": "1", "output": output},
+            {"action": "run", "playbook": "a.yml", "time": "2", "output": output},
+        ])
+
+        conn = get_history_db_connection()
+        blobs = conn.execute("SELECT codec, size, length(data) FROM run_outputs").fetchall()
+        self.assertEqual(len(blobs), 1)
+        self.assertEqual(blobs[0][0], "zlib")
+        self.assertEqual(blobs[0][1], len(output))
+        self.assertLess(blobs[0][2], len(output) // 10)
+        self.assertEqual([r["output"] for r in load_history()], [output, output])
+
+    def test_incompressible_output_is_stored_raw(self):
+        add_history_record({"action": "run", "playbook": "a.yml", "time": "1", "output": "ok"})
+
+        conn = get_history_db_connection()
+        self.assertEqual(conn.execute("SELECT codec FROM run_outputs").fetchone()[0], "raw")
+
+    def test_replacing_history_drops_orphaned_outputs(self):
+        add_history_record({"action": "run", "playbook": "a.yml", "time": "1", "output": "old"})
+        save_history([{"action": "run", "playbook": "b.yml", "time": "2", "output": "new"}])
+
+        conn = get_history_db_connection()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM run_outputs").fetchone()[0], 1)
+
+    def _add_runs(self, playbooks, output=lambda i: "out %d" % i):
+        for i, playbook in enumerate(playbooks):
+            add_history_record({"action": "run", "playbook": playbook,
+                                "time": "2024-01-%02d 00:00:00" % (i + 1), "output": output(i)})
+
+    def test_compact_history_keeps_newest_rows(self):
+        self._add_runs(["a.yml"] * 5)
+
+        stats = compact_history({"max_rows": 2})
+
+        self.assertEqual(stats["runs_deleted"], 3)
+        self.assertEqual([r["output"] for r in load_history()], ["out 3", "out 4"])
+        self.assertEqual(get_compaction_stats()["totals"]["runs_deleted"], 3)
+
+    def test_compact_history_max_age_skips_running_runs(self):
+        self._add_runs(["a.yml", "b.yml"])
+        get_history_db_connection().execute(
+            "INSERT INTO playbook_runs (action, playbook, output, time) VALUES ('run', 'c.yml', 'live', '2000-01-01 00:00:00')"
+        )
+
+        compact_history({"max_age_days": 1})
+
+        self.assertEqual([r["playbook"] for r in load_history()], ["c.yml"])
+
+    def test_compact_history_keep_last_per_playbook(self):
+        self._add_runs(["a.yml", "a.yml", "a.yml", "b.yml", "b.yml", "b.yml"])
+
+        compact_history({"keep_last_per_playbook": {"*": 1, "b.yml": 2}})
+
+        self.assertEqual([r["output"] for r in load_history()], ["out 2", "out 4", "out 5"])
+
+    def test_compact_history_max_output_bytes_drops_oldest_and_blobs(self):
+        self._add_runs(["a.yml"] * 4, output=lambda i: os.urandom(1000).hex())
+
+        compact_history({"max_output_bytes": 2500})
+
+        conn = get_history_db_connection()
+        self.assertEqual(len(load_history()), 2)
+        self.assertLessEqual(conn.execute("SELECT SUM(length(data)) FROM run_outputs").fetchone()[0], 2500)
+
+    def test_compact_history_max_output_bytes_counts_shared_blobs_once(self):
+        shared = os.urandom(1000).hex()
+        self._add_runs(["a.yml"] * 4, output=lambda i: shared if i < 2 else os.urandom(1000).hex())
+
+        compact_history({"max_output_bytes": 2500})
+
+        conn = get_history_db_connection()
+        self.assertEqual(len(load_history()), 2)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM run_outputs").fetchone()[0], 2)
+
+    def test_compaction_enables_incremental_vacuum(self):
+        self._add_runs(["a.yml"] * 3)
+        compact_history({"max_rows": 1})
+        conn = get_history_db_connection()
+        self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+        self.assertEqual(conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+
+    def test_run_results_are_loaded_and_removed_with_their_run(self):
+        self._add_runs(["a.yml", "a.yml"])
+        results_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, results_dir, True)
+        path = os.path.join(results_dir, "results.ndjson")
+        with open(path, "w") as f:
+            f.write(json.dumps({"type": "task", "host": "web1", "task": "deploy", "status": "failed"}) + "\n")
+            f.write(json.dumps({"type": "task", "host": "web1", "task": "deploy", "status": "bogus"}) + "\n")
+            f.write(json.dumps({"type": "host", "host": "web1", "ok": 1, "failed": 1}) + "\n")
+            f.write('{"type": "task", "host"')
+        for run_id in (1, 2):
+            self.assertEqual(record_run_results(run_id, path), (1, 1))
+
+        self.assertEqual([r["run_id"] for r in query_task_results(status="failed", host="web1")], [2, 1])
+        compact_history({"max_rows": 1})
+        conn = get_history_db_connection()
+        self.assertEqual(conn.execute("SELECT DISTINCT run_id FROM run_tasks").fetchall()[0][0], 2)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM run_hosts").fetchone()[0], 1)
+
+    def test_timing_report_percentiles_and_regressions(self):
+        conn = get_history_db_connection()
+        now = datetime.now()
+        # Four runs last week at 2s, then three this week at 5s; "fast" stays at 0.1s.
+        for days_ago, seconds in [(10, 2.0)] * 4 + [(1, 5.0)] * 3:
+            time_text = (now - timedelta(days=days_ago)).strftime("%Y-%m-%d %H:%M:%S")
+            run_id = conn.execute("INSERT INTO playbook_runs (action, playbook, output, time) "
+                                  "VALUES ('run', 'site.yml', '', ?)", (time_text,)).lastrowid
+            for host, factor in (("web1", 1.0), ("web2", 0.5)):
+                conn.execute("INSERT INTO run_tasks (run_id, host, task, role, status, duration) "
+                             "VALUES (?, ?, 'install', 'common', 'ok', ?)", (run_id, host, seconds * factor))
+                conn.execute("INSERT INTO run_tasks (run_id, host, task, role, status, duration) "
+                             "VALUES (?, ?, 'fast', 'common', 'ok', 0.1)", (run_id, host))
+
+        report = get_timing_report("site.yml", runs=5)
+
+        self.assertEqual(report["runs"], 5)
+        slowest = report["slowest_tasks"][0]
+        self.assertEqual((slowest["task"], slowest["p50"], slowest["p95"], slowest["max"]),
+                         ("install", 5.0, 5.0, 5.0))
+        self.assertEqual(slowest["mean"], 3.8)
+        self.assertEqual(report["slowest_roles"][0]["max"], 5.1)
+        self.assertEqual([(r["task"], r["previous_p50"], r["current_p50"], r["change"])
+                          for r in report["regressions"]], [("install", 2.0, 5.0, 2.5)])
+
+    def test_list_history_runs_sorts_and_pages_by_resource_column(self):
+        conn = get_history_db_connection()
+        for playbook, duration, code in [("a.yml", 5.0, 0), ("b.yml", 2.0, 2), ("a.yml", 5.0, 0),
+                                         ("a.yml", None, None), ("b.yml", 9.0, 0)]:
+            conn.execute("INSERT INTO playbook_runs (action, playbook, output, time, duration, return_code) "
+                         "VALUES ('run', ?, '', '', ?, ?)", (playbook, duration, code))
+
+        first = list_history_runs(limit=2, sort="duration")
+        self.assertEqual([(r["id"], r["duration"]) for r in first], [(5, 9.0), (3, 5.0)])
+        rest = list_history_runs(limit=2, sort="duration", before_id=3, before_value=5.0)
+        self.assertEqual([r["id"] for r in rest], [1, 2])
+        ascending = list_history_runs(sort="duration", descending=False, filters={"playbook": "a.yml"})
+        self.assertEqual([r["id"] for r in ascending], [1, 3])
+        self.assertEqual([r["id"] for r in list_history_runs(filters={"failed": True})], [2])
+        self.assertEqual([r["id"] for r in list_history_runs(filters={"min_duration": 6})], [5])
+
+    def test_validate_retention_policy(self):
+        policy = validate_retention_policy({"max_rows": "10", "keep_last_per_playbook": {"*": 3}})
+        self.assertEqual(policy["max_rows"], 10)
+        self.assertIsNone(policy["max_age_days"])
+        for bad in ({"max_rows": 0}, {"max_age_days": "soon"}, {"keep_last_per_playbook": {"a": -1}}, []):
+            with self.assertRaises(ValueError):
+                validate_retention_policy(bad)
+
+    def test_plain_text_outputs_are_migrated_to_output_store(self):
+        conn = sqlite3.connect(self.test_history_db_file)
+        migrate_v1 = HISTORY_MIGRATIONS[0]
+        migrate_v1(conn)
+        conn.execute(
+            "INSERT INTO playbook_runs (action, playbook, output, time) VALUES ('run', 'old.yml', 'legacy', 't')"
+        )
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
+        conn.close()
+
+        self.assertEqual(load_history()[0]["output"], "legacy")
+        row = get_history_db_connection().execute(
+            "SELECT output, output_hash FROM playbook_runs"
+        ).fetchone()
+        self.assertEqual(row[0], "")
+        self.assertIsNotNone(row[1])
+
     @patch("ansiblePower.sqlite3.connect")
     def test_save_history_write_error(self, mock_connect):
         mock_connect.side_effect = OSError("Disk full")
@@ -152,6 +453,471 @@ class TestConfigAndHistory(unittest.TestCase):
         )
 
 
+class TestJobManager(unittest.TestCase):
+
+    def setUp(self):
+        self.test_history_file = "test_jobs_history.json"
+        self.test_history_db_file = "test_jobs_history.db"
+        patcher_history = patch("ansiblePower.HISTORY_FILE", self.test_history_file)
+        patcher_history.start()
+        self.addCleanup(patcher_history.stop)
+        for suffix in ("", "-wal", "-shm"):
+            path = self.test_history_db_file + suffix
+            self.addCleanup(lambda path=path: os.path.exists(path) and os.remove(path))
+
+    def test_priority_lanes_run_high_before_low(self):
+        manager = JobManager()
+        order = []
+        started = threading.Event()
+        gate = threading.Event()
+
+        def handler(job):
+            if job["playbook"] == "first.yml":
+                started.set()
+                gate.wait(5)
+            order.append(job["playbook"])
+            return "succeeded", None
+
+        manager.register("test", handler)
+        with patch("ansiblePower.get_job_worker_count", return_value=1):
+            manager.submit("test", "first.yml")  # occupies the only worker
+            self.assertTrue(started.wait(5))
+            manager.submit("test", "low.yml", priority="low")
+            manager.submit("test", "high.yml", priority="high")
+        gate.set()
+        manager._queue.join()
+
+        self.assertEqual(order, ["first.yml", "high.yml", "low.yml"])
+
+    def test_submit_rejects_when_queue_full(self):
+        manager = JobManager(max_queued=0)
+        manager.register("test", lambda job: ("succeeded", None))
+
+        with self.assertRaises(JobQueueFull):
+            manager.submit("test", "any.yml")
+
+    def test_concurrent_submits_do_not_exceed_queue_size(self):
+        manager = JobManager(max_queued=2)
+        manager.register("test", lambda job: ("succeeded", None))
+        token = _worker_token()
+        rejected = []
+
+        def submit():
+            try:
+                manager.submit("test", "any.yml")
+            except JobQueueFull:
+                rejected.append(True)
+
+        # No workers drain the queue, and a slow insert widens the window between check and enqueue.
+        with patch("ansiblePower.get_job_worker_count", return_value=0), \
+                patch("ansiblePower._worker_token", side_effect=lambda: time.sleep(0.05) or token):
+            threads = [threading.Thread(target=submit) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(manager._queue.qsize(), 2)
+        self.assertEqual(len(rejected), 4)
+
+    def test_submit_rejects_unknown_priority(self):
+        manager = JobManager()
+        manager.register("test", lambda job: ("succeeded", None))
+
+        with self.assertRaises(ValueError):
+            manager.submit("test", "any.yml", priority="urgent")
+
+
+class TestCustomRotatingLogHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir, True)
+        self.log_file = os.path.join(self.test_dir, "logs", "app.log")
+        self.handler = CustomRotatingLogHandler(self.log_file, max_lines=3, max_bytes=200)
+        self.handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s"))
+        self.addCleanup(self.handler.close)
+        self.logger = logging.getLogger("ansiblePower.test_handler")
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_records_are_appended_and_read_newest_first(self):
+        for i in range(3):
+            self.logger.warning("message %d", i)
+
+        with open(self.log_file) as f:
+            self.assertIn("message 0", f.readline())
+        recent = self.handler.read_recent()
+        self.assertEqual([r.rsplit(" ", 1)[-1] for r in recent], ["2", "1", "0"])
+
+    def test_rotation_keeps_newest_records_across_segments(self):
+        for i in range(10):
+            self.logger.warning("message %d", i)
+
+        self.assertTrue(os.path.exists(self.log_file + ".1"))
+        self.assertLess(os.path.getsize(self.log_file), 200)
+        recent = self.handler.read_recent()
+        self.assertEqual([r.rsplit(" ", 1)[-1] for r in recent], ["9", "8", "7"])
+
+    def test_multiline_records_stay_together(self):
+        self.logger.warning("first")
+        self.logger.warning("line one\nline two")
+
+        self.assertTrue(self.handler.read_recent(1)[0].endswith("line one\nline two"))
+
+    def test_reopens_after_another_process_rotates(self):
+        self.logger.warning("before")
+        os.replace(self.log_file, self.log_file + ".1")
+        self.logger.warning("after")
+
+        with open(self.log_file) as f:
+            self.assertIn("after", f.read())
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir, True)
+        patcher = patch("ansiblePower.get_metrics_dir", return_value=self.test_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_collect_adds_up_processes_and_archives_exited_ones(self):
+        registry = MetricsRegistry()
+        registry.inc("ansiblepower_playbook_runs_total", (("outcome", "failed"),))
+        registry.observe("ansiblepower_phase_duration_seconds", 0.003, (("phase", "sqlite"),))
+        # A worker that has exited.
+        with open(os.path.join(self.test_dir, "999999999-dead.json"), "w") as f:
+            json.dump([["ansiblepower_playbook_runs_total", [["outcome", "failed"]], 2]], f)
+
+        for _ in range(2):
+            totals = registry.collect()
+            self.assertEqual(totals[("ansiblepower_playbook_runs_total", (("outcome", "failed"),))], 3)
+        self.assertNotIn("999999999-dead.json", os.listdir(self.test_dir))
+        self.assertIn("archive.json", os.listdir(self.test_dir))
+
+        text = format_metrics(totals, [("ansiblepower_history_runs", "Runs.", [((), 7)])])
+        self.assertIn('ansiblepower_phase_duration_seconds_bucket{phase="sqlite",le="0.0025"} 0', text)
+        self.assertIn('ansiblepower_phase_duration_seconds_bucket{phase="sqlite",le="0.005"} 1', text)
+        self.assertIn('ansiblepower_phase_duration_seconds_count{phase="sqlite"} 1', text)
+        self.assertIn("# TYPE ansiblepower_history_runs gauge\nansiblepower_history_runs 7.0", text)
+
+    def test_concurrent_writes_do_not_collide(self):
+        registry = MetricsRegistry()
+        registry.inc("ansiblepower_playbook_runs_total", (("outcome", "succeeded"),))
+        errors = []
+
+        def write():
+            try:
+                for _ in range(50):
+                    registry.write(force=True)
+            except OSError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+    def test_iterating_a_cursor_is_timed_once_rows_are_exhausted(self):
+        conn = sqlite3.connect(":memory:", factory=TimedConnection)
+        conn.execute("CREATE TABLE t (x)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(5)])
+        cursor = conn.execute("SELECT x FROM t")
+
+        with patch("ansiblePower._record_phase") as record:
+            self.assertEqual(len(list(cursor)), 5)
+
+        record.assert_called_once()
+        self.assertEqual(record.call_args[0][0], "sqlite")
+
+
+class TestProfileStore(unittest.TestCase):
+
+    def test_keeps_only_the_slowest_profiles(self):
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir, True)
+        store = ProfileStore(size=2)
+        profiler = cProfile.Profile()
+        with patch.object(ProfileStore, "directory", return_value=test_dir):
+            ids = [store.add(profiler, {"path": "/", "duration_ms": ms}) for ms in (5, 50, 20, 1)]
+
+            self.assertIsNone(ids[3])
+            self.assertEqual([p["duration_ms"] for p in store.list()], [50, 20])
+            self.assertIsNone(store.path(ids[0]))
+            self.assertTrue(store.path(ids[1]).endswith(".pstats"))
+            self.assertIsNone(store.path("../etc/passwd"))
+
+
+class TestSystemSampler(unittest.TestCase):
+
+    def test_ring_buffer_keeps_newest_samples(self):
+        sampler = SystemSampler(interval=5, history=15)
+        now = time.time()
+        samples = iter({"time": now - age, "cpu": float(age)} for age in (40, 30, 20, 10, 0))
+        with patch("ansiblePower.sample_system", side_effect=lambda: next(samples)):
+            for _ in range(5):
+                sampler._record()
+
+        self.assertEqual([s["cpu"] for s in sampler.window(3600)], [20.0, 10.0, 0.0])
+        self.assertEqual([s["cpu"] for s in sampler.window(15)], [10.0, 0.0])
+        self.assertEqual(sampler.latest()["cpu"], 0.0)
+
+    def test_latest_samples_immediately_when_empty(self):
+        with patch("ansiblePower.sample_system", return_value={"time": 1, "cpu": 3.0}) as sample:
+            self.assertEqual(SystemSampler().latest()["cpu"], 3.0)
+        sample.assert_called_once_with()
+
+    def test_only_ansible_playbook_children_are_counted(self):
+        script_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, script_dir, True)
+        children = []
+        # The app itself, e.g. a Gunicorn worker started from ansiblePower.py, must not count.
+        for name in ("ansible-playbook", "ansiblePower.py"):
+            path = os.path.join(script_dir, name)
+            with open(path, "w") as f:
+                f.write("import time\ntime.sleep(30)\n")
+            child = subprocess.Popen([sys.executable, path])
+            self.addCleanup(child.wait)
+            self.addCleanup(child.kill)
+            children.append((child, path))
+
+        deadline = time.monotonic() + 10
+        while any(psutil.Process(child.pid).cmdline()[1:2] != [path] for child, path in children):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+
+        self.assertEqual(_count_ansible_processes(), 1)
+
+
+class TestProcessStreaming(unittest.TestCase):
+
+    def test_failed_spawn_stops_usage_sampler(self):
+        usage = ProcessTreeUsage()
+        cmds = [[sys.executable, "-c", "import time; time.sleep(30)"],
+                [os.path.join(tempfile.gettempdir(), "no-such-ansible-playbook")]]
+
+        with self.assertRaises(FileNotFoundError):
+            _stream_processes(cmds, None, timeout=60, env={}, usage=usage)
+
+        self.assertIsNotNone(usage._thread)
+        self.assertFalse(usage._thread.is_alive())
+
+
+class TestServerSentEvents(unittest.TestCase):
+
+    def test_sse_event_splits_multiline_data(self):
+        self.assertEqual(
+            _sse_event("one\ntwo", event_id=8),
+            "id: 8\ndata: one\ndata: two\n\n",
+        )
+
+    def test_sse_event_named_event(self):
+        self.assertEqual(_sse_event("{}", event="done"), "event: done\ndata: {}\n\n")
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def test_yields_records_across_small_reads(self):
+        records = [{"output": "x" * 100, "n": i} for i in range(5)] + [12345, "s"]
+        stream = StringIO(" " + json.dumps(records) + "\n")
+        self.assertEqual(list(_iter_json_array(stream, read_size=7)), records)
+
+    def test_empty_array(self):
+        self.assertEqual(list(_iter_json_array(StringIO("[ ]"))), [])
+
+    def test_rejects_non_array_and_truncated_input(self):
+        with self.assertRaises(ValueError):
+            list(_iter_json_array(StringIO('{"a": 1}')))
+        with self.assertRaises(ValueError):
+            list(_iter_json_array(StringIO('[{"a": 1}, {"b"'), read_size=4))
+
+
+class TestPlaybookIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self._write("site.yml", "- name: Site\n  hosts: all\n")
+        self._write("web/deploy.yml", "---\n- name: Deploy\n  hosts: 'web:&prod'  # live\n  tasks: []\n")
+        self._write("web/tasks.yml", "- name: Install\n  apt: name=nginx\n")
+        self._write("roles/app/tasks/main.yml", "- hosts: all\n")
+        self._write(".git/hooks.yml", "- hosts: all\n")
+        self.index = PlaybookIndex()
+
+    def _write(self, rel, text):
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+
+    def _names(self):
+        self.index._checked = 0.0  # skip the refresh throttle
+        return [p["name"] for p in self.index.get(self.root)["playbooks"]]
+
+    def test_lists_nested_playbooks_only(self):
+        self.assertEqual(self._names(), ["site.yml", "web/deploy.yml"])
+        deploy = self.index.get(self.root)["playbooks"][1]
+        self.assertEqual((deploy["plays"], deploy["hosts"]), (["Deploy"], ["web:&prod"]))
+
+    def test_picks_up_new_and_removed_files(self):
+        self._names()
+        self._write("db/backup.yml", "- import_playbook: ../site.yml\n")
+        os.remove(os.path.join(self.root, "site.yml"))
+        self.assertEqual(self._names(), ["db/backup.yml", "web/deploy.yml"])
+
+    def test_snapshot_is_reused_between_checks(self):
+        first = self.index.get(self.root)
+        self._write("late.yml", "- hosts: all\n")
+        self.assertIs(self.index.get(self.root), first)
+
+    def test_missing_directory(self):
+        self.assertTrue(self.index.get(os.path.join(self.root, "nope"))["missing"])
+
+    def test_parse_playbook_summary_reads_top_level_keys_only(self):
+        text = "- name: A\n  vars:\n    name: inner\n    hosts: inner\n- hosts: \"db\"\n  name: B\n"
+        self.assertEqual(parse_playbook_summary(text), (["A", "B"], ["db"]))
+
+
+class TestFileContentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+
+    def _write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_unchanged_file_is_served_from_memory(self):
+        cache = FileContentCache()
+        path = self._write("a.yml", "one")
+        content, etag = cache.get(path)
+        with patch("builtins.open", side_effect=AssertionError("file re-read")):
+            self.assertEqual(cache.get(path), (content, etag))
+
+    def test_changed_file_gets_new_content_and_etag(self):
+        cache = FileContentCache()
+        path = self._write("a.yml", "one")
+        _, etag = cache.get(path)
+        self._write("a.yml", "two!")
+        content, new_etag = cache.get(path)
+        self.assertEqual(content, "two!")
+        self.assertNotEqual(etag, new_etag)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = FileContentCache(max_bytes=10)
+        a, b, c = (self._write(n, "12345") for n in ("a", "b", "c"))
+        cache.get(a)
+        cache.get(b)
+        cache.get(a)
+        cache.get(c)
+        self.assertEqual(list(cache._entries), [a, c])
+        self.assertEqual(cache._size, 10)
+
+    def test_files_over_budget_are_not_cached(self):
+        cache = FileContentCache(max_bytes=4)
+        self.assertEqual(cache.get(self._write("big", "123456"))[0], "123456")
+        self.assertEqual(len(cache._entries), 0)
+
+
+class TestInventory(unittest.TestCase):
+
+    INI = (
+        "lone ansible_host=10.0.0.1\n"
+        "[web]\n"
+        "web[01:03].example.com:2222 http_port=80\n"
+        "[db]\n"
+        "db-[a:b]\n"
+        "[prod:children]\n"
+        "web\n"
+        "db\n"
+        "[prod:vars]\n"
+        "env = prod\n"
+        "[canary]\n"
+        "web01.example.com\n"
+    )
+
+    def setUp(self):
+        self.inventory = parse_ini_inventory(self.INI)
+
+    def test_expand_host_range(self):
+        self.assertEqual(expand_host_range("h[08:10:2]"), ["h08", "h10"])
+        self.assertEqual(expand_host_range("r[a:b]-[1:2]"), ["ra-1", "ra-2", "rb-1", "rb-2"])
+        with self.assertRaises(InventoryError):
+            expand_host_range("h[1:z]")
+
+    def test_groups_children_and_vars(self):
+        inv = self.inventory
+        self.assertEqual(inv.group_hosts("prod"), [
+            "web01.example.com", "web02.example.com", "web03.example.com", "db-a", "db-b"])
+        self.assertEqual(inv.groups["prod"]["vars"], {"env": "prod"})
+        self.assertEqual(inv.hosts["web02.example.com"], {"http_port": "80", "ansible_port": "2222"})
+        self.assertEqual(inv.group_hosts("ungrouped"), ["lone"])
+
+    def test_hosts_in_other_groups_are_not_ungrouped(self):
+        inv = parse_ini_inventory("[ungrouped]\nweb1\nlone\n\n[web]\nweb1\n")
+        self.assertEqual(inv.group_hosts("ungrouped"), ["lone"])
+        self.assertEqual(inv.resolve("ungrouped"), ["lone"])
+
+    def test_resolve_patterns(self):
+        resolve = self.inventory.resolve
+        self.assertEqual(len(resolve("all")), 6)
+        self.assertEqual(resolve("prod:&canary"), ["web01.example.com"])
+        self.assertEqual(resolve("prod:!web"), ["db-a", "db-b"])
+        self.assertEqual(resolve("db-*,lone"), ["lone", "db-a", "db-b"])
+        self.assertEqual(resolve("~web0[23]"), ["web02.example.com", "web03.example.com"])
+        self.assertEqual(resolve("web[1:]"), ["web02.example.com", "web03.example.com"])
+        self.assertEqual(resolve("!db"), ["lone", "web01.example.com", "web02.example.com", "web03.example.com"])
+        self.assertEqual(resolve("missing"), [])
+
+    def test_invalid_inventories_are_rejected(self):
+        for text in ("[web\nhost", "[web:vars]\na=1\n", "[a:children]\nb\n[b:children]\na\n",
+                     "[web]\nhost novalue\n", "[web:extra]\n"):
+            with self.assertRaises(InventoryError, msg=text):
+                parse_ini_inventory(text)
+
+    def test_yaml_inventory(self):
+        inv = parse_inventory(
+            "all:\n  children:\n    web:\n      hosts:\n        w[1:2]:\n          port: 80\n"
+            "      vars:\n        env: prod\n", "hosts.yml"
+        )
+        self.assertEqual(inv.resolve("web"), ["w1", "w2"])
+        self.assertEqual(inv.groups["web"]["vars"], {"env": "prod"})
+
+    def test_yaml_inventory_without_pyyaml_names_the_package(self):
+        with patch("ansiblePower.yaml", None):
+            with self.assertRaisesRegex(RuntimeError, "pip install PyYAML"):
+                parse_inventory("all:\n  hosts:\n    h1:\n", "hosts.yml")
+
+
+class TestPerformanceProfiles(unittest.TestCase):
+
+    def test_profile_env(self):
+        env = _profile_env({"forks": 20, "pipelining": False, "strategy": "free",
+                            "ssh_control_persist": "5m", "control_path_dir": "/tmp/cp", "local_tmp": "/dev/shm/x"})
+        self.assertEqual(env["ANSIBLE_FORKS"], "20")
+        self.assertEqual(env["ANSIBLE_PIPELINING"], "False")
+        self.assertEqual(env["ANSIBLE_STRATEGY"], "free")
+        self.assertIn("ControlPersist=5m", env["ANSIBLE_SSH_ARGS"])
+        self.assertEqual(env["ANSIBLE_SSH_CONTROL_PATH_DIR"], "/tmp/cp")
+        self.assertEqual(env["ANSIBLE_LOCAL_TEMP"], "/dev/shm/x")
+        self.assertEqual(_profile_env({}), {})
+
+    def test_validate_performance_profile(self):
+        self.assertEqual(validate_performance_profile("p", {"forks": 5, "strategy": None}), {"forks": 5})
+        for name, profile in (("bad name", {}), ("p", {"forks": True}), ("p", {"pipelining": "yes"}),
+                              ("p", {"ssh_control_persist": "forever"}), ("p", {"strategy": "a b"})):
+            with self.assertRaises(ValueError):
+                validate_performance_profile(name, profile)
+
+
 class TestUpdatePlaybooksDirSecurity(unittest.TestCase):
     """Tests for the path traversal fix in update_playbooks_dir (issue 15.1)."""
 